@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import numpy as np
+from typing import List, Optional, Tuple
+
+# Rows scored per matrix product while training / assigning
+ASSIGN_CHUNK_SIZE = 65536
+
+INDEX_FORMAT_VERSION = 1
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Return the nearest (highest inner product) centroid for every row."""
+    assignments = np.empty(vectors.shape[0], dtype=np.int32)
+    for i in range(0, vectors.shape[0], ASSIGN_CHUNK_SIZE):
+        chunk = np.asarray(vectors[i:i+ASSIGN_CHUNK_SIZE], dtype=np.float32)
+        assignments[i:i+ASSIGN_CHUNK_SIZE] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 20,
+                     seed: int = 0) -> np.ndarray:
+    """
+    k-means on L2-normalized vectors using cosine similarity. Returns
+    normalized centroids of shape (n_clusters, dim).
+    """
+    rng = np.random.default_rng(seed)
+    centroids = np.array(vectors[rng.choice(vectors.shape[0], n_clusters, replace=False)], dtype=np.float32)
+
+    for _ in range(n_iter):
+        assignments = _assign(vectors, centroids)
+
+        # Sum each cluster's members with one reduceat over the sorted rows
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        used = np.nonzero(counts)[0]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[used]
+        sums[used] = np.add.reduceat(vectors[order], starts, axis=0)
+
+        # Re-seed empty clusters with random points so every list is used
+        empty = np.nonzero(counts == 0)[0]
+        if len(empty):
+            sums[empty] = vectors[rng.choice(vectors.shape[0], len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index with flat (uncompressed) lists.
+
+    Vectors are partitioned into n_lists clusters by spherical k-means. A
+    query scores the centroids, then only the vectors in the nprobe closest
+    lists. Larger nprobe means better recall and slower queries.
+
+    On disk the index is a directory of .npy files so it can be memory-mapped:
+        centroids.npy  (n_lists, dim) float32
+        offsets.npy    (n_lists + 1,) int64, list i is rows offsets[i]:offsets[i+1]
+        vectors.npy    (n, dim) float32, grouped by list
+        ids.npy        (n,) paper ids in the same order as vectors.npy
+        meta.json      format version, sizes and build time
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray,
+                 vectors: np.ndarray, ids: np.ndarray):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.ids = ids
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, ids: List[str], n_lists: Optional[int] = None,
+              n_iter: int = 20, sample_size: int = 200000, seed: int = 0) -> 'IVFFlatIndex':
+        """Build an index over L2-normalized vectors."""
+        n = vectors.shape[0]
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(n)))
+        n_lists = min(n_lists, n)
+
+        rng = np.random.default_rng(seed)
+        if n > sample_size:
+            sample = vectors[np.sort(rng.choice(n, sample_size, replace=False))]
+        else:
+            sample = vectors
+
+        start = time.time()
+        centroids = spherical_kmeans(np.asarray(sample, dtype=np.float32), n_lists, n_iter, seed)
+        print(f"Trained {n_lists} centroids on {sample.shape[0]} vectors in {time.time() - start:.1f}s")
+
+        assignments = _assign(vectors, centroids)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=n_lists)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(
+            centroids,
+            offsets,
+            np.ascontiguousarray(vectors[order], dtype=np.float32),
+            np.asarray(ids)[order]
+        )
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'centroids.npy'), self.centroids)
+        np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+        np.save(os.path.join(path, 'vectors.npy'), self.vectors)
+        np.save(os.path.join(path, 'ids.npy'), np.asarray(self.ids, dtype=str))
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({
+                "version": INDEX_FORMAT_VERSION,
+                "type": "ivf_flat",
+                "size": len(self),
+                "dim": int(self.centroids.shape[1]),
+                "n_lists": self.n_lists,
+                "built_at": time.strftime('%Y-%m-%d %H:%M:%S')
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'IVFFlatIndex':
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_FORMAT_VERSION or meta.get("type") != "ivf_flat":
+            raise ValueError(f"Unsupported index format in {path}: {meta}")
+
+        mmap_mode = 'r' if mmap else None
+        return cls(
+            np.load(os.path.join(path, 'centroids.npy')),
+            np.load(os.path.join(path, 'offsets.npy')),
+            np.load(os.path.join(path, 'vectors.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'ids.npy'), mmap_mode=mmap_mode)
+        )
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = 16) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k for a normalized query. Returns (positions, scores)
+        best first, where positions index into self.ids / self.vectors.
+        """
+        nprobe = max(1, min(nprobe, self.n_lists))
+        centroid_scores = self.centroids @ query
+        if nprobe < self.n_lists:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.n_lists)
+
+        positions = np.concatenate([
+            np.arange(self.offsets[i], self.offsets[i + 1]) for i in probe
+        ]) if len(probe) else np.zeros(0, dtype=np.int64)
+        if len(positions) == 0:
+            return positions, np.zeros(0, dtype=np.float32)
+
+        # Probed lists are contiguous slices, so gather them list by list
+        scores = np.concatenate([
+            np.asarray(self.vectors[self.offsets[i]:self.offsets[i + 1]]) @ query for i in probe
+        ])
+
+        k = min(k, len(positions))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(positions) else np.arange(len(positions))
+        top = top[np.argsort(-scores[top])]
+        return positions[top], scores[top]
@@ -1,15 +1,19 @@
 import os
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import sqlite3
-import json
 import urllib.request as libreq
 import xml.etree.ElementTree as ET
 from datetime import datetime
 import time
 import re
-from get_connections import main as get_paper_connections
-from embed import fuzzy_search_related_papers, fuzzy_search_get_all_related_papers
+from get_connections import main as get_paper_connections, ensure_citations_table, get_connections_cache, MAX_DEGREE, MAX_GRAPH_NODES
+from embed import fuzzy_search_top_k, related_papers_top_k_batch, get_query_cache_stats, paper_similarities, get_papers_by_ids
+from graph_ranking import get_graph_ranker
+from graph_payload import build_graph_payload, prune_connections, DEFAULT_PAYLOAD_NODES, RANKINGS
+from paper_search import (search_papers as search_paper_index, find_paper_id, ensure_papers_fts,
+                          ensure_paper_categories, index_paper_categories, search_category, CATEGORY_PAGE_SIZE)
+from hybrid_search import hybrid_search, HYBRID_CANDIDATES
+from db import get_connection
 
 app = Flask(__name__)
 # Use CORS with explicit settings for compatibility
@@ -20,11 +24,16 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'papers.db')
 CSV_PATH = os.path.join(BASE_DIR, 'arxiv_ripper', 'arxiv_cs_recent.csv')
 
+# Number of nearest neighbours fetched before sort_core_papers picks its 5
+HOT_PAPER_CANDIDATES = 10
+# Embedding neighbours pooled with graph neighbours when ranking core papers
+CORE_PAPER_CANDIDATES = 20
+
 # Helper function to add paper to embeddings directly from API
 def add_paper_to_embeddings_local(paper):
     """Direct implementation to add paper to embeddings database without importing from embed.py"""
     try:
-        from embed import generate_embeddings, setup_embeddings_database, EMBEDDINGS_DB_PATH
+        from embed import generate_embeddings, setup_embeddings_database, get_store, abstract_hash, EMBEDDINGS_DB_PATH
         
         # Make sure database is set up
         setup_embeddings_database()
@@ -42,27 +51,28 @@ def add_paper_to_embeddings_local(paper):
             return False
         
         # Store in database
-        conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
-        cursor = conn.cursor()
+        conn = get_connection(EMBEDDINGS_DB_PATH)
         
         embedding_blob = embeddings[0].tobytes()
         
-        cursor.execute('''
-        INSERT OR REPLACE INTO paper_embeddings
-        (id, title, abstract, embedding, authors, categories, year)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            paper['id'],
-            paper['title'],
-            paper['abstract'],
-            embedding_blob,
-            paper.get('authors', ''),
-            paper.get('categories', ''),
-            paper.get('year', 0)
-        ))
-        
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute('''
+            INSERT OR REPLACE INTO paper_embeddings
+            (id, title, abstract, embedding, authors, categories, year, abstract_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                paper['id'],
+                paper['title'],
+                paper['abstract'],
+                embedding_blob,
+                paper.get('authors', ''),
+                paper.get('categories', ''),
+                paper.get('year', 0),
+                abstract_hash(paper['abstract'])
+            ))
+        
+        # Keep the in-memory vector store in sync with the new row
+        get_store().upsert(paper['id'], embeddings[0], paper.get('year'), paper.get('categories'))
         
         print(f"Successfully added paper {paper['id']} to embeddings database")
         return True
@@ -154,35 +164,34 @@ def fetch_arxiv_paper(paper_id):
 def add_paper_to_db(paper):
     """Add paper to the papers database."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        ensure_paper_categories(DB_PATH)
+        conn = get_connection(DB_PATH)
+        
+        # Insert the paper and its category rows in one transaction
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO papers (
+                    id, title, authors, abstract, categories, 
+                    connected_papers, year, month, day
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                paper["id"],
+                paper["title"],
+                paper["authors"],
+                paper["abstract"],
+                paper["categories"],
+                paper["connected_papers"],
+                paper["year"],
+                paper["month"],
+                paper["day"]
+            ))
+            index_paper_categories(conn, [(paper["id"], paper["categories"], paper["year"], paper["month"], paper["day"])])
         
-        # Insert the paper into the database
-        cursor.execute("""
-            INSERT OR REPLACE INTO papers (
-                id, title, authors, abstract, categories, 
-                connected_papers, year, month, day
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            paper["id"],
-            paper["title"],
-            paper["authors"],
-            paper["abstract"],
-            paper["categories"],
-            paper["connected_papers"],
-            paper["year"],
-            paper["month"],
-            paper["day"]
-        ))
-        
-        conn.commit()
         print(f"Successfully added paper {paper['id']} to database")
         return True
     except Exception as e:
         print(f"Error adding paper to database: {str(e)}")
         return False
-    finally:
-        conn.close()
 
 
 def sort_core_papers(title, papers, current_id=None):
@@ -232,6 +241,41 @@ def sort_core_papers(title, papers, current_id=None):
 
     return results
 
+def rank_core_papers(paper_id, title, candidates, k=5):
+    """
+    Top k papers around paper_id by the combined graph + cosine score. The
+    pool is the embedding neighbours already found for paper_id plus its
+    citation neighbourhood (citations, co-citation, coupling).
+    """
+    ranker = get_graph_ranker(DB_PATH)
+    proximity = ranker.proximity(paper_id)
+    
+    similarities = {paper['id']: paper['similarity'] for paper in candidates}
+    similarities.update(paper_similarities(paper_id, [p for p in proximity if p not in similarities]))
+    ranked = ranker.combined_scores(paper_id, similarities, proximity)
+    
+    papers = {paper['id']: paper for paper in candidates}
+    papers.update(get_papers_by_ids([p for p, _ in ranked if p not in papers]))
+    
+    results = []
+    for ranked_id, score in ranked:
+        paper = papers.get(ranked_id)
+        if paper is None or (title and paper.get('title') == title):
+            continue
+        results.append({
+            "id": paper["id"],
+            "title": paper["title"],
+            "abstract": paper.get("abstract", ""),
+            "categories": paper.get("categories", ""),
+            "authors": paper.get("authors", ""),
+            "similarity": similarities[ranked_id],
+            "score": score
+        })
+        if len(results) >= k:
+            break
+    
+    return results
+
 @app.route('/api/search', methods=['GET'])
 def search_papers():
     query = request.args.get('q')
@@ -242,111 +286,53 @@ def search_papers():
         return jsonify({"success": False, "error": "No query provided"}), 400
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
+        # Ids via the primary key, text via the FTS index ranked by BM25
         print(f"DEBUG: Searching database for: {query}")
-        cursor.execute("""
-            SELECT id, title, authors, abstract, categories, year, month, day
-            FROM papers 
-            WHERE title LIKE ? OR authors LIKE ? OR id LIKE ?
-            LIMIT 20
-        """, (f"%{query}%", f"%{query}%", f"%{query}%"))
+        rows = search_paper_index(query, 20, DB_PATH)
+        
+        # Find every matched paper's neighbours in one batched pass, reusing stored embeddings
+        try:
+            hot_candidates = related_papers_top_k_batch(
+                [{"id": row[0], "abstract": row[3]} for row in rows],
+                CORE_PAPER_CANDIDATES,
+                exclude_ids=[{row[0]} for row in rows]
+            )
+        except Exception as e:
+            print(f"DEBUG: Error getting hot papers: {str(e)}")
+            hot_candidates = [[] for _ in rows]
         
         results = []
-        for row in cursor.fetchall():
+        for row, candidates in zip(rows, hot_candidates):
             print(f"DEBUG: Found paper: {row[0]}")
             connections = flask_get_connections(row[0], 1)
             connections_data = connections.get_json()
             
-            # Get embedding-based related papers
-            print(f"DEBUG: Getting embedding-based related papers for {row[0]}")
             current_paper_id = row[0]
-            current_paper_title = row[1]
-            
-            # Safely get related papers with error handling
-            try:
-                hot_papers = fuzzy_search_get_all_related_papers(row[3] or "")
-                hot_papers = sort_core_papers(current_paper_title, hot_papers, current_paper_id)
-                print(f"DEBUG: Found {len(hot_papers)} hot papers for {current_paper_id}")
-            except Exception as e:
-                print(f"DEBUG: Error getting hot papers: {str(e)}")
-                hot_papers = []
+            hot_papers = sort_core_papers(row[1], candidates[:HOT_PAPER_CANDIDATES], current_paper_id)
+            print(f"DEBUG: Found {len(hot_papers)} hot papers for {current_paper_id}")
 
             # Add embedding-based connections to the connections data structure
-            if connections_data and "first_degree" in connections_data:
+            if connections_data and "first_degree" in connections_data and "connections" in connections_data["first_degree"]:
                 print(f"DEBUG: Adding embedding-based connections for {row[0]}")
-                # Track how many we've added
-                added_count = 0
+                existing = connections_data["first_degree"]["connections"]
+                existing_ids = {item.get('id') if isinstance(item, dict) else item for item in existing}
+                existing_ids.add(current_paper_id)
                 
-                for i, hot_paper in enumerate(hot_papers):
-                    # Skip if it's the same paper
-                    if hot_paper['id'] == current_paper_id:
+                # Add the hot papers (at most 5) that are not already connected
+                for hot_paper in hot_papers:
+                    if hot_paper['id'] in existing_ids:
                         continue
-                        
-                    # Check if this hot paper is already in the connections
-                    already_exists = False
-                    if connections_data["first_degree"] and "connections" in connections_data["first_degree"]:
-                        already_exists = any(
-                            (isinstance(conn, dict) and conn.get('id') == hot_paper['id']) or
-                            (isinstance(conn, str) and conn == hot_paper['id'])
-                            for conn in connections_data["first_degree"]["connections"]
-                        )
-                    
-                    # Add to connections if not already there
-                    if not already_exists and connections_data["first_degree"] and "connections" in connections_data["first_degree"]:
-                        print(f"DEBUG: Adding embedding connection: {hot_paper['id']}")
-                        connections_data["first_degree"]["connections"].append({
-                            "id": hot_paper['id'],
-                            "title": hot_paper['title'],
-                            "similarity": hot_paper['similarity']  # Use the actual similarity score
-                        })
-                        
-                        # Increment counter and break if we've added 5
-                        added_count += 1
-                        if added_count >= 5:
-                            print(f"DEBUG: Added top 5 embedding-based connections for {row[0]}")
-                            break
+                    print(f"DEBUG: Adding embedding connection: {hot_paper['id']}")
+                    existing.append({
+                        "id": hot_paper['id'],
+                        "title": hot_paper['title'],
+                        "similarity": hot_paper['similarity']  # Use the actual similarity score
+                    })
+                    existing_ids.add(hot_paper['id'])
 
-            # Generate core papers with better error handling
-            core_papers = []
+            # Core papers: one ranked lookup blending citation structure with similarity
             try:
-                # First, get papers related to each hot paper
-                processed_hot_papers = []
-                # Make a copy of hot_papers to avoid modifying the original during iteration
-                for paper in hot_papers[:10]:  # Limit to first 10 hot papers for efficiency
-                    # Skip papers without abstracts
-                    if not paper.get('abstract'):
-                        continue
-                        
-                    try:
-                        paper_temp = fuzzy_search_get_all_related_papers(paper['abstract'])
-                        # Filter out duplicates and the current paper
-                        paper_temp = sort_core_papers(paper['title'], paper_temp, current_paper_id)
-                        if paper_temp and len(paper_temp) > 0:
-                            processed_hot_papers.append(paper_temp[0])
-                    except Exception as inner_e:
-                        print(f"DEBUG: Error processing hot paper {paper.get('id')}: {str(inner_e)}")
-                        continue
-                
-                # Filter out duplicates and ensure we don't include the original paper
-                seen_ids = {current_paper_id}
-                for paper in processed_hot_papers:
-                    if paper['id'] not in seen_ids:
-                        seen_ids.add(paper['id'])
-                        core_papers.append(paper)
-                        if len(core_papers) >= 5:
-                            break
-                
-                # If we don't have 5 core papers yet, add more from hot papers
-                if len(core_papers) < 5:
-                    for paper in hot_papers:
-                        if paper['id'] not in seen_ids:
-                            seen_ids.add(paper['id'])
-                            core_papers.append(paper)
-                            if len(core_papers) >= 5:
-                                break
-                
+                core_papers = rank_core_papers(current_paper_id, row[1], candidates)
                 print(f"DEBUG: Created {len(core_papers)} core papers for {current_paper_id}")
             except Exception as core_e:
                 print(f"DEBUG: Error generating core papers: {str(core_e)}")
@@ -379,8 +365,6 @@ def search_papers():
             "success": False,
             "error": str(e)
         }), 500
-    finally:
-        conn.close()
 
 @app.route('/api/topic-search', methods=['GET'])
 def search_by_topic():
@@ -392,9 +376,13 @@ def search_by_topic():
         return jsonify({"success": False, "error": "No topic provided"}), 400
     
     try:
+        # Optional filters: ?year_min=2020&year_max=2023&category=cs.LG
+        year_range = (request.args.get('year_min', type=int), request.args.get('year_max', type=int))
+        categories = request.args.getlist('category')
+        
         # Use the existing embedding-based search function to find papers related to the topic
         print(f"DEBUG: Searching embeddings for: {query}")
-        related_papers = fuzzy_search_related_papers(query, top_n=20)
+        related_papers = fuzzy_search_top_k(query, 20, year_range=year_range, categories=categories)
         print(f"DEBUG: Found {len(related_papers)} related papers")
         
         # Format the results - LIGHTWEIGHT VERSION (no connections fetch)
@@ -423,14 +411,48 @@ def search_by_topic():
             "error": str(e)
         }), 500
 
+@app.route('/api/hybrid-search', methods=['GET'])
+def search_hybrid():
+    """
+    Full-text and embedding search fused with reciprocal rank fusion.
+    Optional filters: ?year_min=&year_max=&category= (repeatable); ?k= results.
+    """
+    query = request.args.get('q')
+    print(f"DEBUG: /api/hybrid-search received query: {query}")
+    
+    if not query:
+        return jsonify({"success": False, "error": "No query provided"}), 400
+    
+    try:
+        k = max(1, min(request.args.get('k', 20, type=int), HYBRID_CANDIDATES))
+        year_range = (request.args.get('year_min', type=int), request.args.get('year_max', type=int))
+        categories = request.args.getlist('category')
+        
+        response = hybrid_search(query, k, year_range, categories, db_path=DB_PATH)
+        print(f"DEBUG: Returning {len(response['results'])} hybrid results in {response['timings']['total_ms']}ms")
+        return jsonify({"success": True, **response})
+    except Exception as e:
+        print(f"DEBUG: Error in /api/hybrid-search: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "success": True,
+        "query_embedding_cache": get_query_cache_stats(),
+        "connections_cache": get_connections_cache(DB_PATH).stats()
+    })
+
 @app.route('/api/paper/<paper_id>', methods=['GET'])
 def get_paper(paper_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = get_connection(DB_PATH).cursor()
         
         cursor.execute("""
-            SELECT id, title, authors, abstract, categories, year, connected_papers 
+            SELECT id, title, authors, abstract, categories, year
             FROM papers WHERE id = ?
         """, (paper_id,))
         
@@ -439,19 +461,21 @@ def get_paper(paper_id):
             print(f"Paper {paper_id} not found in database")
             return jsonify({"success": False, "error": f"Paper with ID {paper_id} not found in database"}), 404
             
-        # Get connected papers details
-        connected = []
-        if paper[6]:
-            try:
-                connected_ids = json.loads(paper[6])
-                placeholders = ','.join(['?']*len(connected_ids))
-                cursor.execute(f"""
-                    SELECT id, title FROM papers 
-                    WHERE id IN ({placeholders})
-                """, connected_ids)
-                connected = [{"id": row[0], "title": row[1]} for row in cursor.fetchall()]
-            except json.JSONDecodeError:
-                pass
+        # Get connected papers details in both directions from the citations table
+        ensure_citations_table(DB_PATH)
+        cursor.execute("""
+            SELECT p.id, p.title FROM citations c
+            JOIN papers p ON p.id = c.dst
+            WHERE c.src = ?
+        """, (paper_id,))
+        connected = [{"id": row[0], "title": row[1]} for row in cursor.fetchall()]
+        
+        cursor.execute("""
+            SELECT p.id, p.title FROM citations c
+            JOIN papers p ON p.id = c.src
+            WHERE c.dst = ?
+        """, (paper_id,))
+        cited_by = [{"id": row[0], "title": row[1]} for row in cursor.fetchall()]
                 
         return jsonify({
             "success": True,
@@ -461,36 +485,22 @@ def get_paper(paper_id):
             "abstract": paper[3],
             "categories": paper[4],
             "year": paper[5],
-            "connected_papers": connected
+            "connected_papers": connected,
+            "cited_by": cited_by
         })
     except Exception as e:
         print(f"Error in /api/paper: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/connections/<paper_info>/<degree_checked>', methods=['GET'])
 def flask_get_connections(paper_info, degree_checked):
     print(f"DEBUG: /api/connections received request for {paper_info}, degree {degree_checked}")
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
         # in case user queries by paper title
-        search_query = f"%{paper_info}%"
-        cursor.execute("""
-            SELECT *
-            FROM papers 
-            WHERE title LIKE ? OR id LIKE ?
-            LIMIT 1
-        """, (search_query, search_query))
-        
-        results = cursor.fetchall()
-        paper_id = None
+        paper_id = find_paper_id(paper_info, DB_PATH)
         
-        if results and len(results) > 0:
-            paper_id = results[0][0]
+        if paper_id:
             print(f"DEBUG: Found paper by search: {paper_id}")
         else:
             # If no results found, the paper_info might be an exact paper_id
@@ -501,7 +511,15 @@ def flask_get_connections(paper_info, degree_checked):
         if not paper_id:
             return jsonify({"success": False, "error": "Paper not found"}), 404
             
-        connections = get_paper_connections(paper_id)
+        # Only expand as many hops as were asked for; deeper hops are
+        # requested separately when the user enables them
+        try:
+            degree = max(1, min(int(degree_checked), MAX_DEGREE))
+        except (TypeError, ValueError):
+            degree = 1
+        max_nodes = request.args.get('max_nodes', MAX_GRAPH_NODES, type=int)
+        
+        connections = get_paper_connections(paper_id, degree, max_nodes)
         
         if not connections or "first_degree" not in connections:
             print(f"DEBUG: No connections found for {paper_id}")
@@ -512,15 +530,43 @@ def flask_get_connections(paper_info, degree_checked):
                     "connections": []
                 }
             })
+        
+        # Keep the best ?budget= nodes and send their titles inline
+        budget = request.args.get('budget', DEFAULT_PAYLOAD_NODES, type=int)
+        rank = request.args.get('rank', 'degree')
+        connections = prune_connections(connections, budget, rank, DB_PATH, paper_similarities)
             
         print(f"DEBUG: Returning connections for {paper_id}")
         return jsonify(connections)
     except Exception as e:
         print(f"DEBUG: Error in /api/connections: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
-    finally:
-        if 'conn' in locals():
-            conn.close()
+
+@app.route('/api/graph/<paper_id>', methods=['GET'])
+def get_graph_payload(paper_id):
+    """
+    Bounded graph around a paper: ?degree=1..3, ?budget= nodes per page,
+    ?rank=degree|pagerank|similarity, ?offset= for the next page (see
+    next_offset), ?expand=<id> to get the first-degree graph of one node.
+    """
+    try:
+        degree = max(1, min(request.args.get('degree', 1, type=int), MAX_DEGREE))
+        budget = request.args.get('budget', DEFAULT_PAYLOAD_NODES, type=int)
+        offset = max(0, request.args.get('offset', 0, type=int))
+        rank = request.args.get('rank', 'degree')
+        if rank not in RANKINGS:
+            return jsonify({"success": False, "error": f"rank must be one of {', '.join(RANKINGS)}"}), 400
+        
+        expand = request.args.get('expand')
+        if expand:
+            paper_id, degree = expand, 1
+        
+        connections = get_paper_connections(paper_id, degree, MAX_GRAPH_NODES)
+        payload = build_graph_payload(connections, budget, rank, offset, DB_PATH, paper_similarities)
+        return jsonify({"success": True, **payload})
+    except Exception as e:
+        print(f"DEBUG: Error in /api/graph: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/update', methods=['POST'])
 def update_database():
@@ -528,9 +574,16 @@ def update_database():
         from arxiv_ripper.arxiv_ripper import main as update_arxiv
         from arxiv_ripper.upload_csv import upload_csv_to_db
         
+        from embed import update_embeddings_incremental
+        
         update_arxiv()
         upload_csv_to_db(CSV_PATH, DB_PATH)
-        return jsonify({"status": "success"})
+        
+        # Embed only the papers that are new or changed; ?embeddings=0 skips this step
+        embeddings = None
+        if request.args.get('embeddings', '1') != '0':
+            embeddings = update_embeddings_incremental()
+        return jsonify({"status": "success", "embeddings": embeddings})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -544,47 +597,29 @@ def search_by_category():
         return jsonify({"success": False, "error": "No category provided"}), 400
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         # Normalize the category format (handle both CS.LG and cs.lg formats)
         normalized_category = category.upper()
         if not normalized_category.startswith("CS."):
             normalized_category = "CS." + normalized_category
         
-        print(f"DEBUG: Searching database for category: {normalized_category}")
+        # ?limit= papers per page; ?cursor= is next_cursor from the previous page
+        limit = max(1, min(request.args.get('limit', CATEGORY_PAGE_SIZE, type=int), 100))
+        cursor = request.args.get('cursor')
         
-        # Query the database for papers with exact category match
-        # Categories are stored as comma-separated strings like "CS.CL, CS.AI"
-        cursor.execute("""
-            SELECT id, title, authors, year, month, day, categories
-            FROM papers 
-            WHERE categories LIKE ? OR categories LIKE ? OR categories LIKE ? OR categories = ?
-            ORDER BY year DESC, month DESC, day DESC
-            LIMIT 20
-        """, (
-            f"{normalized_category},%",  # Category at the start
-            f"%, {normalized_category},%",  # Category in the middle
-            f"%, {normalized_category}",  # Category at the end
-            normalized_category,  # Category as the only value
-        ))
+        print(f"DEBUG: Searching database for category: {normalized_category}")
+        try:
+            rows, next_cursor = search_category(normalized_category, limit, cursor, DB_PATH)
+        except ValueError:
+            return jsonify({"success": False, "error": "Invalid cursor"}), 400
         
         results = []
-        rows = cursor.fetchall()
-        
         for row in rows:
-            # Additional check to ensure we have exact category match
-            categories = row["categories"].split(", ") if row["categories"] else []
-            if normalized_category not in [cat.strip().upper() for cat in categories]:
-                continue
-                
             paper = {
-                "id": row["id"],
-                "title": row["title"].strip(),
-                "authors": row["authors"],
-                "year": row["year"],
-                "categories": row["categories"]
+                "id": row[0],
+                "title": row[1].strip(),
+                "authors": row[2],
+                "year": row[3],
+                "categories": row[6]
             }
             results.append(paper)
         
@@ -592,7 +627,8 @@ def search_by_category():
         return jsonify({
             "success": True,
             "category": normalized_category,
-            "results": results
+            "results": results,
+            "next_cursor": next_cursor
         })
         
     except Exception as e:
@@ -601,8 +637,9 @@ def search_by_category():
             "success": False,
             "error": str(e)
         }), 500
-    finally:
-        conn.close()
 
 if __name__ == '__main__':
+    # Build the full-text and category indexes before serving if this database has none yet
+    ensure_papers_fts(DB_PATH)
+    ensure_paper_categories(DB_PATH)
     app.run(debug=True, port=8080)
\ No newline at end of file
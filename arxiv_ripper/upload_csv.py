@@ -1,7 +1,13 @@
+import os
+import sys
 import sqlite3
 import csv
 from pathlib import Path
 
+# Also run as "python3 arxiv_ripper/upload_csv.py" from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from paper_search import ensure_paper_categories, index_paper_categories
+
 def upload_csv_to_db(csv_file_path, db_file='papers.db', batch_size=1000):
     """
     Upload CSV data to SQLite database with batching for efficiency.
@@ -12,6 +18,7 @@ def upload_csv_to_db(csv_file_path, db_file='papers.db', batch_size=1000):
         batch_size (int): Number of records to insert in each batch
     """    
     # Connect to the SQLite database
+    ensure_paper_categories(db_file)
     conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
     
@@ -57,6 +64,7 @@ def upload_csv_to_db(csv_file_path, db_file='papers.db', batch_size=1000):
                 # Execute when batch size is reached
                 if len(batch) >= batch_size:
                     cursor.executemany(insert_sql, batch)
+                    index_paper_categories(cursor, [(d[0], d[4], d[7], d[8], d[9]) for d in batch])
                     conn.commit()
                     total_records += len(batch)
                     print(f"Inserted {total_records} records so far...")
@@ -65,6 +73,7 @@ def upload_csv_to_db(csv_file_path, db_file='papers.db', batch_size=1000):
             # Insert any remaining records in the final batch
             if batch:
                 cursor.executemany(insert_sql, batch)
+                index_paper_categories(cursor, [(d[0], d[4], d[7], d[8], d[9]) for d in batch])
                 conn.commit()
                 total_records += len(batch)
             
@@ -0,0 +1,359 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from db import connect
+
+# Next to the code rather than the working directory, so the crawler and the
+# server always save and load the same copy
+GRAPH_PATH = os.environ.get('PAPERWEB_GRAPH_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'citation_graph'))
+
+GRAPH_FORMAT_VERSION = 1
+
+# Seconds between checks for edges written by other processes (server
+# workers, the crawler); see sync_citation_graph()
+SYNC_INTERVAL = float(os.environ.get('PAPERWEB_SYNC_INTERVAL', '30'))
+# Extractions stamped this long before the previous check are read again,
+# since updated_at is taken before the writing transaction commits
+SYNC_OVERLAP = 60.0
+
+
+def _build_csr(src: np.ndarray, dst: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Compressed sparse row arrays for edges src[i] -> dst[i] over n nodes."""
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst[order].astype(np.int32)
+
+
+def _gather(indptr: np.ndarray, indices: np.ndarray, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    All CSR neighbours of nodes in one vectorized pass. Returns (sources,
+    neighbours) where sources[i] is the node whose edge led to neighbours[i].
+    """
+    nodes = nodes[nodes < len(indptr) - 1]
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Position of every edge: its row's start plus its offset within the row
+    row_offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    positions = row_offsets + np.arange(total)
+    return np.repeat(nodes, lengths), indices[positions].astype(np.int64)
+
+
+class CitationGraph:
+    """
+    In-memory citation graph in compressed sparse row form.
+
+    Papers are numbered 0..n-1 (ids[i] / id_to_index). Out-edges of node i
+    (papers it cites) are indices[indptr[i]:indptr[i+1]]; rev_indptr /
+    rev_indices hold the reverse edges (papers citing it). Edges added after
+    the arrays were built are kept in small per-node delta sets until the next
+    rebuild, so the CSR arrays themselves are never modified and can be
+    memory-mapped read-only.
+    """
+
+    def __init__(self, ids: List[str], indptr: np.ndarray, indices: np.ndarray,
+                 rev_indptr: np.ndarray, rev_indices: np.ndarray, n_edges: int):
+        self.ids = list(ids)
+        self.id_to_index = {paper_id: i for i, paper_id in enumerate(self.ids)}
+        self.indptr = indptr
+        self.indices = indices
+        self.rev_indptr = rev_indptr
+        self.rev_indices = rev_indices
+        self.n_edges = n_edges
+        self.delta_out: Dict[int, set] = {}
+        self.delta_in: Dict[int, set] = {}
+        self.lock = threading.RLock()
+        # time.time() of the last sync_citation_graph() check
+        self.synced_at = time.time()
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build_from_db(cls, db_path: str) -> 'CitationGraph':
+        start = time.time()
+        conn = connect(db_path)
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("SELECT id FROM papers ORDER BY id")
+            ids = [row[0] for row in cursor.fetchall()]
+            id_to_index = {paper_id: i for i, paper_id in enumerate(ids)}
+
+            cursor.execute("SELECT src, dst FROM citations")
+            src = []
+            dst = []
+            while True:
+                rows = cursor.fetchmany(100000)
+                if not rows:
+                    break
+                for s, d in rows:
+                    # Edge endpoints are normally papers, but keep any that are not
+                    for paper_id in (s, d):
+                        if paper_id not in id_to_index:
+                            id_to_index[paper_id] = len(ids)
+                            ids.append(paper_id)
+                    src.append(id_to_index[s])
+                    dst.append(id_to_index[d])
+        finally:
+            conn.close()
+
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        indptr, indices = _build_csr(src, dst, len(ids))
+        rev_indptr, rev_indices = _build_csr(dst, src, len(ids))
+
+        print(f"Built citation graph with {len(ids)} papers and {len(src)} edges in {time.time() - start:.1f}s")
+        return cls(ids, indptr, indices, rev_indptr, rev_indices, len(src))
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'ids.npy'), np.asarray(self.ids, dtype=str))
+        np.save(os.path.join(path, 'indptr.npy'), self.indptr)
+        np.save(os.path.join(path, 'indices.npy'), self.indices)
+        np.save(os.path.join(path, 'rev_indptr.npy'), self.rev_indptr)
+        np.save(os.path.join(path, 'rev_indices.npy'), self.rev_indices)
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({
+                "version": GRAPH_FORMAT_VERSION,
+                "nodes": self.n_nodes,
+                "edges": self.n_edges,
+                "built_at": time.strftime('%Y-%m-%d %H:%M:%S')
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'CitationGraph':
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get("version") != GRAPH_FORMAT_VERSION:
+            raise ValueError(f"Unsupported graph format in {path}: {meta}")
+
+        mmap_mode = 'r' if mmap else None
+        return cls(
+            np.load(os.path.join(path, 'ids.npy')).tolist(),
+            np.load(os.path.join(path, 'indptr.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'indices.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'rev_indptr.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'rev_indices.npy'), mmap_mode=mmap_mode),
+            meta["edges"]
+        )
+
+    def _index(self, paper_id: str, create: bool = False) -> Optional[int]:
+        index = self.id_to_index.get(paper_id)
+        if index is None and create:
+            index = len(self.ids)
+            self.ids.append(paper_id)
+            self.id_to_index[paper_id] = index
+        return index
+
+    def add_edges(self, src_id: str, dst_ids: List[str]):
+        """Apply edges written after the graph was built."""
+        with self.lock:
+            src = self._index(src_id, create=True)
+            for dst_id in dst_ids:
+                dst = self._index(dst_id, create=True)
+                if dst in self.delta_out.get(src, ()) or dst in self._csr_row(self.indptr, self.indices, src):
+                    continue
+                self.delta_out.setdefault(src, set()).add(dst)
+                self.delta_in.setdefault(dst, set()).add(src)
+                self.n_edges += 1
+
+    @staticmethod
+    def _csr_row(indptr: np.ndarray, indices: np.ndarray, node: int) -> np.ndarray:
+        if node >= len(indptr) - 1:
+            return np.zeros(0, dtype=indices.dtype)
+        return indices[indptr[node]:indptr[node + 1]]
+
+    def _expand(self, nodes: np.ndarray, reverse: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """(sources, neighbours) over CSR edges plus any delta edges."""
+        indptr, indices = (self.rev_indptr, self.rev_indices) if reverse else (self.indptr, self.indices)
+        delta = self.delta_in if reverse else self.delta_out
+
+        sources, neighbours = _gather(indptr, indices, nodes)
+        if delta:
+            extra = [(node, other) for node in nodes.tolist() for other in delta.get(node, ())]
+            if extra:
+                extra = np.asarray(extra, dtype=np.int64)
+                sources = np.concatenate([sources, extra[:, 0]])
+                neighbours = np.concatenate([neighbours, extra[:, 1]])
+        return sources, neighbours
+
+    def neighbors(self, paper_id: str, reverse: bool = False) -> List[str]:
+        """Papers cited by paper_id (or citing it, if reverse)."""
+        return self.neighbors_many([paper_id], reverse).get(paper_id, [])
+
+    def neighbors_many(self, paper_ids: List[str], reverse: bool = False) -> Dict[str, List[str]]:
+        """{paper_id: [neighbour ids]} for every paper that has at least one neighbour."""
+        nodes = np.asarray([i for i in (self.id_to_index.get(p) for p in paper_ids) if i is not None], dtype=np.int64)
+        with self.lock:
+            sources, neighbours = self._expand(nodes, reverse)
+
+        result: Dict[str, List[str]] = {}
+        for source, neighbour in zip(sources.tolist(), neighbours.tolist()):
+            result.setdefault(self.ids[source], []).append(self.ids[neighbour])
+        return result
+
+    def k_hop(self, paper_id: str, k: int, reverse: bool = False,
+              max_nodes: Optional[int] = None) -> List[np.ndarray]:
+        """
+        Breadth-first k-hop neighbourhood as node indices, one array per hop
+        (hop 1 first). Each node appears at the first hop that reaches it.
+        Stops early once max_nodes nodes have been reached.
+        """
+        start = self.id_to_index.get(paper_id)
+        if start is None:
+            return []
+
+        visited = np.zeros(self.n_nodes, dtype=bool)
+        visited[start] = True
+        frontier = np.asarray([start], dtype=np.int64)
+        hops = []
+        reached = 0
+
+        with self.lock:
+            for _ in range(k):
+                _, neighbours = self._expand(frontier, reverse)
+                neighbours = np.unique(neighbours)
+                neighbours = neighbours[~visited[neighbours]]
+                if max_nodes is not None and reached + len(neighbours) > max_nodes:
+                    neighbours = neighbours[:max(0, max_nodes - reached)]
+                if len(neighbours) == 0:
+                    break
+                visited[neighbours] = True
+                hops.append(neighbours)
+                reached += len(neighbours)
+                frontier = neighbours
+
+        return hops
+
+    def out_degree(self) -> np.ndarray:
+        """Number of references of every node."""
+        degree = np.zeros(self.n_nodes, dtype=np.int64)
+        csr_nodes = len(self.indptr) - 1
+        degree[:csr_nodes] = np.diff(self.indptr)
+        for node, targets in self.delta_out.items():
+            degree[node] += len(targets)
+        return degree
+
+    def in_degree(self) -> np.ndarray:
+        """Number of citations of every node."""
+        degree = np.zeros(self.n_nodes, dtype=np.int64)
+        csr_nodes = len(self.rev_indptr) - 1
+        degree[:csr_nodes] = np.diff(self.rev_indptr)
+        for node, sources in self.delta_in.items():
+            degree[node] += len(sources)
+        return degree
+
+
+_graphs: Dict[str, CitationGraph] = {}
+_graphs_lock = threading.Lock()
+
+
+def count_citations(db_path: str) -> int:
+    conn = connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM citations").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def get_citation_graph(db_path: str = 'papers.db', path: str = GRAPH_PATH) -> CitationGraph:
+    """
+    Process-wide graph for db_path. Loaded (memory-mapped) from path when the
+    saved copy has the same number of edges as the citations table, otherwise
+    rebuilt from the database and saved. An already loaded graph first picks
+    up edges other processes have written (sync_citation_graph).
+    """
+    # Keyed by absolute path: api.py and get_connections.py name the same file differently
+    key = os.path.abspath(db_path)
+    graph = _graphs.get(key)
+    if graph is not None:
+        sync_citation_graph(db_path)
+        return graph
+
+    with _graphs_lock:
+        graph = _graphs.get(key)
+        if graph is not None:
+            return graph
+
+        graph = None
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            try:
+                graph = CitationGraph.load(path)
+                if graph.n_edges != count_citations(db_path):
+                    print(f"Saved citation graph at {path} is stale, rebuilding")
+                    graph = None
+            except (ValueError, OSError, sqlite3.Error) as e:
+                print(f"Could not load citation graph from {path}: {str(e)}")
+                graph = None
+
+        if graph is None:
+            graph = CitationGraph.build_from_db(db_path)
+            try:
+                graph.save(path)
+            except OSError as e:
+                print(f"Could not save citation graph to {path}: {str(e)}")
+
+        _graphs[key] = graph
+        return graph
+
+
+def apply_new_edges(db_path: str, src_id: str, dst_ids: List[str]):
+    """Add edges to the loaded graph for db_path, if there is one."""
+    graph = _graphs.get(os.path.abspath(db_path))
+    if graph is not None:
+        graph.add_edges(src_id, dst_ids)
+
+
+def sync_citation_graph(db_path: str = 'papers.db', interval: float = SYNC_INTERVAL) -> int:
+    """
+    Add edges other processes wrote since the last check to the loaded graph
+    for db_path. Every server worker has its own graph and apply_new_edges
+    only reaches the worker that did the extraction, so the others find the
+    papers whose extraction finished recently and read their edges. Checks
+    at most once per interval; returns the number of edges added.
+    """
+    graph = _graphs.get(os.path.abspath(db_path))
+    if graph is None:
+        return 0
+    now = time.time()
+    with graph.lock:
+        if now - graph.synced_at < interval:
+            return 0
+        since = datetime.fromtimestamp(graph.synced_at - SYNC_OVERLAP).strftime('%Y-%m-%d %H:%M:%S')
+        graph.synced_at = now
+
+    connections: Dict[str, List[str]] = {}
+    conn = connect(db_path)
+    try:
+        for src, dst in conn.execute('''
+            SELECT c.src, c.dst FROM reference_extraction e
+            JOIN citations c ON c.src = e.paper_id
+            WHERE e.updated_at >= ? AND e.status = 'done'
+        ''', (since,)):
+            connections.setdefault(src, []).append(dst)
+    except sqlite3.Error as e:
+        print(f"Could not sync citation graph for {db_path}: {str(e)}")
+        return 0
+    finally:
+        conn.close()
+
+    before = graph.n_edges
+    for src, dsts in connections.items():
+        graph.add_edges(src, dsts)
+    added = graph.n_edges - before
+    if added:
+        print(f"Synced {added} citation edges from {db_path}")
+    return added
@@ -0,0 +1,214 @@
+import json
+import atexit
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from db import connect, get_connection
+
+# Views are counted in memory and written to paper_views in one transaction
+# once this many are pending or VIEW_FLUSH_INTERVAL seconds have passed, so
+# serving a cached response does not take the database's write lock
+VIEW_FLUSH_SIZE = 100
+VIEW_FLUSH_INTERVAL = 60.0
+
+
+class ConnectionsCache:
+    """
+    Materialized /api/connections responses keyed on (paper, degree,
+    max_nodes), stored in the papers database.
+
+    Every paper that appears in a cached neighbourhood gets a row in
+    connections_cache_nodes, so when a paper gains edges all cached
+    responses that include it can be dropped with one indexed delete.
+    paper_views counts requests per paper for pre-warming; counts reach it
+    in batches (see record_view).
+    """
+
+    def __init__(self, db_path: str = 'papers.db'):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self.views_lock = threading.Lock()
+        self.pending_views: Dict[str, int] = {}
+        self.pending_total = 0
+        self.last_flush = time.time()
+        self._setup()
+        # Workers recycled by gunicorn's max_requests exit normally
+        atexit.register(self.flush_views)
+
+    def _setup(self):
+        conn = connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS connections_cache (
+            paper_id TEXT NOT NULL,
+            degree INTEGER NOT NULL,
+            max_nodes INTEGER NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL,
+            PRIMARY KEY (paper_id, degree, max_nodes)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS connections_cache_nodes (
+            node_id TEXT NOT NULL,
+            paper_id TEXT NOT NULL,
+            degree INTEGER NOT NULL,
+            max_nodes INTEGER NOT NULL,
+            PRIMARY KEY (node_id, paper_id, degree, max_nodes)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_connections_cache_nodes_entry
+        ON connections_cache_nodes(paper_id, degree, max_nodes)
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS paper_views (
+            paper_id TEXT PRIMARY KEY,
+            views INTEGER NOT NULL DEFAULT 0,
+            last_viewed REAL
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_paper_views_views ON paper_views(views)')
+
+        conn.commit()
+        conn.close()
+
+    def get(self, paper_id: str, degree: int, max_nodes: int) -> Optional[Dict[str, Any]]:
+        conn = get_connection(self.db_path)
+        row = conn.execute('''
+            SELECT response FROM connections_cache
+            WHERE paper_id = ? AND degree = ? AND max_nodes = ?
+        ''', (paper_id, degree, max_nodes)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, paper_id: str, degree: int, max_nodes: int, response: Dict[str, Any]):
+        nodes = neighbourhood_nodes(response)
+        conn = get_connection(self.db_path)
+        with conn:
+            self._delete_entry(conn, paper_id, degree, max_nodes)
+            conn.execute('''
+                INSERT INTO connections_cache (paper_id, degree, max_nodes, response, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (paper_id, degree, max_nodes, json.dumps(response), time.time()))
+            conn.executemany('''
+                INSERT OR IGNORE INTO connections_cache_nodes (node_id, paper_id, degree, max_nodes)
+                VALUES (?, ?, ?, ?)
+            ''', [(node, paper_id, degree, max_nodes) for node in nodes])
+
+    @staticmethod
+    def _delete_entry(conn, paper_id: str, degree: int, max_nodes: int):
+        conn.execute('''
+            DELETE FROM connections_cache WHERE paper_id = ? AND degree = ? AND max_nodes = ?
+        ''', (paper_id, degree, max_nodes))
+        conn.execute('''
+            DELETE FROM connections_cache_nodes WHERE paper_id = ? AND degree = ? AND max_nodes = ?
+        ''', (paper_id, degree, max_nodes))
+
+    def invalidate(self, node_ids: Iterable[str]) -> int:
+        """Drop every cached response whose neighbourhood contains any of node_ids."""
+        node_ids = list(node_ids)
+        conn = get_connection(self.db_path)
+        entries = set()
+        for i in range(0, len(node_ids), 500):
+            chunk = node_ids[i:i+500]
+            placeholders = ','.join(['?'] * len(chunk))
+            entries.update(conn.execute(f'''
+                SELECT paper_id, degree, max_nodes FROM connections_cache_nodes
+                WHERE node_id IN ({placeholders})
+            ''', chunk).fetchall())
+
+        with conn:
+            for entry in entries:
+                self._delete_entry(conn, *entry)
+        return len(entries)
+
+    def clear(self):
+        conn = get_connection(self.db_path)
+        with conn:
+            conn.execute('DELETE FROM connections_cache')
+            conn.execute('DELETE FROM connections_cache_nodes')
+
+    def record_view(self, paper_id: str):
+        """Count a view in memory; flush_views() runs once enough are pending or old enough."""
+        with self.views_lock:
+            self.pending_views[paper_id] = self.pending_views.get(paper_id, 0) + 1
+            self.pending_total += 1
+            due = (self.pending_total >= VIEW_FLUSH_SIZE
+                   or time.time() - self.last_flush >= VIEW_FLUSH_INTERVAL)
+        if due:
+            self.flush_views()
+
+    def flush_views(self):
+        """Write pending view counts in one transaction. On failure they are kept for the next flush."""
+        with self.views_lock:
+            pending, self.pending_views = self.pending_views, {}
+            self.pending_total = 0
+            self.last_flush = time.time()
+        if not pending:
+            return
+
+        now = time.time()
+        try:
+            conn = get_connection(self.db_path)
+            with conn:
+                conn.executemany('''
+                    INSERT INTO paper_views (paper_id, views, last_viewed) VALUES (?, ?, ?)
+                    ON CONFLICT(paper_id) DO UPDATE SET views = views + excluded.views, last_viewed = excluded.last_viewed
+                ''', [(paper_id, views, now) for paper_id, views in pending.items()])
+        except sqlite3.Error as e:
+            print(f"Could not record paper views: {str(e)}")
+            with self.views_lock:
+                for paper_id, views in pending.items():
+                    self.pending_views[paper_id] = self.pending_views.get(paper_id, 0) + views
+                    self.pending_total += views
+
+    def most_viewed(self, n: int) -> List[str]:
+        self.flush_views()
+        conn = get_connection(self.db_path)
+        rows = conn.execute('SELECT paper_id FROM paper_views ORDER BY views DESC LIMIT ?', (n,)).fetchall()
+        return [row[0] for row in rows]
+
+    def warm(self, compute: Callable[[str, int, int], Dict[str, Any]], n: int,
+             degrees: Iterable[int], max_nodes: int) -> int:
+        """
+        Precompute responses for the n most viewed papers that are not cached
+        yet. compute(paper_id, degree, max_nodes) builds a response.
+        """
+        warmed = 0
+        for paper_id in self.most_viewed(n):
+            for degree in degrees:
+                if self.get(paper_id, degree, max_nodes) is not None:
+                    continue
+                self.put(paper_id, degree, max_nodes, compute(paper_id, degree, max_nodes))
+                warmed += 1
+        return warmed
+
+    def stats(self) -> Dict[str, int]:
+        conn = get_connection(self.db_path)
+        entries = conn.execute('SELECT COUNT(*) FROM connections_cache').fetchone()[0]
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+def neighbourhood_nodes(response: Dict[str, Any]) -> List[str]:
+    """Every paper id in a connections response (source, keys and references)."""
+    nodes = set()
+    first_degree = response.get('first_degree', {})
+    if first_degree.get('source_id'):
+        nodes.add(first_degree['source_id'])
+    nodes.update(first_degree.get('connections', []))
+    for key, level in response.items():
+        if key == 'first_degree' or not isinstance(level, dict):
+            continue
+        for node, refs in level.items():
+            nodes.add(node)
+            nodes.update(refs)
+    return sorted(nodes)
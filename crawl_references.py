@@ -0,0 +1,239 @@
+import os
+import re
+import sys
+import time
+import argparse
+from datetime import datetime
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import fitz as pymupdf
+from tqdm import tqdm
+
+from get_connections import extract_normalized_arxiv_ids, ensure_citations_table, get_connections_cache
+from citation_graph import CitationGraph, GRAPH_PATH
+from db import connect
+
+# Root of the local PDF mirror written by download_arxiv.sh (DEST_BASE there):
+# <mirror>/<category>/pdf/<yymm>/<file>.pdf
+MIRROR_PATH = os.environ.get('PAPERWEB_ARXIV_MIRROR', '/Volumes/My Passport/arxiv_data')
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'papers.db')
+
+# Papers handed to the pool and written to the database per transaction
+WRITE_BATCH_SIZE = 500
+PAPER_FETCH_SIZE = 10000
+
+VERSION_SUFFIX = re.compile(r'v\d+$')
+
+
+def strip_version(paper_id: str) -> str:
+    return VERSION_SUFFIX.sub('', paper_id)
+
+
+def mirror_paper_id(category: str, filename: str) -> Tuple[str, int]:
+    """
+    Map a mirror file name to (paper id, version). New-style papers live under
+    the 'arxiv' category (2101.00001v2.pdf -> 2101.00001); old-style ones under
+    their archive (cs/pdf/0001/0001001v1.pdf or cs0001001v1.pdf -> cs/0001001).
+    """
+    stem = filename[:-len('.pdf')]
+    match = VERSION_SUFFIX.search(stem)
+    version = int(match.group(0)[1:]) if match else 0
+    stem = strip_version(stem)
+
+    if category == 'arxiv':
+        return stem, version
+    if stem.startswith(category):
+        stem = stem[len(category):]
+    return f"{category}/{stem}", version
+
+
+def index_mirror(mirror_path: str) -> Dict[str, str]:
+    """{paper id: path of its latest PDF version} for every PDF in the mirror."""
+    start = time.time()
+    latest: Dict[str, Tuple[int, str]] = {}
+
+    if not os.path.isdir(mirror_path):
+        print(f"Mirror directory {mirror_path} does not exist")
+        return {}
+
+    for category in os.scandir(mirror_path):
+        pdf_dir = os.path.join(category.path, 'pdf')
+        if not category.is_dir() or not os.path.isdir(pdf_dir):
+            continue
+        for subdir in os.scandir(pdf_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.endswith('.pdf'):
+                    continue
+                paper_id, version = mirror_paper_id(category.name, entry.name)
+                if paper_id not in latest or version > latest[paper_id][0]:
+                    latest[paper_id] = (version, entry.path)
+
+    print(f"Indexed {len(latest)} PDFs in {mirror_path} in {time.time() - start:.1f}s")
+    return {paper_id: path for paper_id, (_, path) in latest.items()}
+
+
+def load_known_ids(db_path: str) -> Set[str]:
+    """Every paper id in the database, with and without its version suffix."""
+    conn = connect(db_path)
+    known = set()
+    for (paper_id,) in conn.execute("SELECT id FROM papers"):
+        known.add(paper_id)
+        known.add(strip_version(paper_id))
+    conn.close()
+    return known
+
+
+def pending_papers(db_path: str, retry: bool = False) -> Iterator[str]:
+    """
+    Paper ids with no extraction status yet (or, with retry, any status other
+    than 'done'), paged by id so the scan never holds a long read open.
+    """
+    # Papers never crawled have no reference_extraction row, so e.status is NULL for them
+    status_filter = "e.paper_id IS NULL OR e.status != 'done'" if retry else "e.paper_id IS NULL"
+    conn = connect(db_path)
+    last_id = ''
+    try:
+        while True:
+            rows = conn.execute(f'''
+                SELECT p.id FROM papers p
+                LEFT JOIN reference_extraction e ON e.paper_id = p.id
+                WHERE p.id > ? AND ({status_filter})
+                ORDER BY p.id
+                LIMIT ?
+            ''', (last_id, PAPER_FETCH_SIZE)).fetchall()
+            if not rows:
+                break
+            for (paper_id,) in rows:
+                yield paper_id
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+
+
+def extract_references(task: Tuple[str, str]) -> Tuple[str, List[str], Optional[str]]:
+    """
+    Pool worker: read one PDF from the mirror and return
+    (paper_id, arXiv ids found in its text, error or None).
+    """
+    paper_id, path = task
+    try:
+        doc = pymupdf.open(path)
+        text = "".join(page.get_text() for page in doc)
+        doc.close()
+    except Exception as e:
+        return paper_id, [], str(e)
+
+    base_id = strip_version(paper_id)
+    refs = [ref for ref in extract_normalized_arxiv_ids(text) if ref != base_id]
+    return paper_id, refs, None
+
+
+def write_results(conn, results: List[Tuple[str, List[str], Optional[str]]], known: Set[str]) -> int:
+    """Write the edges and status rows for a batch in one transaction."""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    edges = []
+    statuses = []
+    for paper_id, refs, error in results:
+        if error is not None:
+            statuses.append((paper_id, 'error', 0, error, now))
+            continue
+        existing = {ref for ref in refs if ref in known}
+        edges.extend((paper_id, ref) for ref in existing)
+        statuses.append((paper_id, 'done', len(existing), None, now))
+
+    before = conn.total_changes
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO citations (src, dst) VALUES (?, ?)", edges)
+        added = conn.total_changes - before
+        conn.executemany('''
+            INSERT OR REPLACE INTO reference_extraction (paper_id, status, n_refs, error, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', statuses)
+    return added
+
+
+def write_batch(conn, db_path: str, results: List[Tuple[str, List[str], Optional[str]]], known: Set[str]) -> int:
+    """write_results, then drop cached /api/connections responses around papers that gained edges."""
+    added = write_results(conn, results, known)
+    if added:
+        get_connections_cache(db_path).invalidate([paper_id for paper_id, refs, _ in results if refs])
+    return added
+
+
+def record_missing(conn, paper_ids: List[str]):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO reference_extraction (paper_id, status, n_refs, error, updated_at)
+            VALUES (?, 'missing', 0, NULL, ?)
+        ''', [(paper_id, now) for paper_id in paper_ids])
+
+
+def crawl(db_path: str = DB_PATH, mirror_path: str = MIRROR_PATH, workers: Optional[int] = None,
+          retry: bool = False, limit: Optional[int] = None) -> Dict[str, int]:
+    """
+    Extract references for every pending paper that has a PDF in the mirror.
+    Papers without a local PDF are marked 'missing'; rerunning skips both
+    finished and missing papers unless retry is set.
+    """
+    ensure_citations_table(db_path)
+    pdf_paths = index_mirror(mirror_path)
+    known = load_known_ids(db_path)
+
+    tasks = []
+    missing = []
+    for paper_id in pending_papers(db_path, retry):
+        path = pdf_paths.get(paper_id) or pdf_paths.get(strip_version(paper_id))
+        if path:
+            tasks.append((paper_id, path))
+        else:
+            missing.append(paper_id)
+        if limit is not None and len(tasks) >= limit:
+            break
+
+    conn = connect(db_path)
+    record_missing(conn, missing)
+    print(f"{len(tasks)} papers to process, {len(missing)} without a local PDF")
+
+    stats = {"processed": 0, "errors": 0, "edges": 0, "missing": len(missing)}
+    start = time.time()
+    batch = []
+    with Pool(processes=workers) as pool:
+        results = pool.imap_unordered(extract_references, tasks, chunksize=16)
+        for result in tqdm(results, total=len(tasks), desc="Extracting references"):
+            batch.append(result)
+            stats["processed"] += 1
+            if result[2] is not None:
+                stats["errors"] += 1
+            if len(batch) >= WRITE_BATCH_SIZE:
+                stats["edges"] += write_batch(conn, db_path, batch, known)
+                batch = []
+        if batch:
+            stats["edges"] += write_batch(conn, db_path, batch, known)
+    conn.close()
+
+    elapsed = time.time() - start
+    rate = stats["processed"] / elapsed if elapsed > 0 else 0
+    print(f"Processed {stats['processed']} papers ({rate:.1f} papers/sec), "
+          f"{stats['edges']} new edges, {stats['errors']} errors")
+
+    # Refresh the saved CSR arrays so the web process loads the new edges
+    if stats["edges"]:
+        CitationGraph.build_from_db(db_path).save(GRAPH_PATH)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract references for every paper from the local arXiv PDF mirror")
+    parser.add_argument("--mirror", default=MIRROR_PATH, help="Root directory written by download_arxiv.sh")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--retry", action="store_true", help="Retry papers marked missing or error")
+    parser.add_argument("--limit", type=int, default=None, help="Process at most this many PDFs")
+    args = parser.parse_args()
+
+    crawl(args.db, args.mirror, args.workers, args.retry, args.limit)
+    sys.exit(0)
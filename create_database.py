@@ -1,6 +1,7 @@
 import sqlite3
 from typing import Optional, Set, Dict, List
 import json
+from paper_search import ensure_paper_categories, index_paper_categories
 
 # 603789 entries
 # paper website: https://arxiv.org/abs/ID
@@ -29,6 +30,7 @@ def setup_database():
     conn.close()
 
 def process_json_lines(file_path: str, db_path: str = 'papers.db'):
+    ensure_paper_categories(db_path)
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
@@ -77,6 +79,7 @@ def process_json_lines(file_path: str, db_path: str = 'papers.db'):
                     month,
                     day
                 ))
+                index_paper_categories(cursor, [(paper['id'], categories, year, month, day)])
                 entries += 1
                 
             except json.JSONDecodeError as e:
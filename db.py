@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Set
+
+# Read-heavy tuning applied to every connection. mmap lets reads come
+# straight from the OS page cache; cache_size is in KiB (negative pragma).
+DB_MMAP_SIZE = int(os.environ.get('PAPERWEB_DB_MMAP_SIZE', str(1 << 30)))
+DB_CACHE_SIZE_KB = int(os.environ.get('PAPERWEB_DB_CACHE_KB', '65536'))
+# Prepared statements kept per connection; pooled connections reuse them across requests
+DB_CACHED_STATEMENTS = 256
+# Seconds a writer waits for another writer's lock before failing
+DB_BUSY_TIMEOUT = 30.0
+
+_local = threading.local()
+_wal_ready: Set[str] = set()
+_wal_lock = threading.Lock()
+
+
+def _enable_wal(conn: sqlite3.Connection, db_path: str):
+    """
+    Switch the database to WAL once per process. The mode is stored in the
+    file, so readers and the updater stop blocking each other for good.
+    """
+    if db_path in _wal_ready:
+        return
+    with _wal_lock:
+        if db_path not in _wal_ready:
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+            except sqlite3.OperationalError as e:
+                # Another connection holds a lock; try again on the next connect
+                print(f"Could not enable WAL on {db_path}: {e}")
+                return
+            _wal_ready.add(db_path)
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """A new tuned connection, owned and closed by the caller."""
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT, cached_statements=DB_CACHED_STATEMENTS)
+    _enable_wal(conn, db_path)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+    conn.execute(f'PRAGMA cache_size={-DB_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+def get_connection(db_path: str) -> sqlite3.Connection:
+    """
+    This thread's pooled connection to db_path, opened on first use and
+    kept for the life of the thread. Callers must not close it, and should
+    wrap writes in `with conn:` so a failed write never leaves a transaction
+    open for the next caller. A connection inherited across fork (gunicorn
+    preload) is never reused by the child.
+    """
+    pool: Dict[str, sqlite3.Connection] = getattr(_local, 'connections', None)
+    if pool is None or getattr(_local, 'pid', None) != os.getpid():
+        pool = _local.connections = {}
+        _local.pid = os.getpid()
+
+    conn = pool.get(db_path)
+    if conn is None:
+        conn = pool[db_path] = connect(db_path)
+    return conn
+
+
+def close_connections():
+    """Close this thread's pooled connections."""
+    pool = getattr(_local, 'connections', None)
+    if pool and getattr(_local, 'pid', None) == os.getpid():
+        for conn in pool.values():
+            conn.close()
+    _local.connections = {}
+    _local.pid = os.getpid()
@@ -6,15 +6,52 @@ import os
 from transformers import AutoTokenizer, AutoModel
 import torch
 from tqdm import tqdm
+import time
+import argparse
+import queue
+import threading
+import hashlib
+from vector_store import EmbeddingStore, get_embedding_store
+from ann_index import IVFFlatIndex
+from query_cache import QueryEmbeddingCache
+from db import connect, get_connection
 
 # Constants
 PAPERS_DB_PATH = 'papers.db'
 EMBEDDINGS_DB_PATH = 'embeddings.db'
 BATCH_SIZE = 100
+# Tokenized pages the background tokenizer may run ahead of the model
+PIPELINE_QUEUE_SIZE = 4
+CHECKPOINT_NAME = 'process_all_papers'
 MODEL_NAME = "avsolatorio/GIST-Embedding-v0"
 
+# Dynamic batching for the model: inputs are sorted by token length and
+# packed until (rows x longest row) reaches the token budget
+EMBED_TOKEN_BUDGET = int(os.environ.get('PAPERWEB_EMBED_TOKEN_BUDGET', '8192'))
+EMBED_MAX_BATCH_ROWS = 256
+# torch CPU threads for inference; 0 keeps torch's default
+EMBED_NUM_THREADS = int(os.environ.get('PAPERWEB_EMBED_THREADS', '0'))
+
+# In-memory storage format for the vector store: float32, float16 or int8
+EMBEDDING_PRECISION = os.environ.get('PAPERWEB_EMBEDDING_PRECISION', 'float32')
+
+# Approximate nearest-neighbour index (built with `python embed.py build-index`)
+ANN_INDEX_PATH = os.environ.get('PAPERWEB_ANN_INDEX', 'embeddings_ivf')
+USE_ANN_INDEX = os.environ.get('PAPERWEB_USE_ANN', '0') == '1'
+ANN_NPROBE = int(os.environ.get('PAPERWEB_ANN_NPROBE', '16'))
+
+# Memory-mappable copy of the vector store (`python embed.py snapshot`), so
+# server workers share one matrix through the page cache
+EMBEDDING_SNAPSHOT_PATH = os.environ.get('PAPERWEB_EMBEDDING_SNAPSHOT', 'embeddings_snapshot')
+
+# Query embedding cache; set PAPERWEB_QUERY_CACHE_DB to '' to keep it in memory only
+QUERY_CACHE_SIZE = int(os.environ.get('PAPERWEB_QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_DB_PATH = os.environ.get('PAPERWEB_QUERY_CACHE_DB', 'query_cache.db')
+
 tokenizer = None
 model = None
+ann_index_checked = False
+query_cache = None
 
 def load_model():
     global tokenizer, model
@@ -26,9 +63,12 @@ def load_model():
             model = model.to("mps")
         elif torch.cuda.is_available():
             model = model.to("cuda")
+        
+        if EMBED_NUM_THREADS > 0:
+            torch.set_num_threads(EMBED_NUM_THREADS)
 
 def setup_embeddings_database():
-    conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
+    conn = connect(EMBEDDINGS_DB_PATH)
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -43,27 +83,70 @@ def setup_embeddings_database():
     )
     ''')
     
+    # Databases created before incremental updates lack the abstract hash
+    cursor.execute('PRAGMA table_info(paper_embeddings)')
+    if 'abstract_hash' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE paper_embeddings ADD COLUMN abstract_hash TEXT')
+    
+    # Last paper id written by a bulk run, so an interrupted run can resume
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS embedding_progress (
+        name TEXT PRIMARY KEY,
+        last_id TEXT,
+        processed INTEGER,
+        updated_at TEXT
+    )
+    ''')
+    
     conn.commit()
     conn.close()
 
-def get_papers_from_db(batch_size: int = BATCH_SIZE, offset: int = 0) -> List[Dict[str, Any]]:
-    conn = sqlite3.connect(PAPERS_DB_PATH)
+def get_checkpoint(name: str = CHECKPOINT_NAME) -> Tuple[str, int]:
+    """Return (last_id, processed) for a bulk run, or ('', 0) if it has not started."""
+    conn = connect(EMBEDDINGS_DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT last_id, processed FROM embedding_progress WHERE name = ?', (name,))
+    result = cursor.fetchone()
+    conn.close()
+    
+    if result:
+        return result[0] or '', result[1] or 0
+    return '', 0
+
+def reset_checkpoint(name: str = CHECKPOINT_NAME):
+    conn = connect(EMBEDDINGS_DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM embedding_progress WHERE name = ?', (name,))
+    conn.commit()
+    conn.close()
+
+def abstract_hash(abstract: Optional[str]) -> str:
+    """Content hash used to detect papers whose abstract changed since they were embedded."""
+    return hashlib.sha1((abstract or '').encode('utf-8')).hexdigest()
+
+def get_papers_from_db(batch_size: int = BATCH_SIZE, after_id: str = '') -> List[Dict[str, Any]]:
+    """Return the next page of papers with abstracts whose id sorts after after_id."""
+    conn = connect(PAPERS_DB_PATH)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
+    # Keyset pagination on the primary key: every page is an index seek,
+    # unlike OFFSET which rescans all earlier rows
     cursor.execute('''
     SELECT id, title, abstract, authors, categories, year
     FROM papers
-    WHERE abstract IS NOT NULL AND abstract != ''
-    LIMIT ? OFFSET ?
-    ''', (batch_size, offset))
+    WHERE id > ? AND abstract IS NOT NULL AND abstract != ''
+    ORDER BY id
+    LIMIT ?
+    ''', (after_id, batch_size))
     
     papers = [dict(row) for row in cursor.fetchall()]
     conn.close()
     return papers
 
 def count_papers_with_abstracts() -> int:
-    conn = sqlite3.connect(PAPERS_DB_PATH)
+    conn = connect(PAPERS_DB_PATH)
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -75,18 +158,43 @@ def count_papers_with_abstracts() -> int:
     conn.close()
     return count
 
-def generate_embeddings(texts: List[str]) -> np.ndarray:
-    """Generate embeddings for a list of texts using GIST-Embedding model."""
+def tokenize_texts(texts: List[str], token_budget: int = EMBED_TOKEN_BUDGET) -> Tuple[List[Dict[str, torch.Tensor]], np.ndarray]:
+    """
+    Tokenize texts into padded model-input batches (CPU tensors).
+    
+    Texts are sorted by token length and packed so that each batch's padded
+    size (rows x longest row) stays within token_budget, which keeps padding
+    to a minimum. Returns (batches, order) where order[i] is the index in
+    texts of the i-th row across all batches.
+    """
+    load_model()
+    
+    encoded = tokenizer(texts, truncation=True, max_length=512)
+    lengths = [len(ids) for ids in encoded['input_ids']]
+    order = np.argsort(lengths, kind='stable')
+    
+    batches = []
+    current = []
+    for i in order:
+        # Sorted ascending, so this text is the longest in the batch so far
+        if current and (lengths[i] * (len(current) + 1) > token_budget or len(current) >= EMBED_MAX_BATCH_ROWS):
+            batches.append(tokenizer.pad({key: [encoded[key][j] for j in current] for key in encoded.keys()},
+                                         padding=True, return_tensors="pt"))
+            current = []
+        current.append(i)
+    if current:
+        batches.append(tokenizer.pad({key: [encoded[key][j] for j in current] for key in encoded.keys()},
+                                     padding=True, return_tensors="pt"))
+    
+    return batches, order
+
+def embed_tokenized(batches: List[Dict[str, torch.Tensor]], order: np.ndarray) -> np.ndarray:
+    """Run the model over output of tokenize_texts and return CLS embeddings in input order."""
     load_model()
     
-    max_hf_batch_size = 16
     all_embeddings = []
     
-    for i in range(0, len(texts), max_hf_batch_size):
-        batch_texts = texts[i:i+max_hf_batch_size]
-        
-        inputs = tokenizer(batch_texts, padding=True, truncation=True, max_length=512, return_tensors="pt")
-        
+    for inputs in batches:
         if torch.backends.mps.is_available():
             inputs = {k: v.to("mps") for k, v in inputs.items()}
         elif torch.cuda.is_available():
@@ -98,55 +206,449 @@ def generate_embeddings(texts: List[str]) -> np.ndarray:
         
         all_embeddings.append(batch_embeddings)
     
-    return np.vstack(all_embeddings)
+    sorted_embeddings = np.vstack(all_embeddings)
+    embeddings = np.empty_like(sorted_embeddings)
+    embeddings[order] = sorted_embeddings
+    return embeddings
+
+def generate_embeddings(texts: List[str]) -> np.ndarray:
+    """Generate embeddings for a list of texts using GIST-Embedding model."""
+    return embed_tokenized(*tokenize_texts(texts))
 
-def store_embeddings(papers: List[Dict[str, Any]], embeddings: np.ndarray):
-    conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
+def benchmark_batching(sample_size: int = 512):
+    """
+    Compare the old fixed batches of 16 (padded to the longest abstract in
+    each) with length-bucketed batching on a random sample of abstracts.
+    """
+    load_model()
+    
+    conn = connect(PAPERS_DB_PATH)
     cursor = conn.cursor()
+    cursor.execute('''
+    SELECT abstract FROM papers
+    WHERE abstract IS NOT NULL AND abstract != ''
+    ORDER BY RANDOM()
+    LIMIT ?
+    ''', (sample_size,))
+    texts = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    
+    if not texts:
+        print("No abstracts to benchmark")
+        return
+    
+    print(f"Benchmarking {len(texts)} abstracts with {torch.get_num_threads()} torch threads")
+    
+    start = time.time()
+    fixed = []
+    for i in range(0, len(texts), 16):
+        inputs = tokenizer(texts[i:i+16], padding=True, truncation=True, max_length=512, return_tensors="pt")
+        fixed.append(embed_tokenized([inputs], np.arange(len(texts[i:i+16]))))
+    fixed = np.vstack(fixed)
+    fixed_seconds = time.time() - start
+    
+    start = time.time()
+    bucketed = generate_embeddings(texts)
+    bucketed_seconds = time.time() - start
+    
+    print(f"fixed batches of 16: {len(texts) / fixed_seconds:.1f} papers/sec")
+    print(f"length-bucketed (budget {EMBED_TOKEN_BUDGET} tokens): {len(texts) / bucketed_seconds:.1f} papers/sec")
+    print(f"max abs difference between outputs: {np.abs(fixed - bucketed).max():.2e}")
+
+def get_query_cache() -> QueryEmbeddingCache:
+    global query_cache
+    if query_cache is None:
+        query_cache = QueryEmbeddingCache(MODEL_NAME, QUERY_CACHE_SIZE, QUERY_CACHE_DB_PATH or None)
+    return query_cache
+
+def embed_queries(query_texts: List[str]) -> np.ndarray:
+    """
+    Embed free-text queries, serving repeats from the query cache. Only the
+    texts that miss the cache go through the model, in one batch.
+    """
+    cache = get_query_cache()
+    vectors = [cache.get(text) for text in query_texts]
+    
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        # Embed each distinct text once even if it appears several times
+        unique_texts = list(dict.fromkeys(query_texts[i] for i in missing))
+        embedded = dict(zip(unique_texts, generate_embeddings(unique_texts)))
+        for text, vector in embedded.items():
+            cache.put(text, vector)
+        for i in missing:
+            vectors[i] = embedded[query_texts[i]]
+    
+    return np.vstack(vectors)
+
+def embed_query(query_text: str) -> np.ndarray:
+    return embed_queries([query_text])[0]
+
+def get_query_cache_stats() -> Dict[str, int]:
+    return get_query_cache().stats()
+
+def store_embeddings(papers: List[Dict[str, Any]], embeddings: np.ndarray,
+                     checkpoint: Optional[Tuple[str, int]] = None):
+    """
+    Write a batch of embeddings in one transaction. If checkpoint is given as
+    (name, processed), the run's progress is advanced in the same transaction
+    so a crash never records papers that were not written.
+    """
+    conn = get_connection(EMBEDDINGS_DB_PATH)
+    
+    with conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+        INSERT OR REPLACE INTO paper_embeddings
+        (id, title, abstract, embedding, authors, categories, year, abstract_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (
+                paper['id'],
+                paper['title'],
+                paper['abstract'],
+                embeddings[i].tobytes(),
+                paper.get('authors', ''),
+                paper.get('categories', ''),
+                paper.get('year', 0),
+                abstract_hash(paper['abstract'])
+            )
+            for i, paper in enumerate(papers)
+        ])
+        
+        if checkpoint:
+            name, processed = checkpoint
+            cursor.execute('''
+            INSERT OR REPLACE INTO embedding_progress (name, last_id, processed, updated_at)
+            VALUES (?, ?, ?, datetime('now'))
+            ''', (name, papers[-1]['id'], processed))
+    
+    get_store().upsert_many(
+        [paper['id'] for paper in papers],
+        embeddings,
+        [paper.get('year') for paper in papers],
+        [paper.get('categories') for paper in papers]
+    )
+
+def _tokenize_pages(after_id: str, pages: queue.Queue, stop: threading.Event):
+    """Producer for process_all_papers: read and tokenize pages ahead of the model."""
+    try:
+        while not stop.is_set():
+            papers = get_papers_from_db(BATCH_SIZE, after_id)
+            if not papers:
+                break
+            
+            tokenized = tokenize_texts([paper['abstract'] for paper in papers])
+            pages.put((papers, tokenized))
+            after_id = papers[-1]['id']
+        pages.put(None)
+    except Exception as e:
+        pages.put(e)
+
+def process_all_papers(fresh: bool = False):
+    """
+    Embed every paper with an abstract. Reading and tokenization run in a
+    background thread so they overlap with model inference, each page is
+    written in one transaction, and progress is checkpointed so an
+    interrupted run resumes after the last written paper. The checkpoint is
+    cleared once a run completes, so the next run embeds everything again.
+    Pass fresh=True to discard existing embeddings and start over.
+    """
+    setup_embeddings_database()
+    load_model()
+    
+    if fresh:
+        conn = connect(EMBEDDINGS_DB_PATH)
+        conn.execute('DELETE FROM paper_embeddings')
+        conn.commit()
+        conn.close()
+        reset_checkpoint()
     
-    for i, paper in enumerate(papers):
-        embedding_blob = embeddings[i].tobytes()
+    total_papers = count_papers_with_abstracts()
+    after_id, processed = get_checkpoint()
+    if after_id:
+        print(f"Resuming after paper {after_id} ({processed}/{total_papers} already embedded)")
+    
+    pages = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    producer = threading.Thread(target=_tokenize_pages, args=(after_id, pages, stop), daemon=True)
+    producer.start()
+    
+    start = time.time()
+    run_processed = 0
+    try:
+        with tqdm(total=total_papers, initial=processed, unit="papers") as progress:
+            while True:
+                item = pages.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                
+                papers, tokenized = item
+                embeddings = embed_tokenized(*tokenized)
+                
+                processed += len(papers)
+                run_processed += len(papers)
+                store_embeddings(papers, embeddings, checkpoint=(CHECKPOINT_NAME, processed))
+                
+                progress.update(len(papers))
+                progress.set_postfix(papers_per_sec=f"{run_processed / (time.time() - start):.1f}")
         
+        # Only an interrupted run leaves its checkpoint behind
+        reset_checkpoint()
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting on a full queue
+        while producer.is_alive():
+            try:
+                pages.get_nowait()
+            except queue.Empty:
+                producer.join(timeout=0.1)
+    
+    elapsed = time.time() - start
+    print(f"Embedded {run_processed} papers in {elapsed:.1f}s "
+          f"({run_processed / elapsed if elapsed else 0:.1f} papers/sec), {processed} total")
+
+def get_papers_from_db_by_ids(paper_ids: List[str]) -> List[Dict[str, Any]]:
+    """Fetch the papers.db rows needed for embedding, for the given ids."""
+    cursor = get_connection(PAPERS_DB_PATH).cursor()
+    cursor.row_factory = sqlite3.Row
+    
+    papers = []
+    for i in range(0, len(paper_ids), 500):
+        chunk = paper_ids[i:i+500]
+        placeholders = ','.join(['?'] * len(chunk))
+        cursor.execute(f'''
+        SELECT id, title, abstract, authors, categories, year
+        FROM papers
+        WHERE id IN ({placeholders})
+        ''', chunk)
+        papers.extend(dict(row) for row in cursor.fetchall())
+    
+    return papers
+
+def find_embedding_changes() -> Tuple[List[str], List[str]]:
+    """
+    Diff papers.db against paper_embeddings by id and abstract hash.
+    
+    Returns:
+        (ids to embed, ids to delete): papers that are new or whose abstract
+        changed, and embedded papers that were removed or lost their abstract
+    """
+    conn = connect(EMBEDDINGS_DB_PATH)
+    cursor = conn.cursor()
+    
+    # Backfill hashes for rows written before the column existed, using the
+    # abstract that was embedded
+    last_id = ''
+    while True:
         cursor.execute('''
-        INSERT OR REPLACE INTO paper_embeddings
-        (id, title, abstract, embedding, authors, categories, year)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            paper['id'],
-            paper['title'],
-            paper['abstract'],
-            embedding_blob,
-            paper['authors'],
-            paper['categories'],
-            paper['year']
-        ))
+        SELECT id, abstract FROM paper_embeddings
+        WHERE abstract_hash IS NULL AND id > ?
+        ORDER BY id
+        LIMIT 10000
+        ''', (last_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        cursor.executemany('UPDATE paper_embeddings SET abstract_hash = ? WHERE id = ?',
+                           [(abstract_hash(abstract), paper_id) for paper_id, abstract in rows])
+        conn.commit()
+        last_id = rows[-1][0]
     
-    conn.commit()
+    cursor.execute('SELECT id, abstract_hash FROM paper_embeddings')
+    embedded = dict(cursor.fetchall())
     conn.close()
+    
+    conn = connect(PAPERS_DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT id, abstract FROM papers
+    WHERE abstract IS NOT NULL AND abstract != ''
+    ''')
+    
+    to_embed = []
+    seen = set()
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        for paper_id, abstract in rows:
+            seen.add(paper_id)
+            if embedded.get(paper_id) != abstract_hash(abstract):
+                to_embed.append(paper_id)
+    conn.close()
+    
+    to_delete = [paper_id for paper_id in embedded if paper_id not in seen]
+    return to_embed, to_delete
 
-def process_all_papers():
+def update_embeddings_incremental() -> Dict[str, Any]:
+    """
+    Bring paper_embeddings in line with papers.db without re-embedding the
+    whole corpus: embed new or changed papers and delete removed ones.
+    """
     setup_embeddings_database()
+    start = time.time()
     
-    total_papers = count_papers_with_abstracts()
+    to_embed, to_delete = find_embedding_changes()
+    print(f"Incremental update: {len(to_embed)} papers to embed, {len(to_delete)} to delete")
     
-    processed = 0
-    while processed < total_papers:
-        papers = get_papers_from_db(BATCH_SIZE, processed)
+    if to_delete:
+        conn = connect(EMBEDDINGS_DB_PATH)
+        cursor = conn.cursor()
+        for i in range(0, len(to_delete), 500):
+            chunk = to_delete[i:i+500]
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'DELETE FROM paper_embeddings WHERE id IN ({placeholders})', chunk)
+        conn.commit()
+        conn.close()
+        get_store().remove_many(to_delete)
+    
+    embedded = 0
+    for i in tqdm(range(0, len(to_embed), BATCH_SIZE), unit="batches"):
+        papers = get_papers_from_db_by_ids(to_embed[i:i+BATCH_SIZE])
         if not papers:
-            break
-            
-        # Generate embeddings for abstracts
-        abstracts = [paper['abstract'] for paper in papers]
-        embeddings = generate_embeddings(abstracts)
-        
-        # Store in the database
+            continue
+        embeddings = generate_embeddings([paper['abstract'] for paper in papers])
         store_embeddings(papers, embeddings)
+        embedded += len(papers)
+    
+    elapsed = time.time() - start
+    print(f"Incremental update finished in {elapsed:.1f}s: {embedded} embedded, {len(to_delete)} deleted")
+    return {"embedded": embedded, "deleted": len(to_delete), "seconds": round(elapsed, 1)}
+
+def get_store() -> EmbeddingStore:
+    """Return the process-wide in-memory store for EMBEDDINGS_DB_PATH."""
+    return get_embedding_store(EMBEDDINGS_DB_PATH, EMBEDDING_PRECISION)
+
+def get_search_store() -> EmbeddingStore:
+    """
+    Return the store, attaching the ANN index on first use if it is enabled,
+    and picking up rows other processes have written since it was loaded.
+    """
+    global ann_index_checked
+    store = get_store()
+    if not ann_index_checked:
+        ann_index_checked = True
+        if USE_ANN_INDEX:
+            load_ann_index()
+    store.sync()
+    return store
+
+def load_store_snapshot(path: str = EMBEDDING_SNAPSHOT_PATH) -> EmbeddingStore:
+    """
+    Load the store memory-mapped from its snapshot at path. A missing or
+    stale snapshot is rewritten from the database first, then mapped, so the
+    matrix ends up file-backed rather than on this process's heap.
+    """
+    store = get_store()
+    if store.load_snapshot(path):
+        return store
+    
+    store.load()
+    store.save_snapshot(path)
+    store.load_snapshot(path)
+    return store
+
+def load_ann_index(path: str = ANN_INDEX_PATH, nprobe: int = ANN_NPROBE) -> bool:
+    """Memory-map the ANN index at path and route searches through it."""
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        print(f"No ANN index found at {path}, using exact search")
+        return False
+    
+    index = IVFFlatIndex.load(path)
+    get_store().attach_ann_index(index, nprobe)
+    print(f"Loaded ANN index from {path} ({len(index)} vectors, {index.n_lists} lists, nprobe={nprobe})")
+    return True
+
+def build_ann_index(n_lists: Optional[int] = None, path: str = ANN_INDEX_PATH):
+    """Build an IVF-flat index over every stored embedding and save it to path."""
+    store = get_store()
+    store.ensure_loaded()
+    
+    start = time.time()
+    index = IVFFlatIndex.build(store.matrix[:store.size], store.ids, n_lists)
+    index.save(path)
+    print(f"Built ANN index with {len(index)} vectors in {index.n_lists} lists at {path} ({time.time() - start:.1f}s)")
+
+def evaluate_ann_recall(k: int = 10, n_queries: int = 200,
+                        nprobe_values: Tuple[int, ...] = (1, 4, 8, 16, 32, 64),
+                        path: str = ANN_INDEX_PATH):
+    """
+    Report recall@k and query latency of the ANN index against exact search,
+    using stored papers as queries.
+    """
+    store = get_store()
+    store.ensure_loaded()
+    # exact=True is used for ground truth, so the attached index and its
+    # coverage are only swapped for the duration of the evaluation
+    with store.lock:
+        saved = (store.ann_index, store.ann_nprobe, store.ann_rows, store.uncovered_rows)
+    try:
+        store.attach_ann_index(IVFFlatIndex.load(path))
         
-        processed += len(papers)
+        rng = np.random.default_rng(0)
+        query_rows = rng.choice(store.size, min(n_queries, store.size), replace=False)
+        queries = [(store.ids[row], store.get_vector(store.ids[row])) for row in query_rows]
+        
+        start = time.time()
+        exact = [
+            {paper_id for paper_id, _ in store.top_k(vector, k, exclude_ids={query_id}, exact=True)}
+            for query_id, vector in queries
+        ]
+        exact_ms = (time.time() - start) * 1000 / len(queries)
+        print(f"exact: {exact_ms:.2f} ms/query")
+        
+        print(f"{'nprobe':>8} {'recall@' + str(k):>10} {'ms/query':>10} {'speedup':>8}")
+        for nprobe in nprobe_values:
+            start = time.time()
+            hits = 0
+            for (query_id, vector), truth in zip(queries, exact):
+                approx = store.top_k(vector, k, exclude_ids={query_id}, nprobe=nprobe)
+                hits += len(truth & {paper_id for paper_id, _ in approx})
+            ann_ms = (time.time() - start) * 1000 / len(queries)
+            recall = hits / max(1, sum(len(truth) for truth in exact))
+            print(f"{nprobe:>8} {recall:>10.4f} {ann_ms:>10.2f} {exact_ms / ann_ms:>7.1f}x")
+    finally:
+        with store.lock:
+            store.ann_index, store.ann_nprobe, store.ann_rows, store.uncovered_rows = saved
+            if store.ann_index is not None:
+                # Rows added during the evaluation are not covered by the restored index
+                store._map_ann_rows()
+
+def benchmark_precisions(k: int = 10, n_queries: int = 200):
+    """
+    Compare the float32, float16 and int8 stores: matrix memory footprint,
+    exact-search QPS and recall@k against float32.
+    """
+    stores = {precision: EmbeddingStore(EMBEDDINGS_DB_PATH, precision) for precision in ('float32', 'float16', 'int8')}
+    for store in stores.values():
+        store.ensure_loaded()
+    
+    reference = stores['float32']
+    rng = np.random.default_rng(0)
+    query_rows = rng.choice(reference.size, min(n_queries, reference.size), replace=False)
+    queries = [(reference.ids[row], reference.matrix[row].copy()) for row in query_rows]
+    truth = [
+        {paper_id for paper_id, _ in reference.top_k(vector, k, exclude_ids={query_id})}
+        for query_id, vector in queries
+    ]
+    
+    print(f"{'precision':>10} {'memory MB':>10} {'QPS':>8} {'recall@' + str(k):>10}")
+    for precision, store in stores.items():
+        start = time.time()
+        results = [
+            {paper_id for paper_id, _ in store.top_k(vector, k, exclude_ids={query_id})}
+            for query_id, vector in queries
+        ]
+        qps = len(queries) / (time.time() - start)
+        recall = sum(len(r & t) for r, t in zip(results, truth)) / max(1, sum(len(t) for t in truth))
+        memory = store.matrix[:store.size].nbytes / 1e6
+        print(f"{precision:>10} {memory:>10.1f} {qps:>8.1f} {recall:>10.4f}")
 
 def get_embedding_for_paper(paper_id: str) -> Optional[np.ndarray]:
-    conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
-    cursor = conn.cursor()
+    cursor = get_connection(EMBEDDINGS_DB_PATH).cursor()
     
     cursor.execute('''
     SELECT embedding FROM paper_embeddings
@@ -154,7 +656,6 @@ def get_embedding_for_paper(paper_id: str) -> Optional[np.ndarray]:
     ''', (paper_id,))
     
     result = cursor.fetchone()
-    conn.close()
     
     if result:
         return np.frombuffer(result[0], dtype=np.float32)
@@ -163,97 +664,170 @@ def get_embedding_for_paper(paper_id: str) -> Optional[np.ndarray]:
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
-def find_related_papers(paper_id: str, top_n: int = 10) -> List[Dict[str, Any]]:
-    target_embedding = get_embedding_for_paper(paper_id)
-    if target_embedding is None:
-        return []
-    
-    conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT id, title, abstract, embedding, authors, categories, year
-    FROM paper_embeddings
-    WHERE id != ?
-    ''', (paper_id,))
-    
-    related_papers = []
-    rows = cursor.fetchall()
-    
-    for row in rows:
-        paper_data = dict(row)
-        embedding = np.frombuffer(paper_data.pop('embedding'), dtype=np.float32)
-        similarity = cosine_similarity(target_embedding, embedding)
+def get_papers_by_ids(paper_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Fetch paper metadata (without the embedding BLOB) for the given ids."""
+    papers = {}
+    if not paper_ids:
+        return papers
+    
+    cursor = get_connection(EMBEDDINGS_DB_PATH).cursor()
+    cursor.row_factory = sqlite3.Row
+    
+    # Stay well below SQLite's bound-parameter limit
+    chunk_size = 500
+    for i in range(0, len(paper_ids), chunk_size):
+        chunk = paper_ids[i:i+chunk_size]
+        placeholders = ','.join(['?'] * len(chunk))
+        cursor.execute(f'''
+        SELECT id, title, abstract, authors, categories, year
+        FROM paper_embeddings
+        WHERE id IN ({placeholders})
+        ''', chunk)
         
-        related_papers.append({
-            **paper_data,
-            'similarity': float(similarity)
-        })
-    
-    conn.close()
+        for row in cursor.fetchall():
+            papers[row['id']] = dict(row)
     
-    related_papers.sort(key=lambda x: x['similarity'], reverse=True)
-    return related_papers[:top_n]
+    return papers
 
-def fuzzy_search_related_papers(query_text: str, top_n: int = 10) -> List[Dict[str, Any]]:
-    query_embedding = generate_embeddings([query_text])[0]
+def attach_metadata(scored_ids: List[Tuple[str, float]]) -> List[Dict[str, Any]]:
+    """Turn (paper_id, similarity) pairs into paper dicts, keeping their order."""
+    papers = get_papers_by_ids([paper_id for paper_id, _ in scored_ids])
+    
+    results = []
+    for paper_id, similarity in scored_ids:
+        paper = papers.get(paper_id)
+        if paper is None:
+            continue
+        results.append({**paper, 'similarity': similarity})
+    return results
+
+def search_top_k(query_embedding: np.ndarray, k: int = 10,
+                 exclude_ids: Optional[set] = None,
+                 year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                 categories: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Bounded top-k retrieval against the in-memory store.
     
-    conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    Args:
+        query_embedding: Query vector (need not be normalized)
+        k: Number of papers to return
+        exclude_ids: Paper ids that must not appear in the results
+        year_range: Inclusive (min_year, max_year); either bound may be None
+        categories: Only return papers in at least one of these categories
     
-    cursor.execute('''
-    SELECT id, title, abstract, embedding, authors, categories, year
-    FROM paper_embeddings
-    ''')
+    Returns:
+        Up to k paper dicts sorted by similarity. Metadata is only fetched
+        for the returned papers.
+    """
+    scored = get_search_store().top_k(query_embedding, k, exclude_ids, year_range, categories)
+    return attach_metadata(scored)
+
+def fuzzy_search_top_k(query_text: str, k: int = 10,
+                       exclude_ids: Optional[set] = None,
+                       year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                       categories: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Embed query_text and return its k nearest papers; see search_top_k."""
+    query_embedding = embed_query(query_text)
+    return search_top_k(query_embedding, k, exclude_ids, year_range, categories)
+
+def search_top_k_batch(query_embeddings: np.ndarray, k: int = 10,
+                       exclude_ids: Optional[List[Optional[set]]] = None,
+                       year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                       categories: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Batched search_top_k: one top-k list per row of query_embeddings.
+    exclude_ids, if given, has one set per query. Metadata for all winners
+    is fetched in a single pass.
+    """
+    scored_lists = get_search_store().top_k_batch(query_embeddings, k, exclude_ids, year_range, categories)
     
-    related_papers = []
-    rows = cursor.fetchall()
+    papers = get_papers_by_ids(list({paper_id for scored in scored_lists for paper_id, _ in scored}))
+    return [
+        [{**papers[paper_id], 'similarity': similarity} for paper_id, similarity in scored if paper_id in papers]
+        for scored in scored_lists
+    ]
+
+def fuzzy_search_top_k_batch(query_texts: List[str], k: int = 10,
+                             exclude_ids: Optional[List[Optional[set]]] = None,
+                             year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                             categories: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    """Embed all query_texts in one generate_embeddings call and search them together."""
+    if not query_texts:
+        return []
+    query_embeddings = embed_queries(query_texts)
+    return search_top_k_batch(query_embeddings, k, exclude_ids, year_range, categories)
+
+def embed_papers(papers: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Return one embedding per paper (dicts with 'id' and 'abstract'). Stored
+    vectors are reused; the model only runs for papers that have not been
+    embedded yet.
+    """
+    vectors, found = get_search_store().get_vectors([paper.get('id') for paper in papers])
     
-    for row in rows:
-        paper_data = dict(row)
-        embedding = np.frombuffer(paper_data.pop('embedding'), dtype=np.float32)
-        similarity = cosine_similarity(query_embedding, embedding)
-        
-        related_papers.append({
-            **paper_data,
-            'similarity': float(similarity)
-        })
+    missing = np.nonzero(~found)[0]
+    if len(missing):
+        vectors[missing] = generate_embeddings([papers[i].get('abstract') or "" for i in missing])
+    return vectors
+
+def related_papers_top_k_batch(papers: List[Dict[str, Any]], k: int = 10,
+                               exclude_ids: Optional[List[Optional[set]]] = None,
+                               year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                               categories: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    """Like fuzzy_search_top_k_batch, but queries by paper using stored embeddings where possible."""
+    if not papers:
+        return []
+    return search_top_k_batch(embed_papers(papers), k, exclude_ids, year_range, categories)
+
+def paper_similarities(paper_id: str, other_ids: List[str]) -> Dict[str, float]:
+    """Cosine similarity between paper_id and each of other_ids, from stored vectors."""
+    store = get_search_store()
+    target = store.get_vector(paper_id)
+    if target is None or not other_ids:
+        return {}
+    
+    vectors, found = store.get_vectors(other_ids)
+    scores = vectors[found] @ target
+    return {other_id: float(score) for other_id, score in zip(np.asarray(other_ids)[found], scores)}
+
+def find_related_papers(paper_id: str, top_n: int = 10) -> List[Dict[str, Any]]:
+    target_embedding = get_search_store().get_vector(paper_id)
+    if target_embedding is None:
+        return []
     
-    conn.close()
+    scored = get_search_store().top_k(target_embedding, top_n, exclude_ids={paper_id})
+    return attach_metadata(scored)
+
+def fuzzy_search_related_papers(query_text: str, top_n: int = 10) -> List[Dict[str, Any]]:
+    query_embedding = embed_query(query_text)
     
-    related_papers.sort(key=lambda x: x['similarity'], reverse=True)
-    return related_papers[:top_n]
+    scored = get_search_store().top_k(query_embedding, top_n)
+    return attach_metadata(scored)
 
 def fuzzy_search_get_all_related_papers(query_text: str) -> List[Dict[str, Any]]:
-    query_embedding = generate_embeddings([query_text])[0]
+    """Rank the whole corpus against query_text. Prefer fuzzy_search_top_k when only the top results are used."""
+    query_embedding = embed_query(query_text)
     
-    conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    ids, similarities = get_store().all_scores(query_embedding)
+    order = np.argsort(-similarities)
+    
+    cursor = get_connection(EMBEDDINGS_DB_PATH).cursor()
+    cursor.row_factory = sqlite3.Row
     
     cursor.execute('''
-    SELECT id, title, abstract, embedding, authors, categories, year
+    SELECT id, title, abstract, authors, categories, year
     FROM paper_embeddings
     ''')
     
-    all_papers = []
-    rows = cursor.fetchall()
-    
-    for row in rows:
-        paper_data = dict(row)
-        embedding = np.frombuffer(paper_data.pop('embedding'), dtype=np.float32)
-        similarity = cosine_similarity(query_embedding, embedding)
-        
-        all_papers.append({
-            **paper_data,
-            'similarity': float(similarity)
-        })
+    papers = {row['id']: dict(row) for row in cursor.fetchall()}
     
-    conn.close()
+    all_papers = []
+    for row in order:
+        paper = papers.get(ids[row])
+        if paper is None:
+            continue
+        all_papers.append({**paper, 'similarity': float(similarities[row])})
     
-    all_papers.sort(key=lambda x: x['similarity'], reverse=True)
     return all_papers
 
 def add_paper_to_embeddings(paper: Dict[str, Any]) -> bool:
@@ -284,28 +858,8 @@ def add_paper_to_embeddings(paper: Dict[str, Any]) -> bool:
             print(f"Failed to generate embedding for paper {paper['id']}")
             return False
         
-        # Store in the database
-        conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
-        cursor = conn.cursor()
-        
-        embedding_blob = embeddings[0].tobytes()
-        
-        cursor.execute('''
-        INSERT OR REPLACE INTO paper_embeddings
-        (id, title, abstract, embedding, authors, categories, year)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            paper['id'],
-            paper['title'],
-            paper['abstract'],
-            embedding_blob,
-            paper.get('authors', ''),
-            paper.get('categories', ''),
-            paper.get('year', 0)
-        ))
-        
-        conn.commit()
-        conn.close()
+        # Store in the database and the in-memory store
+        store_embeddings([paper], embeddings)
         
         print(f"Successfully added paper {paper['id']} to embeddings database")
         return True
@@ -315,4 +869,34 @@ def add_paper_to_embeddings(paper: Dict[str, Any]) -> bool:
         return False
 
 if __name__ == "__main__":
-    process_all_papers()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build and maintain the paper embeddings")
+    parser.add_argument("command", nargs="?", default="embed", choices=["embed", "incremental", "build-index", "snapshot", "recall", "bench-precision", "bench-batching"],
+                        help="embed: embed all papers (default); incremental: embed only new or "
+                             "changed papers and drop removed ones; build-index: build the ANN index; "
+                             "snapshot: write the memory-mapped store loaded by the production server; "
+                             "recall: report ANN recall@k against exact search; "
+                             "bench-precision: compare float32/float16/int8 stores; "
+                             "bench-batching: compare fixed and length-bucketed model batches")
+    parser.add_argument("--lists", type=int, default=None, help="Number of IVF lists (default: 4*sqrt(n))")
+    parser.add_argument("-k", type=int, default=10, help="k for the recall report")
+    parser.add_argument("--fresh", action="store_true",
+                        help="embed: discard existing embeddings and the checkpoint instead of resuming")
+    args = parser.parse_args()
+    
+    if args.command == "incremental":
+        update_embeddings_incremental()
+    elif args.command == "build-index":
+        build_ann_index(args.lists)
+    elif args.command == "snapshot":
+        store = get_store()
+        store.load()
+        store.save_snapshot(EMBEDDING_SNAPSHOT_PATH)
+        print(f"Wrote {store.size} embeddings to {EMBEDDING_SNAPSHOT_PATH}")
+    elif args.command == "recall":
+        evaluate_ann_recall(args.k)
+    elif args.command == "bench-precision":
+        benchmark_precisions(args.k)
+    elif args.command == "bench-batching":
+        benchmark_batching()
+    else:
+        process_all_papers(args.fresh)
\ No newline at end of file
@@ -1,18 +1,34 @@
+import os
 import sqlite3
 import re
-import requests
-from typing import Set
+from typing import List, Optional, Tuple
 from datetime import datetime
 import sys
-import PyPDF2
+import time
 import json
-import fitz as pymupdf
+from concurrent.futures import ThreadPoolExecutor
+from pdf_fetcher import FetchError, PDF_POOL_SIZE, get_pdf_fetcher
+from connections_cache import ConnectionsCache
+from citation_graph import CitationGraph, GRAPH_PATH, get_citation_graph, apply_new_edges
+from db import connect, get_connection
 
 # Constants
-ARXIV_PDF_URL = "https://arxiv.org/pdf/"
-HEADERS = {'User-Agent': 'Mozilla/5.0'}
 ERROR_LOG_FILE = 'errors.txt'
-db_path ='papers.db'
+# Fetch a PDF inside a request when a paper has no extracted references yet.
+# Set PAPERWEB_LAZY_EXTRACTION=0 once crawl_references.py has covered the corpus.
+LAZY_EXTRACTION = os.environ.get('PAPERWEB_LAZY_EXTRACTION', '1') == '1'
+# Seconds before a paper whose extraction failed is fetched again in a request
+EXTRACTION_RETRY_AFTER = int(os.environ.get('PAPERWEB_EXTRACTION_RETRY_AFTER', str(24 * 3600)))
+# PDFs fetched per /api/connections request beyond the root paper. At the
+# PDF rate limit (one every few seconds) this keeps a degree 2-3 expansion
+# well inside the gunicorn timeout; papers over the limit are left for
+# crawl_references.py or a later view.
+MAX_REQUEST_EXTRACTIONS = int(os.environ.get('PAPERWEB_MAX_REQUEST_EXTRACTIONS', '8'))
+# Resolved against this file, like api.py's DB_PATH, so the module opens the
+# same database whatever the working directory
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'papers.db')
+db_path = DB_PATH
 
 # Array of all possible arXiv reference patterns
 ARXIV_PATTERNS = [
@@ -39,6 +55,13 @@ ARXIV_PATTERNS = [
     r'cs\s?\.?\s?[A-Za-z]{2}/\d{7}',       # cs CL/1234567 or cs. CL/1234567
 ]
 
+# Single-pass equivalent of ARXIV_PATTERNS: every cs pattern above is a
+# case of the first alternative, every new-style one contains the second
+ARXIV_ID_PATTERN = re.compile(r'cs(?:\s?\.?\s?[A-Za-z]{2})?/(\d{7})|(\d{4}\.\d{4,5})', re.IGNORECASE)
+VALID_ARXIV_ID = re.compile(r'^(?:cs/\d{7}|\d{4}\.\d{4,5})$')
+REFERENCES_HEADING = re.compile(r'^[ \t]*(?:\d+\.?[ \t]*)?(?:references|bibliography|literature cited)[ \t]*$',
+                                re.IGNORECASE | re.MULTILINE)
+
 def log_error(paper_id: str, error_type: str, message: str):
     """Log errors to the error file with timestamp."""
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -46,50 +69,34 @@ def log_error(paper_id: str, error_type: str, message: str):
         f.write(f"[{timestamp}] {error_type} for paper {paper_id}: {message}\n")
 
 def get_pdf_text(arxiv_id: str) -> str:
-    """Get text from ArXiv PDF with improved error handling and logging."""
-    url = f"{ARXIV_PDF_URL}{arxiv_id}"
-    
+    """Get text from an arXiv PDF through the shared, cached and rate-limited fetcher."""
     try:
-        head_response = requests.head(url, timeout=10)
-        
-        if head_response.status_code != 200:
-            log_error(arxiv_id, "HTTP Error", f"Status code: {head_response.status_code}")
-            return ""
-            
-        response = requests.get(url, timeout=30)
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Save the PDF temporarily
-            with open('temp.pdf', 'wb') as f:
-                f.write(response.content)
-
-            try:
-                # Extract text using PyMuPDF
-                doc = pymupdf.open('temp.pdf')
-                text = ""
-                for page in doc:
-                    text += page.get_text()
-                doc.close()
-                return text
-            except Exception as e:
-                log_error(arxiv_id, "PDF Text Extraction Error", str(e))
-                return ""
-        else:
-            log_error(arxiv_id, "HTTP Error", f"Status code: {response.status_code}")
-            return ""
-            
-    except requests.exceptions.RequestException as e:
-        log_error(arxiv_id, "HTTP Request Error", str(e))
-        return ""
-    except PyPDF2.PdfReadError as e:
-        log_error(arxiv_id, "PDF Read Error", str(e))
+        return get_pdf_fetcher().get_text(arxiv_id)
+    except FetchError as e:
+        log_error(arxiv_id, "PDF Fetch Error", str(e))
         return ""
     except Exception as e:
         log_error(arxiv_id, "PDF Processing Error", str(e))
         return ""
 
-def extract_normalized_arxiv_ids(text: str) -> Set[str]:
+def references_section(text: str) -> str:
+    """Text from the last References/Bibliography heading on, or all of it if there is none."""
+    headings = list(REFERENCES_HEADING.finditer(text))
+    return text[headings[-1].start():] if headings else text
+
+def extract_normalized_arxiv_ids(text: str, references_only: bool = False) -> List[str]:
+    """
+    Every arXiv id in text, in one pass of ARXIV_ID_PATTERN, once each in
+    order of first appearance. Old-style ids become cs/NNNNNNN and version
+    suffixes are never part of the match.
+    """
+    if references_only:
+        text = references_section(text)
+    return list(dict.fromkeys(f"cs/{old_style}" if old_style else new_style
+                              for old_style, new_style in ARXIV_ID_PATTERN.findall(text)))
+
+def extract_arxiv_ids_multipass(text: str) -> List[str]:
+    """Previous extractor, one finditer pass per ARXIV_PATTERNS entry. Kept for parity checks."""
     found_ids = set()
     
     for pattern in ARXIV_PATTERNS:
@@ -119,185 +126,452 @@ def extract_normalized_arxiv_ids(text: str) -> Set[str]:
     
     return list(found_ids)
 
-def filter_existing_references(references, db_path: str = 'papers.db'):
+def compare_extractors(texts):
+    """
+    Run both extractors over texts. Reports timings and the papers where the
+    single-pass extractor misses a well-formed id the multi-pass one found
+    (the old normalization also emits fragments such as 'ar' for 'arxiv:').
+    """
+    single_time = multi_time = 0.0
+    mismatches = []
+    for name, text in texts:
+        start = time.perf_counter()
+        new_ids = set(extract_normalized_arxiv_ids(text))
+        single_time += time.perf_counter() - start
+        
+        start = time.perf_counter()
+        old_ids = {i for i in extract_arxiv_ids_multipass(text) if VALID_ARXIV_ID.match(i)}
+        multi_time += time.perf_counter() - start
+        
+        if not old_ids <= new_ids:
+            mismatches.append((name, sorted(old_ids - new_ids)))
+    
+    return {
+        "texts": len(texts),
+        "megabytes": sum(len(text) for _, text in texts) / 1e6,
+        "single_pass_seconds": single_time,
+        "multi_pass_seconds": multi_time,
+        "mismatches": mismatches
+    }
+
+# Candidate ids resolved per query; each one costs up to three bound parameters
+RESOLVE_CHUNK_SIZE = 250
+
+def filter_existing_references(references, db_path: str = DB_PATH):
+    """
+    The references that are papers in the database, either exactly or as a
+    versioned id (1234.5678 matches 1234.5678v1). Resolved with one query per
+    RESOLVE_CHUNK_SIZE candidates: an IN list for exact ids plus a primary-key
+    range (ref+'v' <= id < ref+'w') per candidate for versioned ones, so
+    SQLite answers it from the index instead of a LIKE table scan.
+    """
+    references = list(dict.fromkeys(references))
     existing_references = set()
     
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        cursor = get_connection(db_path).cursor()
         
-        for ref in references:
-            # Check both the exact ID and versioned IDs (e.g., 1234.5678 and 1234.5678v1)
-            cursor.execute("""
-                SELECT 1 FROM papers 
-                WHERE id = ? OR id LIKE ? || '%'
-            """, (ref, f"{ref}v"))
+        for i in range(0, len(references), RESOLVE_CHUNK_SIZE):
+            chunk = references[i:i+RESOLVE_CHUNK_SIZE]
+            placeholders = ','.join(['?'] * len(chunk))
+            ranges = ' OR '.join(['(id >= ? AND id < ?)'] * len(chunk))
+            params = list(chunk)
+            for ref in chunk:
+                params.extend((f"{ref}v", f"{ref}w"))
             
-            if cursor.fetchone():
-                existing_references.add(ref)
+            cursor.execute(f"SELECT id FROM papers WHERE id IN ({placeholders}) OR {ranges}", params)
+            found = [row[0] for row in cursor.fetchall()]
+            
+            chunk_set = set(chunk)
+            for paper_id in found:
+                if paper_id in chunk_set:
+                    existing_references.add(paper_id)
+                else:
+                    base_id = paper_id.rsplit('v', 1)[0]
+                    if base_id in chunk_set:
+                        existing_references.add(base_id)
                 
     except sqlite3.Error as e:
         pass
-    finally:
-        if conn:
-            conn.close()
     
-    return list(existing_references)
+    return [ref for ref in references if ref in existing_references]
 
-def process_paper(paper_id: str):
-    pdf_text = get_pdf_text(paper_id)
-    if not pdf_text:
-        return []
+def setup_citations_table(db_path: str = DB_PATH):
+    """
+    Create the citations edge table. The first time it is created, edges are
+    migrated from the legacy JSON papers.connected_papers column.
+    """
+    conn = connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'citations'")
+        exists = cursor.fetchone() is not None
+        
+        # src cites dst; the primary key serves forward lookups and the
+        # (dst, src) index serves "who cites X"
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS citations (
+                src TEXT NOT NULL,
+                dst TEXT NOT NULL,
+                PRIMARY KEY (src, dst)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_citations_dst ON citations(dst, src)")
+        
+        # One row per paper whose references have been extracted (or tried),
+        # so neither the crawler nor the web path repeats finished work
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reference_extraction (
+                paper_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                n_refs INTEGER DEFAULT 0,
+                error TEXT,
+                updated_at TEXT
+            )
+        """)
+        # Server workers poll for recently finished extractions (sync_citation_graph)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_reference_extraction_updated ON reference_extraction(updated_at)")
+        conn.commit()
         
-    references = extract_normalized_arxiv_ids(pdf_text)
+        if not exists:
+            migrated = migrate_connected_papers(conn)
+            print(f"Created citations table and migrated {migrated} edges from connected_papers")
+    finally:
+        conn.close()
+
+def migrate_connected_papers(conn) -> int:
+    """Copy every edge from the JSON connected_papers column into citations."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, connected_papers FROM papers
+        WHERE connected_papers IS NOT NULL AND connected_papers NOT IN ('', '[]')
+    """)
     
-    # Remove self-references
-    paper_base_id = paper_id.split('v')[0]
-    references = [ref for ref in references if ref != paper_base_id]
+    edges = []
+    for paper_id, connected in cursor.fetchall():
+        try:
+            edges.extend((paper_id, ref) for ref in json.loads(connected) if ref != paper_id)
+        except (json.JSONDecodeError, TypeError):
+            continue
     
-    return references
+    before = conn.total_changes
+    conn.executemany("INSERT OR IGNORE INTO citations (src, dst) VALUES (?, ?)", edges)
+    conn.commit()
+    return conn.total_changes - before
+
+_citations_ready = set()
+_connections_caches = {}
+
+def get_connections_cache(db_path: str = DB_PATH) -> ConnectionsCache:
+    # Keyed by absolute path: api.py and main() name the same file differently
+    key = os.path.abspath(db_path)
+    if key not in _connections_caches:
+        _connections_caches[key] = ConnectionsCache(db_path)
+    return _connections_caches[key]
 
-def update_paper_connections(paper_id: str, references, db_path: str = 'papers.db') -> int:
+def ensure_citations_table(db_path: str = DB_PATH):
+    if db_path not in _citations_ready:
+        setup_citations_table(db_path)
+        _citations_ready.add(db_path)
+
+def update_paper_connections(paper_id: str, references, db_path: str = DB_PATH) -> int:
+    """Record that paper_id cites references. Returns the number of new edges."""
     if not references:
         return 0
-        
+    
+    ensure_citations_table(db_path)
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Get current connections
-        cursor.execute("SELECT connected_papers FROM papers WHERE id = ?", (paper_id,))
-        result = cursor.fetchone()
-        
-        current_connections = set()
-        if result and result[0]:
-            try:
-                current_connections = set(json.loads(result[0]))
-            except json.JSONDecodeError:
-                current_connections = set()
-        
-        # Calculate new connections to add
-        new_connections = set(references) - set(current_connections)
-        if not new_connections:
-            return 0
-            
-        # Update the database
-        updated_connections = list(current_connections.union(new_connections))
-        cursor.execute("""
-            UPDATE papers 
-            SET connected_papers = ?
-            WHERE id = ?
-        """, (json.dumps(updated_connections), paper_id))
-        
-        conn.commit()
-        return len(new_connections)
+        conn = get_connection(db_path)
+        before = conn.total_changes
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO citations (src, dst) VALUES (?, ?)",
+                [(paper_id, ref) for ref in set(references) if ref != paper_id]
+            )
+        added = conn.total_changes - before
+        if added:
+            apply_new_edges(db_path, paper_id, list(references))
+            get_connections_cache(db_path).invalidate([paper_id])
+        return added
         
     except sqlite3.Error:
-        if conn:
-            conn.rollback()
         return 0
-    finally:
-        if conn:
-            conn.close()
 
-def get_paper_connections(paper_id: str, db_path: str = 'papers.db'):
+def get_extraction_status(paper_id: str, db_path: str = DB_PATH):
+    """'done', 'missing', 'error' or None if references were never extracted."""
+    return get_extraction_statuses([paper_id], db_path).get(paper_id)
+
+def get_extraction_statuses(paper_ids, db_path: str = DB_PATH):
+    """{paper_id: status} for the papers that have an extraction status."""
+    return {paper_id: record[0] for paper_id, record in get_extraction_records(paper_ids, db_path).items()}
+
+def get_extraction_records(paper_ids, db_path: str = DB_PATH):
+    """{paper_id: (status, n_refs, updated_at)} for the papers that have an extraction status."""
+    ensure_citations_table(db_path)
+    paper_ids = list(paper_ids)
+    records = {}
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT connected_papers FROM papers 
-            WHERE id = ?
-        """, (paper_id,))
-        
-        result = cursor.fetchone()
-        if result and result[0]:
-            try:
-                return list(json.loads(result[0]))
-            except json.JSONDecodeError:
-                return []
-        return []
-        
+        conn = get_connection(db_path)
+        for i in range(0, len(paper_ids), 500):
+            chunk = paper_ids[i:i+500]
+            placeholders = ','.join(['?'] * len(chunk))
+            for paper_id, status, n_refs, updated_at in conn.execute(
+                f"SELECT paper_id, status, n_refs, updated_at FROM reference_extraction WHERE paper_id IN ({placeholders})", chunk
+            ):
+                records[paper_id] = (status, n_refs or 0, updated_at)
+        return records
     except sqlite3.Error:
-        return []
-    finally:
-        if conn:
-            conn.close()
+        return records
+
+def failed_recently(record, retry_after: int = EXTRACTION_RETRY_AFTER) -> bool:
+    """True if an extraction record is an error less than retry_after seconds old."""
+    status, _, updated_at = record
+    if status != 'error' or not updated_at:
+        return False
+    try:
+        failed_at = datetime.strptime(updated_at, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return False
+    return (datetime.now() - failed_at).total_seconds() < retry_after
+
+def load_stored_connections(paper_ids, db_path: str = DB_PATH):
+    """Outgoing edges for many papers read from the citations table: {src: [dst, ...]}."""
+    paper_ids = list(paper_ids)
+    connections = {}
+    try:
+        conn = get_connection(db_path)
+        for i in range(0, len(paper_ids), 500):
+            chunk = paper_ids[i:i+500]
+            placeholders = ','.join(['?'] * len(chunk))
+            for src, dst in conn.execute(
+                f"SELECT src, dst FROM citations WHERE src IN ({placeholders})", chunk
+            ):
+                connections.setdefault(src, []).append(dst)
+        return connections
+    except sqlite3.Error:
+        return connections
+
+def record_extraction(paper_id: str, status: str, n_refs: int = 0, error: str = None,
+                      db_path: str = DB_PATH):
+    ensure_citations_table(db_path)
+    try:
+        conn = get_connection(db_path)
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO reference_extraction (paper_id, status, n_refs, error, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (paper_id, status, n_refs, error, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    except sqlite3.Error:
+        pass
+
+def get_paper_connections(paper_id: str, db_path: str = DB_PATH):
+    """Papers cited by paper_id."""
+    return get_connections_bulk([paper_id], db_path).get(paper_id, [])
 
-def process_connections(first_degree_refs):
-    second_degree_refs = dict()
-    for ref_paper_id in first_degree_refs:
+def get_connections_bulk(paper_ids, db_path: str = DB_PATH):
+    """Outgoing edges for many papers from the in-memory graph: {src: [dst, ...]}."""
+    ensure_citations_table(db_path)
+    return get_citation_graph(db_path).neighbors_many(list(paper_ids))
+
+def get_citing_papers(paper_id: str, db_path: str = DB_PATH):
+    """Papers that cite paper_id (reverse edges of the in-memory graph)."""
+    ensure_citations_table(db_path)
+    return get_citation_graph(db_path).neighbors(paper_id, reverse=True)
+
+def get_or_extract_connections(paper_id: str):
+    """Return a paper's stored references, extracting them from its PDF the first time."""
+    return process_connections([paper_id]).get(paper_id, [])
+
+def process_connections(first_degree_refs, max_extractions: Optional[int] = None):
+    """
+    {paper_id: references} for many papers. Stored edges come from the graph,
+    or from the citations table for edges another process wrote after the
+    graph was loaded. Papers never extracted before (and only while
+    LAZY_EXTRACTION is on) or whose last attempt failed more than
+    EXTRACTION_RETRY_AFTER seconds ago have their PDFs fetched concurrently,
+    at most max_extractions of them, and all ids found in them are resolved
+    against the database together.
+    """
+    return resolve_connections(first_degree_refs, max_extractions)[0]
+
+def resolve_connections(first_degree_refs, max_extractions: Optional[int] = None) -> Tuple[dict, int, List[str]]:
+    """process_connections, plus the number of PDFs fetched and the papers left unextracted."""
+    first_degree_refs = list(dict.fromkeys(first_degree_refs))
+    second_degree_refs = get_connections_bulk(first_degree_refs)
+    
+    unresolved = [ref for ref in first_degree_refs if ref not in second_degree_refs]
+    if not unresolved:
+        return second_degree_refs, 0, []
+    
+    # A paper marked done with references but absent from the graph had its
+    # edges written by another process (the crawler or another worker)
+    # after this graph was loaded: read them from the citations table
+    records = get_extraction_records(unresolved)
+    stale = [ref for ref in unresolved if ref in records and records[ref][0] == 'done' and records[ref][1] > 0]
+    for ref_paper_id, refs in load_stored_connections(stale).items():
+        apply_new_edges(db_path, ref_paper_id, refs)
+        second_degree_refs[ref_paper_id] = refs
+    
+    # Papers that failed recently are not retried inside a request: each
+    # attempt waits on the PDF rate limit and delays the response
+    pending = [ref for ref in unresolved
+               if ref not in records or (records[ref][0] != 'done' and not failed_recently(records[ref]))]
+    if not LAZY_EXTRACTION or not pending:
+        return second_degree_refs, 0, []
+    
+    deferred = []
+    if max_extractions is not None and len(pending) > max_extractions:
+        pending, deferred = pending[:max(0, max_extractions)], pending[max(0, max_extractions):]
+    if not pending:
+        return second_degree_refs, 0, deferred
+    
+    with ThreadPoolExecutor(max_workers=min(len(pending), PDF_POOL_SIZE)) as executor:
+        texts = dict(zip(pending, executor.map(get_pdf_text, pending)))
+    
+    extracted = {}
+    for ref_paper_id, text in texts.items():
+        if not text:
+            record_extraction(ref_paper_id, 'error', error="No text from PDF")
+            continue
+        base_id = ref_paper_id.split('v')[0]
+        extracted[ref_paper_id] = [r for r in extract_normalized_arxiv_ids(text) if r != base_id]
+    
+    # Filter to only papers that exist in our database, in one pass for all of them
+    existing = set(filter_existing_references({r for refs in extracted.values() for r in refs}))
+    
+    for ref_paper_id, refs in extracted.items():
         try:
-            # Skip if we've already processed this paper
-            check_if_processed = get_paper_connections(ref_paper_id)
-            if check_if_processed:
-                second_degree_refs[ref_paper_id] = list(check_if_processed)
-                continue
-                
-            # Get references for this reference paper
-            ref_text = get_pdf_text(ref_paper_id)
-            if not ref_text:
-                continue
-                
-            refs_of_ref = extract_normalized_arxiv_ids(ref_text)
-            refs_of_ref = {r for r in refs_of_ref if r != ref_paper_id.split('v')[0]}
-            
-            # Filter to only papers that exist in our database
-            existing_refs_of_ref = filter_existing_references(refs_of_ref)
-            
-            # Update this reference paper's connections
-            if existing_refs_of_ref:
-                update_paper_connections(ref_paper_id, existing_refs_of_ref)
-                second_degree_refs[ref_paper_id] = list(existing_refs_of_ref)
-                
+            refs = [r for r in refs if r in existing]
+            if refs:
+                update_paper_connections(ref_paper_id, refs)
+                second_degree_refs[ref_paper_id] = refs
+            record_extraction(ref_paper_id, 'done', len(refs))
         except Exception as e:
-            log_error(ref_paper_id, "Second-degree processing error", str(e))
+            log_error(ref_paper_id, "Connection processing error", str(e))
             continue
 
-    return second_degree_refs
+    return second_degree_refs, len(pending), deferred
 
-def main(paper_id):
-    with open(ERROR_LOG_FILE, 'w') as f:
-        f.write(f"Reference extraction log started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+DEGREE_KEYS = ['first_degree', 'second_degree', 'third_degree']
+MAX_DEGREE = len(DEGREE_KEYS)
+MAX_GRAPH_NODES = 500
+
+def expand_connections(paper_id: str, degree: int = 1, max_nodes: int = MAX_GRAPH_NODES):
+    """
+    Breadth-first citation expansion around paper_id.
+    
+    Only the requested number of hops is computed, so degree 1 never looks
+    at a neighbour's references. Expansion stops adding new papers once
+    max_nodes distinct papers (including the source) are in the result;
+    edges between papers already in the result are still kept.
+    
+    Returns the same shape as main(): first_degree with source details,
+    then second_degree / third_degree dicts of {paper_id: [references]}
+    up to the requested degree, plus a truncated flag and the number of
+    papers whose extraction was deferred (see MAX_REQUEST_EXTRACTIONS).
+    """
+    degree = max(1, min(degree, MAX_DEGREE))
+    truncated = False
     
     # Get first degree connections with full details
-    references = get_paper_connections(paper_id)
+    references = get_or_extract_connections(paper_id)
     
-    if not references:
-        references = process_paper(paper_id)
-        references = filter_existing_references(references)
+    visited = {paper_id}
+    first_degree = []
+    for ref in references:
+        if ref in visited:
+            continue
+        if len(visited) >= max_nodes:
+            truncated = True
+            break
+        visited.add(ref)
+        first_degree.append(ref)
     
-    # Get second degree connections with full details
-    second_degree_refs = process_connections(references)
+    result = {
+        'first_degree': {
+            "source_id": paper_id,
+            "source_title": get_paper_title(paper_id),
+            "connections": first_degree
+        }
+    }
     
-    # Get third degree connections with full details
-    sec_degree_papers = [paper for paperset in second_degree_refs.values() for paper in paperset]
+    frontier = first_degree
+    extraction_budget = MAX_REQUEST_EXTRACTIONS
+    deferred = 0
+    for depth in range(2, degree + 1):
+        level = {}
+        next_frontier = []
+        # One vectorized CSR lookup for the whole frontier; only papers with
+        # no stored edges fall back to (batched) PDF extraction, and only
+        # while the request's extraction budget lasts
+        try:
+            stored, fetched, skipped = resolve_connections(frontier, extraction_budget)
+            extraction_budget -= fetched
+            deferred += len(skipped)
+        except Exception as e:
+            log_error(paper_id, f"Degree {depth} processing error", str(e))
+            stored = get_connections_bulk(frontier)
+        for node in frontier:
+            if len(visited) >= max_nodes:
+                truncated = True
+                break
+            refs = stored.get(node, [])
+            
+            kept = []
+            for ref in refs:
+                if ref in visited:
+                    kept.append(ref)
+                elif len(visited) < max_nodes:
+                    visited.add(ref)
+                    next_frontier.append(ref)
+                    kept.append(ref)
+                else:
+                    truncated = True
+            if kept:
+                level[node] = kept
+        
+        result[DEGREE_KEYS[depth - 1]] = level
+        frontier = next_frontier
     
-    third_degree_refs = process_connections(sec_degree_papers)
+    result['truncated'] = truncated
+    # Papers whose references were not extracted to keep the request short
+    result['deferred'] = deferred
+    return result
+
+def main(paper_id, degree: int = MAX_DEGREE, max_nodes: int = MAX_GRAPH_NODES):
+    """
+    Connections response for paper_id, served from the materialized cache
+    when possible. Responses are cached unless the source had no
+    connections, so a failed first extraction is retried on a later view
+    (once EXTRACTION_RETRY_AFTER has passed), or some extractions were
+    deferred, so each later view extracts more of the neighbourhood.
+    """
+    degree = max(1, min(degree, MAX_DEGREE))
+    cache = get_connections_cache(db_path)
+    cache.record_view(paper_id)
     
-    # Format the first degree connections to match expected structure
-    first_degree_formatted = {
-        "source_id": paper_id,
-        "source_title": get_paper_title(paper_id),
-        "connections": references
-    }
+    result = cache.get(paper_id, degree, max_nodes)
+    if result is not None:
+        return result
     
-    result = {
-        'first_degree': first_degree_formatted,
-        'second_degree': second_degree_refs,
-        'third_degree': third_degree_refs
-    }
+    result = expand_connections(paper_id, degree, max_nodes)
+    if result['first_degree']['connections'] and not result['deferred']:
+        cache.put(paper_id, degree, max_nodes, result)
     
-    print(f"DEBUG: Connection structure format - first_degree: {type(result['first_degree'])}, second_degree: {type(result['second_degree'])}, third_degree: {type(result['third_degree'])}")
-    print(f"DEBUG: Second degree keys sample: {list(result['second_degree'].keys())[:3] if result['second_degree'] else []}")
+    print(f"DEBUG: Expanded {paper_id} to degree {degree}: {sum(len(result.get(key, {})) for key in DEGREE_KEYS[1:])} expanded nodes, truncated={result['truncated']}, deferred={result['deferred']}")
     
     return result
 
+def warm_connections_cache(n: int = 100, degrees=range(1, MAX_DEGREE + 1),
+                           max_nodes: int = MAX_GRAPH_NODES) -> int:
+    """Precompute responses for the n most viewed papers."""
+    return get_connections_cache(db_path).warm(expand_connections, n, degrees, max_nodes)
+
 def get_paper_title(paper_id):
     """Helper function to get just the paper title"""
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        cursor = get_connection(db_path).cursor()
         cursor.execute("SELECT title FROM papers WHERE id = ?", (paper_id,))
         row = cursor.fetchone()
         return row[0] if row else f"Paper {paper_id}"
@@ -306,8 +580,7 @@ def get_paper_title(paper_id):
 
 def get_paper_details(paper_id):
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        cursor = get_connection(db_path).cursor()
         cursor.execute("""
             SELECT id, title, authors, abstract, categories, year, month, day
             FROM papers 
@@ -331,8 +604,42 @@ def get_paper_details(paper_id):
         return None
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python script.py <paper_id>")
+    if len(sys.argv) == 2 and sys.argv[1] == "--migrate":
+        conn = connect(db_path)
+        setup_citations_table(db_path)
+        print(f"Migrated {migrate_connected_papers(conn)} new edges from connected_papers")
+        conn.close()
+        sys.exit(0)
+    if len(sys.argv) == 2 and sys.argv[1] == "--build-graph":
+        ensure_citations_table(db_path)
+        CitationGraph.build_from_db(db_path).save(GRAPH_PATH)
+        sys.exit(0)
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "--warm":
+        n = int(sys.argv[2]) if len(sys.argv) == 3 else 100
+        print(f"Warmed {warm_connections_cache(n)} cached connection responses")
+        sys.exit(0)
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "--bench-extract":
+        # Compare extractors on cached PDF texts (pdf_cache/**/*.txt by default)
+        text_dir = sys.argv[2] if len(sys.argv) == 3 else get_pdf_fetcher().cache_dir
+        texts = []
+        for root, _, files in os.walk(text_dir):
+            for name in files:
+                if name.endswith('.txt'):
+                    with open(os.path.join(root, name), encoding='utf-8', errors='replace') as f:
+                        texts.append((name, f.read()))
+        report = compare_extractors(texts)
+        print(f"{report['texts']} texts, {report['megabytes']:.1f} MB")
+        print(f"single pass: {report['single_pass_seconds']:.3f}s, multi pass: {report['multi_pass_seconds']:.3f}s")
+        print(f"{len(report['mismatches'])} texts where the single pass missed an id")
+        for name, missing in report['mismatches'][:20]:
+            print(f"  {name}: {missing}")
+        sys.exit(0)
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python script.py <paper_id> [degree]")
+        print("       python script.py --migrate")
+        print("       python script.py --build-graph")
+        print("       python script.py --bench-extract [text_dir]")
+        print("       python script.py --warm [n_papers]")
         sys.exit(1)
     paper_id = sys.argv[1]
-    main(paper_id)
+    main(paper_id, int(sys.argv[2]) if len(sys.argv) == 3 else MAX_DEGREE)
@@ -0,0 +1,183 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from graph_ranking import get_graph_ranker
+from db import get_connection
+
+# Default and hard upper bound on nodes per graph response
+DEFAULT_PAYLOAD_NODES = 150
+MAX_PAYLOAD_NODES = 500
+
+RANKINGS = ('degree', 'pagerank', 'similarity')
+
+LEVEL_KEYS = ['first_degree', 'second_degree', 'third_degree']
+
+
+def neighbourhood_edges(connections: Dict[str, Any]) -> Tuple[str, Dict[str, int], List[Tuple[str, str]]]:
+    """
+    Flatten a get_connections.main() response into (source_id, {paper_id:
+    level}, [(src, dst), ...]). Each paper's level is the first hop at which
+    it appears; the source is level 0.
+    """
+    first_degree = connections.get('first_degree', {})
+    source_id = first_degree.get('source_id')
+    levels = {source_id: 0}
+    edges = []
+
+    for ref in first_degree.get('connections', []):
+        ref = ref['id'] if isinstance(ref, dict) else ref
+        levels.setdefault(ref, 1)
+        edges.append((source_id, ref))
+
+    for depth, key in enumerate(LEVEL_KEYS[1:], start=2):
+        for node, refs in connections.get(key, {}).items():
+            for ref in refs:
+                ref = ref['id'] if isinstance(ref, dict) else ref
+                levels.setdefault(ref, depth)
+                edges.append((node, ref))
+
+    return source_id, levels, edges
+
+
+def node_scores(source_id: str, paper_ids: List[str], rank: str, db_path: str,
+                similarity_fn: Optional[Callable[[str, List[str]], Dict[str, float]]] = None) -> Dict[str, float]:
+    """Score used to prune nodes: citation degree, PageRank percentile or cosine to the source."""
+    if rank == 'similarity' and similarity_fn is not None:
+        return similarity_fn(source_id, paper_ids)
+
+    ranker = get_graph_ranker(db_path)
+    if rank == 'pagerank':
+        return dict(zip(paper_ids, ranker.pagerank_score(paper_ids).tolist()))
+    return dict(zip(paper_ids, ranker.citation_degree(paper_ids).tolist()))
+
+
+def order_nodes(source_id: str, levels: Dict[str, int], edges: List[Tuple[str, str]],
+                scores: Dict[str, float]) -> List[str]:
+    """
+    Source first, then each level best score first. A node is only placed
+    after one of the nodes linking to it, so any prefix of the order is a
+    connected graph and can be used as a node budget.
+    """
+    parents: Dict[str, List[str]] = {}
+    for src, dst in edges:
+        parents.setdefault(dst, []).append(src)
+
+    order = [source_id]
+    placed = {source_id}
+    for level in range(1, len(LEVEL_KEYS) + 1):
+        candidates = [node for node, node_level in levels.items()
+                      if node_level == level and any(p in placed for p in parents.get(node, []))]
+        candidates.sort(key=lambda node: -scores.get(node, 0.0))
+        order.extend(candidates)
+        placed.update(candidates)
+    return order
+
+
+def fetch_node_metadata(paper_ids: List[str], db_path: str) -> Dict[str, Dict[str, Any]]:
+    """Title, year and categories for many papers, one query per 500 ids."""
+    metadata = {}
+    conn = get_connection(db_path)
+    for i in range(0, len(paper_ids), 500):
+        chunk = paper_ids[i:i+500]
+        placeholders = ','.join(['?'] * len(chunk))
+        for row in conn.execute(f'''
+            SELECT id, title, year, categories FROM papers WHERE id IN ({placeholders})
+        ''', chunk):
+            metadata[row[0]] = {
+                "title": row[1].strip() if row[1] else f"Paper {row[0]}",
+                "year": row[2],
+                "categories": row[3]
+            }
+    return metadata
+
+
+def build_graph_payload(connections: Dict[str, Any], budget: int = DEFAULT_PAYLOAD_NODES,
+                        rank: str = 'degree', offset: int = 0, db_path: str = 'papers.db',
+                        similarity_fn: Optional[Callable[[str, List[str]], Dict[str, float]]] = None) -> Dict[str, Any]:
+    """
+    Compact graph for a connections response.
+
+    Nodes are ordered by order_nodes and paged by offset/budget; every node
+    carries its title and metadata inline. Edges are [i, j] pairs of
+    positions in that global order (i cites j), sent with the page holding
+    the later of their two endpoints, so pages can be appended client-side.
+    """
+    budget = max(1, min(budget, MAX_PAYLOAD_NODES))
+    source_id, levels, edges = neighbourhood_edges(connections)
+    scores = node_scores(source_id, [node for node in levels if node != source_id], rank, db_path, similarity_fn)
+    order = order_nodes(source_id, levels, edges, scores)
+    position = {node: i for i, node in enumerate(order)}
+
+    page = order[offset:offset + budget]
+    metadata = fetch_node_metadata(page, db_path)
+    nodes = []
+    for node in page:
+        info = metadata.get(node, {"title": f"Paper {node}", "year": None, "categories": None})
+        nodes.append({
+            "id": node,
+            "title": info["title"],
+            "year": info["year"],
+            "categories": info["categories"],
+            "level": levels[node],
+            "score": scores.get(node)
+        })
+
+    end = offset + len(page)
+    page_edges = sorted({
+        (position[src], position[dst]) for src, dst in edges
+        if src in position and dst in position and offset <= max(position[src], position[dst]) < end
+    })
+
+    return {
+        "source_id": source_id,
+        "rank": rank,
+        "offset": offset,
+        "total_nodes": len(order),
+        "next_offset": end if end < len(order) else None,
+        "nodes": nodes,
+        "edges": [list(edge) for edge in page_edges],
+        "truncated": connections.get('truncated', False) or end < len(order),
+        "deferred": connections.get('deferred', 0)
+    }
+
+
+def prune_connections(connections: Dict[str, Any], budget: int = DEFAULT_PAYLOAD_NODES,
+                      rank: str = 'degree', db_path: str = 'papers.db',
+                      similarity_fn: Optional[Callable[[str, List[str]], Dict[str, float]]] = None) -> Dict[str, Any]:
+    """
+    The same neighbourhood in the /api/connections shape, cut to the budget
+    best nodes, with every connection as {"id", "title"} so clients never
+    need a follow-up request per node for titles.
+    """
+    budget = max(1, min(budget, MAX_PAYLOAD_NODES))
+    source_id, levels, edges = neighbourhood_edges(connections)
+    scores = node_scores(source_id, [node for node in levels if node != source_id], rank, db_path, similarity_fn)
+    kept = set(order_nodes(source_id, levels, edges, scores)[:budget])
+    metadata = fetch_node_metadata(list(kept), db_path)
+
+    def entry(node):
+        return {"id": node, "title": metadata.get(node, {}).get("title", f"Paper {node}")}
+
+    first_degree = connections['first_degree']
+    result = {
+        'first_degree': {
+            "source_id": source_id,
+            "source_title": first_degree.get('source_title'),
+            "connections": [entry(node) for node, level in levels.items() if level == 1 and node in kept]
+        }
+    }
+    for key in LEVEL_KEYS[1:]:
+        if key not in connections:
+            continue
+        level = {}
+        for node, refs in connections[key].items():
+            if node not in kept:
+                continue
+            refs = [ref['id'] if isinstance(ref, dict) else ref for ref in refs]
+            refs = [entry(ref) for ref in refs if ref in kept]
+            if refs:
+                level[node] = refs
+        result[key] = level
+
+    result['truncated'] = connections.get('truncated', False) or len(kept) < len(levels)
+    result['deferred'] = connections.get('deferred', 0)
+    return result
@@ -0,0 +1,237 @@
+import os
+import sys
+import time
+import threading
+import numpy as np
+import scipy.sparse as sp
+from typing import Dict, List, Optional, Tuple
+
+from citation_graph import CitationGraph, get_citation_graph, sync_citation_graph
+
+DAMPING = 0.85
+PAGERANK_TOL = 1e-6
+PAGERANK_MAX_ITER = 100
+
+# Blend used by combined scores; every component is in [0, 1]
+COSINE_WEIGHT = 0.6
+PROXIMITY_WEIGHT = 0.3
+PAGERANK_WEIGHT = 0.1
+
+# Co-cited / coupled papers kept per query paper
+GRAPH_CANDIDATES = 50
+
+# Recompute once the graph has gained this fraction of new edges; edges
+# added lazily by requests should not trigger a full PageRank each time
+REFRESH_FRACTION = 0.01
+
+
+def adjacency_matrix(graph: CitationGraph) -> sp.csr_matrix:
+    """Sparse n x n matrix with A[i, j] = 1 when paper i cites paper j, deltas included."""
+    n = graph.n_nodes
+    csr_nodes = len(graph.indptr) - 1
+    indptr = np.concatenate([np.asarray(graph.indptr), np.full(n - csr_nodes, graph.indptr[-1], dtype=np.int64)])
+    indices = np.asarray(graph.indices)
+    adjacency = sp.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(n, n))
+
+    if graph.delta_out:
+        rows = [src for src, targets in graph.delta_out.items() for _ in targets]
+        cols = [dst for targets in graph.delta_out.values() for dst in targets]
+        adjacency = adjacency + sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n, n))
+    return adjacency
+
+
+def pagerank(adjacency: sp.csr_matrix, damping: float = DAMPING,
+             personalization: Optional[np.ndarray] = None,
+             tol: float = PAGERANK_TOL, max_iter: int = PAGERANK_MAX_ITER) -> np.ndarray:
+    """
+    PageRank by sparse power iteration. personalization is the teleport
+    distribution (uniform if None); rank held by papers with no references
+    is redistributed along it too.
+    """
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.zeros(0)
+
+    out_degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = out_degree == 0
+    inverse = np.zeros(n)
+    inverse[~dangling] = 1.0 / out_degree[~dangling]
+    # transition.T @ rank spreads each paper's rank evenly over its references
+    transition_t = (sp.diags(inverse) @ adjacency).T.tocsr()
+
+    teleport = np.full(n, 1.0 / n) if personalization is None else personalization / personalization.sum()
+    rank = teleport.copy()
+    for _ in range(max_iter):
+        updated = damping * (transition_t @ rank) + (damping * rank[dangling].sum() + 1 - damping) * teleport
+        if np.abs(updated - rank).sum() < tol:
+            return updated
+        rank = updated
+    return rank
+
+
+class GraphRanker:
+    """
+    Citation-structure scores over a CitationGraph: global PageRank,
+    personalized PageRank, co-citation and bibliographic coupling, and a
+    combined score that blends graph proximity with cosine similarity.
+
+    The sparse matrices and PageRank are computed once and recomputed only
+    after the graph has grown by REFRESH_FRACTION. Papers added since then
+    score as if they had no edges.
+    """
+
+    def __init__(self, graph: CitationGraph):
+        self.graph = graph
+        self.lock = threading.Lock()
+        self.n_edges = -1
+        self.adjacency = None
+        self.cited_by = None
+        self.in_degree = None
+        self.out_degree = None
+        self.pagerank = None
+        self.pagerank_percentile = None
+
+    def refresh(self):
+        with self.lock:
+            growth = self.graph.n_edges - self.n_edges
+            if self.adjacency is not None and growth <= REFRESH_FRACTION * self.n_edges:
+                return
+            start = time.time()
+            self.n_edges = self.graph.n_edges
+            self.adjacency = adjacency_matrix(self.graph)
+            self.cited_by = self.adjacency.T.tocsr()
+            self.out_degree = np.diff(self.adjacency.indptr)
+            self.in_degree = np.diff(self.cited_by.indptr)
+            self.pagerank = pagerank(self.adjacency)
+
+            # Rank percentile in [0, 1] so PageRank blends on the same scale as cosine
+            n = len(self.pagerank)
+            percentile = np.empty(n)
+            percentile[np.argsort(self.pagerank, kind='stable')] = np.arange(n) / max(n - 1, 1)
+            self.pagerank_percentile = percentile
+            print(f"Computed graph ranking for {n} papers, {self.n_edges} edges in {time.time() - start:.2f}s")
+
+    def _index(self, paper_id: str) -> Optional[int]:
+        index = self.graph.id_to_index.get(paper_id)
+        if index is None or index >= self.adjacency.shape[0]:
+            return None
+        return index
+
+    def personalized_pagerank(self, seed_ids: List[str], damping: float = DAMPING) -> Dict[str, float]:
+        """Personalized PageRank restarting at seed_ids, as {paper_id: score} for non-zero scores."""
+        self.refresh()
+        seeds = [i for i in (self._index(s) for s in seed_ids) if i is not None]
+        if not seeds:
+            return {}
+        personalization = np.zeros(self.adjacency.shape[0])
+        personalization[seeds] = 1.0
+        scores = pagerank(self.adjacency, damping, personalization)
+        nonzero = np.nonzero(scores)[0]
+        return {self.graph.ids[i]: float(scores[i]) for i in nonzero}
+
+    def _normalized_overlap(self, row: sp.csr_matrix, other: sp.csr_matrix, degree: np.ndarray,
+                            index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices and Salton-normalized counts of row @ other (shared citers or references)."""
+        counts = (row @ other).tocoo()
+        targets = counts.col
+        keep = targets != index
+        targets = targets[keep]
+        values = counts.data[keep] / np.sqrt(np.maximum(degree[index] * degree[targets], 1))
+        return targets, values
+
+    def cocitation(self, paper_id: str) -> Dict[str, float]:
+        """Papers cited together with paper_id, normalized by sqrt(in-degree product)."""
+        self.refresh()
+        index = self._index(paper_id)
+        if index is None:
+            return {}
+        targets, values = self._normalized_overlap(self.cited_by[index], self.adjacency, self.in_degree, index)
+        return {self.graph.ids[t]: float(v) for t, v in zip(targets, values)}
+
+    def coupling(self, paper_id: str) -> Dict[str, float]:
+        """Papers sharing references with paper_id, normalized by sqrt(out-degree product)."""
+        self.refresh()
+        index = self._index(paper_id)
+        if index is None:
+            return {}
+        targets, values = self._normalized_overlap(self.adjacency[index], self.cited_by, self.out_degree, index)
+        return {self.graph.ids[t]: float(v) for t, v in zip(targets, values)}
+
+    def proximity(self, paper_id: str, limit: int = GRAPH_CANDIDATES) -> Dict[str, float]:
+        """
+        Graph proximity to paper_id in [0, 1]: 1 for a direct citation in
+        either direction, otherwise the larger of co-citation and coupling.
+        Keeps the limit strongest co-cited / coupled papers.
+        """
+        scores: Dict[str, float] = {}
+        for overlap in (self.cocitation(paper_id), self.coupling(paper_id)):
+            for other, value in sorted(overlap.items(), key=lambda item: -item[1])[:limit]:
+                scores[other] = max(scores.get(other, 0.0), value)
+
+        for other in self.graph.neighbors(paper_id) + self.graph.neighbors(paper_id, reverse=True):
+            scores[other] = 1.0
+        scores.pop(paper_id, None)
+        return scores
+
+    def pagerank_score(self, paper_ids: List[str]) -> np.ndarray:
+        """PageRank percentile of each paper (0 for papers not in the graph)."""
+        self.refresh()
+        indices = [self._index(p) for p in paper_ids]
+        return np.array([self.pagerank_percentile[i] if i is not None else 0.0 for i in indices])
+
+    def citation_degree(self, paper_ids: List[str]) -> np.ndarray:
+        """In-degree plus out-degree of each paper (0 for papers not in the graph)."""
+        self.refresh()
+        indices = [self._index(p) for p in paper_ids]
+        return np.array([self.in_degree[i] + self.out_degree[i] if i is not None else 0 for i in indices],
+                        dtype=np.float64)
+
+    def combined_scores(self, paper_id: str, similarities: Dict[str, float],
+                        proximity: Optional[Dict[str, float]] = None) -> List[Tuple[str, float]]:
+        """
+        Rank candidates (the keys of similarities, cosine to paper_id) by
+        COSINE_WEIGHT * cosine + PROXIMITY_WEIGHT * graph proximity
+        + PAGERANK_WEIGHT * PageRank percentile, best first.
+        """
+        if proximity is None:
+            proximity = self.proximity(paper_id)
+        candidates = [c for c in similarities if c != paper_id]
+        if not candidates:
+            return []
+
+        cosine = np.array([similarities[c] for c in candidates])
+        graph = np.array([proximity.get(c, 0.0) for c in candidates])
+        scores = (COSINE_WEIGHT * np.clip(cosine, 0.0, 1.0) + PROXIMITY_WEIGHT * graph
+                  + PAGERANK_WEIGHT * self.pagerank_score(candidates))
+
+        order = np.argsort(-scores, kind='stable')
+        return [(candidates[i], float(scores[i])) for i in order]
+
+
+_rankers: Dict[str, GraphRanker] = {}
+_rankers_lock = threading.Lock()
+
+
+def get_graph_ranker(db_path: str = 'papers.db') -> GraphRanker:
+    """
+    Process-wide ranker over the citation graph of db_path, whose graph has
+    picked up edges written by other processes (sync_citation_graph).
+    """
+    key = os.path.abspath(db_path)
+    with _rankers_lock:
+        ranker = _rankers.get(key)
+        if ranker is None:
+            ranker = _rankers[key] = GraphRanker(get_citation_graph(db_path))
+    sync_citation_graph(db_path)
+    return ranker
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'papers.db'
+    ranker = get_graph_ranker(db_path)
+    ranker.refresh()
+    top = np.argsort(-ranker.pagerank)[:20]
+    print("Top papers by PageRank:")
+    for i in top:
+        print(f"  {ranker.graph.ids[i]}  {ranker.pagerank[i]:.6f}")
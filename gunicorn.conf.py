@@ -0,0 +1,33 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+import os
+import multiprocessing
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.environ.get('PAPERWEB_BIND', '0.0.0.0:8080')
+
+# Each worker is a process with its own model instance and request threads.
+# Warm-up runs once in the master (see wsgi.py) and is inherited on fork.
+# Papers and edges one worker adds reach the others within
+# PAPERWEB_SYNC_INTERVAL seconds, when they next check the database.
+workers = int(os.environ.get('PAPERWEB_WORKERS', str(min(4, multiprocessing.cpu_count()))))
+worker_class = 'gthread'
+threads = int(os.environ.get('PAPERWEB_THREADS', '4'))
+preload_app = os.environ.get('PAPERWEB_PRELOAD', '1') == '1'
+
+# Split the cores between workers so torch does not oversubscribe them
+os.environ.setdefault('PAPERWEB_EMBED_THREADS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+# Lazy reference extraction can fetch PDFs inside a request
+timeout = 120
+graceful_timeout = 30
+# Recycle workers now and then so copy-on-write pages they dirtied are returned
+max_requests = 5000
+max_requests_jitter = 500
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    from wsgi import warm_worker
+    warm_worker()
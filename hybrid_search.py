@@ -0,0 +1,152 @@
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from paper_search import lexical_search
+from embed import embed_query, get_search_store
+from db import get_connection
+
+# Reciprocal rank fusion constant: score = sum over passes of 1 / (RRF_K + rank)
+RRF_K = 60
+
+# Candidates taken from each pass before fusion
+HYBRID_CANDIDATES = 100
+
+# Bare years in a query ("BERT distillation 2023") become a year filter
+QUERY_YEAR = re.compile(r'\b(19[89]\d|20\d\d)\b')
+QUERY_TOKEN_PRESENT = re.compile(r'\w')
+
+# Both passes of one query run side by side; the embedding model releases the GIL
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists into (paper_id, score) pairs, best first. Ranks start at 1."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, paper_id in enumerate(ranking, start=1):
+            scores[paper_id] = scores.get(paper_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def split_query_years(query: str, year_range: Optional[Tuple[Optional[int], Optional[int]]]
+                      ) -> Tuple[str, Optional[Tuple[Optional[int], Optional[int]]]]:
+    """
+    Pull years out of the query text into year_range when no explicit range
+    was given: one year filters to that year, several to the span they cover.
+    """
+    if year_range and (year_range[0] is not None or year_range[1] is not None):
+        return query, year_range
+    years = [int(y) for y in QUERY_YEAR.findall(query)]
+    if not years:
+        return query, year_range
+    text = QUERY_YEAR.sub(' ', query).strip()
+    if not QUERY_TOKEN_PRESENT.search(text):
+        # A query that is only a year is searched as text
+        return query, year_range
+    return text, (min(years), max(years))
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _semantic_pass(query: str, k: int, year_range, categories) -> Tuple[List[Tuple[str, float]], float]:
+    """Vector top-k with filters applied to the store mask; returns the hits and the embedding time."""
+    embedding, embed_ms = _timed(embed_query, query)
+    return get_search_store().top_k(embedding, k, year_range=year_range, categories=categories), embed_ms
+
+
+def fetch_results(paper_ids: List[str], db_path: str) -> Dict[str, Dict[str, Any]]:
+    """Display fields for the fused papers, one query per 500 ids."""
+    papers = {}
+    conn = get_connection(db_path)
+    for i in range(0, len(paper_ids), 500):
+        chunk = paper_ids[i:i+500]
+        placeholders = ','.join(['?'] * len(chunk))
+        for row in conn.execute(f'''
+            SELECT id, title, authors, categories, year FROM papers WHERE id IN ({placeholders})
+        ''', chunk):
+            papers[row[0]] = {
+                "id": row[0],
+                "title": row[1].strip() if row[1] else f"Paper {row[0]}",
+                "authors": row[2],
+                "categories": row[3],
+                "year": row[4]
+            }
+    return papers
+
+
+def hybrid_search(query: str, k: int = 20,
+                  year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                  categories: Optional[List[str]] = None,
+                  candidates: int = HYBRID_CANDIDATES,
+                  db_path: str = 'papers.db') -> Dict[str, Any]:
+    """
+    Lexical (FTS5 BM25) and semantic (embedding top-k) retrieval run
+    concurrently, each already restricted by year_range and categories,
+    then fused with reciprocal rank fusion. Returns the k best papers with
+    their rank in each pass, the filters used and per-stage timings in ms.
+    """
+    total_start = time.perf_counter()
+    text, year_range = split_query_years(query, year_range)
+
+    lexical_future = _executor.submit(_timed, lexical_search, text, candidates, year_range, categories, db_path)
+    semantic_future = _executor.submit(_timed, _semantic_pass, text, candidates, year_range, categories)
+
+    timings = {}
+    try:
+        lexical, timings["lexical_ms"] = lexical_future.result()
+    except Exception as e:
+        print(f"Lexical pass failed for {query!r}: {e}")
+        lexical = []
+    try:
+        (semantic, timings["embed_ms"]), timings["semantic_ms"] = semantic_future.result()
+    except Exception as e:
+        print(f"Semantic pass failed for {query!r}: {e}")
+        semantic = []
+
+    start = time.perf_counter()
+    lexical_rank = {paper_id: rank for rank, (paper_id, _) in enumerate(lexical, start=1)}
+    semantic_rank = {paper_id: rank for rank, (paper_id, _) in enumerate(semantic, start=1)}
+    similarity = dict(semantic)
+    fused = reciprocal_rank_fusion([[p for p, _ in lexical], [p for p, _ in semantic]])[:k]
+    timings["fusion_ms"] = (time.perf_counter() - start) * 1000
+
+    papers, timings["metadata_ms"] = _timed(fetch_results, [paper_id for paper_id, _ in fused], db_path)
+    results = []
+    for paper_id, score in fused:
+        paper = papers.get(paper_id)
+        if paper is None:
+            continue
+        results.append({
+            **paper,
+            "score": score,
+            "lexical_rank": lexical_rank.get(paper_id),
+            "semantic_rank": semantic_rank.get(paper_id),
+            "similarity": similarity.get(paper_id)
+        })
+    timings["total_ms"] = (time.perf_counter() - total_start) * 1000
+
+    return {
+        "query": text,
+        "year_range": list(year_range) if year_range else None,
+        "categories": categories or [],
+        "results": results,
+        "timings": {stage: round(ms, 2) for stage, ms in timings.items()}
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python hybrid_search.py <query>")
+        sys.exit(1)
+    response = hybrid_search(sys.argv[1])
+    for paper in response["results"]:
+        print(f"{paper['score']:.4f}  {paper['id']}  {paper['title']}  "
+              f"(lexical {paper['lexical_rank']}, semantic {paper['semantic_rank']})")
+    print(response["timings"])
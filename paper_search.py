@@ -0,0 +1,399 @@
+import re
+import sys
+import time
+from typing import Iterable, List, Optional, Set, Tuple
+
+from db import connect, get_connection
+
+# Column weights for bm25(): a hit in the title counts most, then authors
+TITLE_WEIGHT = 10.0
+AUTHORS_WEIGHT = 5.0
+ABSTRACT_WEIGHT = 1.0
+
+SEARCH_COLUMNS = "p.id, p.title, p.authors, p.abstract, p.categories, p.year, p.month, p.day"
+
+# Whole or partial arXiv ids ("2301.01234", "2301.012", "cs/0112017", "2301.01234v2")
+PAPER_ID_PATTERN = re.compile(r'^(?:[a-z\-]+(?:\.[A-Za-z]{2})?/\d{1,7}|\d{4}(?:\.\d{0,5})?)(?:v\d+)?$', re.IGNORECASE)
+VERSION_SUFFIX = re.compile(r'v\d+$')
+QUERY_TOKEN = re.compile(r'\w+', re.UNICODE)
+# papers.categories is "cs.LG cs.AI" (Kaggle dump) or "cs.LG, cs.AI" (arxiv_ripper)
+CATEGORY_SEPARATOR = re.compile(r'[,\s]+')
+
+# Papers per /api/category-search page
+CATEGORY_PAGE_SIZE = 20
+
+_fts_ready: Set[str] = set()
+_categories_ready: Set[str] = set()
+
+
+def _create_backfill_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS search_index_backfill (
+        name TEXT PRIMARY KEY,
+        completed_at TEXT
+    )
+    ''')
+
+
+def _backfilled(conn, name: str) -> bool:
+    """
+    True once the backfill of the index called name has committed. The
+    marker is written in the backfill's own transaction, so an interrupted
+    or failed backfill is simply run again by the next setup.
+    """
+    _create_backfill_table(conn)
+    return conn.execute("SELECT 1 FROM search_index_backfill WHERE name = ?", (name,)).fetchone() is not None
+
+
+def _mark_backfilled(conn, name: str):
+    """Record a finished backfill; call inside the transaction that did it."""
+    _create_backfill_table(conn)
+    conn.execute(
+        "INSERT OR REPLACE INTO search_index_backfill (name, completed_at) VALUES (?, datetime('now'))", (name,)
+    )
+
+
+def setup_papers_fts(db_path: str = 'papers.db') -> bool:
+    """
+    Create papers_fts, an FTS5 index over papers.title/authors/abstract that
+    stores no text of its own (content='papers'), and the triggers that keep
+    it in sync. Until a build from the existing papers has committed, each
+    setup builds it again. Returns False if setup failed.
+
+    Every writer uses INSERT OR REPLACE, and REPLACE does not fire delete
+    triggers, so a BEFORE INSERT trigger removes the old row's entry first.
+    """
+    conn = connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+            title, authors, abstract,
+            content='papers', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS papers_fts_before_insert BEFORE INSERT ON papers BEGIN
+            INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract)
+            SELECT 'delete', rowid, title, authors, abstract FROM papers WHERE id = new.id;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS papers_fts_after_insert AFTER INSERT ON papers BEGIN
+            INSERT INTO papers_fts (rowid, title, authors, abstract)
+            VALUES (new.rowid, new.title, new.authors, new.abstract);
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS papers_fts_after_delete AFTER DELETE ON papers BEGIN
+            INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract)
+            VALUES ('delete', old.rowid, old.title, old.authors, old.abstract);
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS papers_fts_after_update AFTER UPDATE OF title, authors, abstract ON papers BEGIN
+            INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract)
+            VALUES ('delete', old.rowid, old.title, old.authors, old.abstract);
+            INSERT INTO papers_fts (rowid, title, authors, abstract)
+            VALUES (new.rowid, new.title, new.authors, new.abstract);
+        END
+        ''')
+        conn.commit()
+
+        if not _backfilled(conn, 'papers_fts'):
+            rebuild_papers_fts(conn)
+        return True
+    except Exception as e:
+        print(f"Error setting up papers_fts: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def rebuild_papers_fts(conn) -> float:
+    """Rebuild the whole index from the papers table, then merge its segments."""
+    start = time.time()
+    with conn:
+        conn.execute("INSERT INTO papers_fts (papers_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO papers_fts (papers_fts) VALUES ('optimize')")
+        _mark_backfilled(conn, 'papers_fts')
+    elapsed = time.time() - start
+    print(f"Built papers_fts in {elapsed:.1f}s")
+    return elapsed
+
+
+def ensure_papers_fts(db_path: str = 'papers.db'):
+    if db_path not in _fts_ready and setup_papers_fts(db_path):
+        _fts_ready.add(db_path)
+
+
+def fts_query(text: str, columns: Optional[List[str]] = None, prefix: bool = True) -> Optional[str]:
+    """
+    Turn free text into an FTS5 query: every word must match, the last one
+    as a prefix (unless prefix is False) so partially typed queries still
+    find results. Words are quoted so FTS5 operators and punctuation in user
+    input are never parsed.
+    """
+    tokens = QUERY_TOKEN.findall(text)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    if prefix:
+        terms[-1] += '*'
+    query = ' '.join(terms)
+    if columns:
+        query = '{' + ' '.join(columns) + '}: (' + query + ')'
+    return query
+
+
+def looks_like_paper_id(text: str) -> bool:
+    return PAPER_ID_PATTERN.match(text.strip()) is not None
+
+
+def search_by_id(conn, text: str, limit: int = 20) -> List[tuple]:
+    """
+    Papers whose id is text or starts with it, as a range scan on the
+    primary key. A version suffix is ignored since ids are stored without one.
+    """
+    paper_id = VERSION_SUFFIX.sub('', text.strip())
+    rows = conn.execute(f'''
+        SELECT {SEARCH_COLUMNS} FROM papers p WHERE p.id = ?
+    ''', (paper_id,)).fetchall()
+    if len(rows) >= limit:
+        return rows
+    # The upper bound is the prefix with its last character incremented
+    upper = paper_id[:-1] + chr(ord(paper_id[-1]) + 1)
+    rows += conn.execute(f'''
+        SELECT {SEARCH_COLUMNS} FROM papers p WHERE p.id > ? AND p.id < ? ORDER BY p.id LIMIT ?
+    ''', (paper_id, upper, limit - len(rows))).fetchall()
+    return rows
+
+
+def search_fts(conn, text: str, limit: int = 20, columns: Optional[List[str]] = None,
+               prefix: bool = True) -> List[tuple]:
+    """Full-text matches for text, best BM25 score first."""
+    query = fts_query(text, columns, prefix)
+    if query is None:
+        return []
+    return conn.execute(f'''
+        SELECT {SEARCH_COLUMNS}
+        FROM papers_fts
+        JOIN papers p ON p.rowid = papers_fts.rowid
+        WHERE papers_fts MATCH ?
+        ORDER BY bm25(papers_fts, ?, ?, ?)
+        LIMIT ?
+    ''', (query, TITLE_WEIGHT, AUTHORS_WEIGHT, ABSTRACT_WEIGHT, limit)).fetchall()
+
+
+def lexical_search(text: str, limit: int = 100,
+                   year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                   categories: Optional[List[str]] = None,
+                   db_path: str = 'papers.db') -> List[Tuple[str, float]]:
+    """
+    (paper_id, bm25) for papers matching any word of text, best first. Unlike
+    search_fts every word is optional, so BM25 ranks papers by how many and
+    how rare the words they contain are. year_range (inclusive, either bound
+    may be None) and categories (any of) are applied inside the query, so
+    the limit counts only papers that pass them.
+    """
+    tokens = QUERY_TOKEN.findall(text)
+    if not tokens:
+        return []
+    ensure_papers_fts(db_path)
+
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    query = ' OR '.join(terms)
+    where = ['papers_fts MATCH ?']
+    params: List = [query]
+    if year_range and year_range[0] is not None:
+        where.append('p.year >= ?')
+        params.append(year_range[0])
+    if year_range and year_range[1] is not None:
+        where.append('p.year <= ?')
+        params.append(year_range[1])
+    if categories:
+        ensure_paper_categories(db_path)
+        categories = [c.upper() for c in categories]
+        where.append(f"p.id IN (SELECT paper_id FROM paper_categories WHERE category IN ({','.join(['?'] * len(categories))}))")
+        params.extend(categories)
+
+    conn = get_connection(db_path)
+    return conn.execute(f'''
+        SELECT p.id, bm25(papers_fts, {TITLE_WEIGHT}, {AUTHORS_WEIGHT}, {ABSTRACT_WEIGHT}) AS score
+        FROM papers_fts
+        JOIN papers p ON p.rowid = papers_fts.rowid
+        WHERE {' AND '.join(where)}
+        ORDER BY score
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+
+
+def search_papers(text: str, limit: int = 20, db_path: str = 'papers.db') -> List[tuple]:
+    """
+    Rows of (id, title, authors, abstract, categories, year, month, day) for
+    a search box query. Ids go through the primary key; everything else
+    through the FTS index, ranked by BM25 over title, authors and abstract.
+    """
+    ensure_papers_fts(db_path)
+    conn = get_connection(db_path)
+    rows = []
+    if looks_like_paper_id(text):
+        rows = search_by_id(conn, text, limit)
+    if len(rows) < limit:
+        seen = {row[0] for row in rows}
+        rows += [row for row in search_fts(conn, text, limit) if row[0] not in seen][:limit - len(rows)]
+    return rows
+
+
+def find_paper_id(text: str, db_path: str = 'papers.db') -> Optional[str]:
+    """The id of the paper text names: an exact id first, then the best title match."""
+    ensure_papers_fts(db_path)
+    conn = get_connection(db_path)
+    if looks_like_paper_id(text):
+        rows = search_by_id(conn, text, 1)
+        if rows:
+            return rows[0][0]
+    # Whole words first so a full title is not outranked by longer ones it prefixes
+    rows = search_fts(conn, text, 1, columns=['title'], prefix=False) or \
+        search_fts(conn, text, 1, columns=['title'])
+    return rows[0][0] if rows else None
+
+
+def split_categories(categories: Optional[str]) -> List[str]:
+    """Distinct categories of a papers.categories string, upper-cased like CS.LG."""
+    if not categories:
+        return []
+    return list(dict.fromkeys(c.upper() for c in CATEGORY_SEPARATOR.split(categories) if c))
+
+
+def setup_paper_categories(db_path: str = 'papers.db') -> bool:
+    """
+    Create paper_categories, one row per (paper, category) with the paper's
+    date copied in, indexed on (category, date) so browsing a category is a
+    range scan. It is filled from papers in one transaction that also
+    records the backfill as done; until then each setup fills it again.
+    Missing date parts are stored as 0 so the index order is total.
+    Returns False if setup failed.
+    """
+    conn = connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS paper_categories (
+            paper_id TEXT NOT NULL,
+            category TEXT NOT NULL,
+            year INTEGER NOT NULL DEFAULT 0,
+            month INTEGER NOT NULL DEFAULT 0,
+            day INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (paper_id, category)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_paper_categories_date
+        ON paper_categories(category, year, month, day, paper_id)
+        ''')
+        conn.commit()
+
+        if not _backfilled(conn, 'paper_categories'):
+            start = time.time()
+            rows = conn.execute("SELECT id, categories, year, month, day FROM papers")
+            with conn:
+                while True:
+                    papers = rows.fetchmany(10000)
+                    if not papers:
+                        break
+                    index_paper_categories(conn, papers, replace=False)
+                _mark_backfilled(conn, 'paper_categories')
+            print(f"Built paper_categories in {time.time() - start:.1f}s")
+        return True
+    except Exception as e:
+        print(f"Error setting up paper_categories: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def ensure_paper_categories(db_path: str = 'papers.db'):
+    if db_path not in _categories_ready and setup_paper_categories(db_path):
+        _categories_ready.add(db_path)
+
+
+def index_paper_categories(conn, papers: Iterable[Tuple], replace: bool = True):
+    """
+    Write paper_categories rows for (id, categories, year, month, day)
+    tuples, in the caller's transaction. With replace, a paper's old rows
+    are dropped first, matching INSERT OR REPLACE INTO papers.
+    """
+    papers = list(papers)
+    if replace:
+        conn.executemany("DELETE FROM paper_categories WHERE paper_id = ?", [(p[0],) for p in papers])
+    conn.executemany('''
+        INSERT OR REPLACE INTO paper_categories (paper_id, category, year, month, day)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (paper_id, category, year or 0, month or 0, day or 0)
+        for paper_id, categories, year, month, day in papers
+        for category in split_categories(categories)
+    ])
+
+
+def encode_category_cursor(row) -> str:
+    """Opaque cursor for the (year, month, day, paper_id) of the last row on a page."""
+    return f"{row[0]}-{row[1]}-{row[2]}-{row[3]}"
+
+
+def decode_category_cursor(cursor: str) -> Tuple[int, int, int, str]:
+    year, month, day, paper_id = cursor.split('-', 3)
+    return int(year), int(month), int(day), paper_id
+
+
+def search_category(category: str, limit: int = CATEGORY_PAGE_SIZE, cursor: Optional[str] = None,
+                    db_path: str = 'papers.db') -> Tuple[List[tuple], Optional[str]]:
+    """
+    Newest papers in category as (id, title, authors, year, month, day,
+    categories) rows, and the cursor for the next page (None on the last).
+    Pages are keyset ranges on idx_paper_categories_date, so every page
+    costs the same however deep it is.
+    """
+    ensure_paper_categories(db_path)
+    conn = get_connection(db_path)
+    after = ''
+    params: List = [category]
+    if cursor:
+        after = 'AND (c.year, c.month, c.day, c.paper_id) < (?, ?, ?, ?)'
+        params.extend(decode_category_cursor(cursor))
+    params.append(limit + 1)
+    rows = conn.execute(f'''
+        SELECT c.year, c.month, c.day, c.paper_id, p.title, p.authors, p.year, p.month, p.day, p.categories
+        FROM paper_categories c
+        JOIN papers p ON p.id = c.paper_id
+        WHERE c.category = ? {after}
+        ORDER BY c.year DESC, c.month DESC, c.day DESC, c.paper_id DESC
+        LIMIT ?
+    ''', params).fetchall()
+
+    next_cursor = encode_category_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [row[3:] for row in rows[:limit]], next_cursor
+
+
+if __name__ == "__main__":
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "--rebuild":
+        db_path = sys.argv[2] if len(sys.argv) == 3 else 'papers.db'
+        setup_papers_fts(db_path)
+        conn = connect(db_path)
+        rebuild_papers_fts(conn)
+        conn.close()
+        sys.exit(0)
+    if len(sys.argv) != 2:
+        print("Usage: python paper_search.py <query>")
+        print("       python paper_search.py --rebuild [db_path]")
+        sys.exit(1)
+    for row in search_papers(sys.argv[1]):
+        print(f"{row[0]}  {row[1].strip()}")
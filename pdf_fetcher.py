@@ -0,0 +1,222 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+import fitz as pymupdf
+
+# Override to point the fetcher at a mirror or a local stub server
+ARXIV_PDF_URL = os.environ.get('PAPERWEB_ARXIV_PDF_URL', 'https://arxiv.org/pdf/')
+PDF_CACHE_DIR = os.environ.get('PAPERWEB_PDF_CACHE', 'pdf_cache')
+# arXiv asks automated clients for no more than one request every three seconds
+PDF_RATE = float(os.environ.get('PAPERWEB_PDF_RATE', 1 / 3))
+PDF_BURST = int(os.environ.get('PAPERWEB_PDF_BURST', 1))
+PDF_POOL_SIZE = 8
+# Extra attempts after a 429/5xx or connection error, waiting PDF_BACKOFF *
+# 2**attempt seconds (or the server's Retry-After) before each
+PDF_RETRIES = int(os.environ.get('PAPERWEB_PDF_RETRIES', 2))
+PDF_BACKOFF = float(os.environ.get('PAPERWEB_PDF_BACKOFF', 5))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+
+class FetchError(Exception):
+    """A PDF could not be downloaded or read."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: tokens refill at rate per second up to
+    capacity, and acquire() blocks until one is available.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def pdf_to_text(data: bytes) -> str:
+    """Extract text from PDF bytes in memory."""
+    doc = pymupdf.open(stream=data, filetype='pdf')
+    try:
+        return "".join(page.get_text() for page in doc)
+    finally:
+        doc.close()
+
+
+class PDFFetcher:
+    """
+    Downloads arXiv PDFs through one pooled HTTP session, rate limited by a
+    shared token bucket, and keeps both the PDF and its extracted text in an
+    on-disk cache keyed by arXiv id:
+        <cache_dir>/<first 2 hex of sha1(id)>/<sha1(id)>.pdf / .txt
+    """
+
+    def __init__(self, base_url: str = ARXIV_PDF_URL, cache_dir: Optional[str] = PDF_CACHE_DIR,
+                 rate: float = PDF_RATE, burst: int = PDF_BURST,
+                 pool_size: int = PDF_POOL_SIZE, timeout: float = 30,
+                 retries: int = PDF_RETRIES, backoff: float = PDF_BACKOFF):
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.bucket = TokenBucket(rate, burst)
+        self.pool_size = pool_size
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.stats_lock = threading.Lock()
+        self.downloads = 0
+        self.pdf_hits = 0
+        self.text_hits = 0
+        self.retried = 0
+        self.cache_errors = 0
+
+    def _cache_path(self, arxiv_id: str, suffix: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        key = hashlib.sha1(arxiv_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    def _read_cache(self, arxiv_id: str, suffix: str) -> Optional[bytes]:
+        path = self._cache_path(arxiv_id, suffix)
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        return None
+
+    def _store(self, arxiv_id: str, suffix: str, data: bytes):
+        """Best-effort _write_cache: a full or read-only cache never fails the fetch."""
+        try:
+            self._write_cache(arxiv_id, suffix, data)
+        except OSError as e:
+            self._count('cache_errors')
+            print(f"Warning: could not cache {arxiv_id}{suffix}: {str(e)}")
+
+    def _write_cache(self, arxiv_id: str, suffix: str, data: bytes):
+        path = self._cache_path(arxiv_id, suffix)
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a unique temp file and rename so concurrent writers never
+        # leave a partial file behind
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _count(self, name: str):
+        with self.stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get_pdf(self, arxiv_id: str) -> bytes:
+        """PDF bytes for arxiv_id, from the cache or downloaded once."""
+        data = self._read_cache(arxiv_id, '.pdf')
+        if data is not None:
+            self._count('pdf_hits')
+            return data
+
+        response = self._download(arxiv_id)
+        data = response.content
+        if not data.startswith(b'%PDF'):
+            raise FetchError(f"Response is not a PDF ({response.headers.get('Content-Type')})")
+
+        self._count('downloads')
+        self._store(arxiv_id, '.pdf', data)
+        return data
+
+    def _download(self, arxiv_id: str) -> requests.Response:
+        """GET the PDF, retrying throttled, failed or unreachable requests with backoff."""
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._count('retried')
+            # Every attempt, retries included, goes through the rate limit
+            self.bucket.acquire()
+            try:
+                response = self.session.get(self.base_url + arxiv_id, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                error, retry_after = FetchError(f"HTTP request error: {str(e)}"), None
+            else:
+                if response.status_code == 200:
+                    return response
+                error = FetchError(f"HTTP error: status code {response.status_code}")
+                if response.status_code not in RETRY_STATUSES:
+                    raise error
+                retry_after = response.headers.get('Retry-After')
+
+            if attempt < self.retries:
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = self.backoff * 2 ** attempt
+                # A long Retry-After is not worth holding a request for
+                time.sleep(min(delay, 60))
+        raise error
+
+    def get_text(self, arxiv_id: str) -> str:
+        """Extracted text of arxiv_id's PDF, cached alongside the PDF."""
+        text = self._read_cache(arxiv_id, '.txt')
+        if text is not None:
+            self._count('text_hits')
+            return text.decode('utf-8')
+
+        data = self.get_pdf(arxiv_id)
+        try:
+            text = pdf_to_text(data)
+        except Exception as e:
+            raise FetchError(f"PDF text extraction error: {str(e)}")
+
+        self._store(arxiv_id, '.txt', text.encode('utf-8'))
+        return text
+
+    def stats(self) -> Dict[str, int]:
+        with self.stats_lock:
+            return {
+                "downloads": self.downloads,
+                "pdf_hits": self.pdf_hits,
+                "text_hits": self.text_hits,
+                "retried": self.retried,
+                "cache_errors": self.cache_errors
+            }
+
+
+_fetcher: Optional[PDFFetcher] = None
+_fetcher_lock = threading.Lock()
+
+
+def get_pdf_fetcher() -> PDFFetcher:
+    """Process-wide fetcher so every request shares one session and rate limit."""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = PDFFetcher()
+        return _fetcher
@@ -0,0 +1,162 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from db import connect, get_connection
+
+# A disk-tier hit refreshes last_used only when it is older than this many
+# seconds, so most reads stay reads; eviction does not need finer recency
+LAST_USED_RESOLUTION = 3600
+
+
+def normalize_query(text: str) -> str:
+    """
+    Canonical form used for cache keys. GIST is built on an uncased BERT
+    tokenizer, so case and runs of whitespace do not change the embedding.
+    """
+    return ' '.join(text.lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings keyed on a hash of the normalized
+    query text plus the model name, so switching MODEL_NAME never serves
+    stale vectors.
+
+    If db_path is set, entries are also written to a SQLite table that
+    survives restarts and is consulted on an in-memory miss.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 1024,
+                 db_path: Optional[str] = None, max_disk_entries: int = 100000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_writes = 0
+
+        if self.db_path:
+            self._setup_disk_tier()
+
+    def _setup_disk_tier(self):
+        conn = connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS query_embeddings (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            last_used REAL
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings(last_used)')
+
+        conn.commit()
+        conn.close()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{normalize_query(text)}".encode('utf-8')).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.key(text)
+
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+        vector = self._disk_get(key)
+
+        with self.lock:
+            if vector is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, vector)
+            return vector
+
+    def put(self, text: str, vector: np.ndarray):
+        key = self.key(text)
+        vector = np.array(vector, dtype=np.float32)
+
+        with self.lock:
+            self._remember(key, vector)
+
+        self._disk_put(key, vector)
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_get(self, key: str) -> Optional[np.ndarray]:
+        if not self.db_path:
+            return None
+
+        try:
+            conn = get_connection(self.db_path)
+            result = conn.execute('SELECT embedding, last_used FROM query_embeddings WHERE key = ?', (key,)).fetchone()
+            now = time.time()
+            if result and (result[1] or 0) < now - LAST_USED_RESOLUTION:
+                with conn:
+                    conn.execute('UPDATE query_embeddings SET last_used = ? WHERE key = ?', (now, key))
+        except sqlite3.Error as e:
+            print(f"Query cache read failed: {str(e)}")
+            return None
+
+        if result:
+            return np.frombuffer(result[0], dtype=np.float32).copy()
+        return None
+
+    def _disk_put(self, key: str, vector: np.ndarray):
+        if not self.db_path:
+            return
+
+        try:
+            conn = get_connection(self.db_path)
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                INSERT OR REPLACE INTO query_embeddings (key, model, embedding, last_used)
+                VALUES (?, ?, ?, ?)
+                ''', (key, self.model_name, vector.tobytes(), time.time()))
+
+                self.disk_writes += 1
+                # Trim the least recently used rows every so often rather than on every write
+                if self.disk_writes % 1000 == 0:
+                    cursor.execute('''
+                    DELETE FROM query_embeddings WHERE key IN (
+                        SELECT key FROM query_embeddings
+                        ORDER BY last_used DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    ''', (self.max_disk_entries,))
+        except sqlite3.Error as e:
+            print(f"Query cache write failed: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_enabled": bool(self.db_path)
+            }
@@ -1,14 +1,14 @@
 echo "Starting rebuild of embeddings database..."
 
-if [ -f embeddings.db ]; then
-    echo "Deleting existing embeddings.db file..."
-    rm embeddings.db
-    echo "embeddings.db deleted successfully."
+# An interrupted run resumes from its checkpoint in embeddings.db;
+# a completed run clears it, so the next run re-embeds every paper.
+# Pass --fresh to discard existing embeddings and start over.
+if [ "$1" == "--fresh" ]; then
+    echo "Discarding existing embeddings and checkpoint..."
+    python embed.py embed --fresh
 else
-    echo "No existing embeddings.db found."
+    echo "Rebuilding embeddings database (resuming if interrupted)..."
+    python embed.py embed
 fi
 
-echo "Rebuilding embeddings database..."
-python embed.py
-
-echo "Process completed." 
\ No newline at end of file
+echo "Process completed." 
@@ -0,0 +1,57 @@
+import re
+
+import pytest
+
+from get_connections import VALID_ARXIV_ID, extract_arxiv_ids_multipass, extract_normalized_arxiv_ids
+
+# (reference text, ids the single-pass extractor must return, in order)
+REFERENCES = [
+    ('[1] A. Vaswani et al. Attention is all you need. arXiv:1706.03762v5, 2017.',
+     ['1706.03762']),
+    ('[2] J. Devlin et al. BERT. [arXiv:1810.04805] and arXiv preprint arXiv:2005.14165v4',
+     ['1810.04805', '2005.14165']),
+    ('[3] Five-digit and four-digit ids: 2301.01234, 0704.0001v2',
+     ['2301.01234', '0704.0001']),
+    ('[4] Old style cs.CL/0112017 and cs/9901001v2',
+     ['cs/0112017', 'cs/9901001']),
+    ('[5] Spaced archive cs CL/0204034 and cs. LG/0301001',
+     ['cs/0204034', 'cs/0301001']),
+    ('[6] cs. ArXiv preprint cs.LG/0512345',
+     ['cs/0512345']),
+    ('[7] arXiv:cs/0102004 [arXiv:cs/0307055]',
+     ['cs/0102004', 'cs/0307055']),
+    ('[8] ARXIV:2103.00020V1 in capitals, cs.lg/0001234',
+     ['2103.00020', 'cs/0001234']),
+    ('[9] Repeated 1706.03762 then 1706.03762v2 again',
+     ['1706.03762']),
+    ('[10] No ids: 12.345, 2020.12, page 1234.567',
+     []),
+]
+
+
+def canonical(paper_id: str) -> str:
+    """
+    Undo the multi-pass extractor's known normalization slips, which keep
+    an 'arXiv:' prefix, a closing bracket, a version suffix or a spaced
+    archive ('cs CL/...') in the id.
+    """
+    paper_id = re.sub(r'^arxiv:', '', paper_id, flags=re.IGNORECASE).rstrip(']')
+    paper_id = re.sub(r'^cs\s?\.?\s?[A-Za-z]{2}/', 'cs/', paper_id)
+    return re.sub(r'v\d+$', '', paper_id, flags=re.IGNORECASE)
+
+
+@pytest.mark.parametrize("text, expected", REFERENCES)
+def test_single_pass_ids(text, expected):
+    assert extract_normalized_arxiv_ids(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", REFERENCES)
+def test_parity_with_multipass(text, expected):
+    multipass = {canonical(paper_id) for paper_id in extract_arxiv_ids_multipass(text)}
+    assert set(extract_normalized_arxiv_ids(text)) == {i for i in multipass if VALID_ARXIV_ID.match(i)}
+
+
+def test_references_only_skips_the_body():
+    text = "Body mentions 1111.11111.\nReferences\n[1] Cited work arXiv:2222.22222\n"
+    assert extract_normalized_arxiv_ids(text, references_only=True) == ['2222.22222']
+    assert extract_normalized_arxiv_ids(text) == ['1111.11111', '2222.22222']
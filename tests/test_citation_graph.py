@@ -0,0 +1,43 @@
+import sqlite3
+from datetime import datetime
+
+from citation_graph import get_citation_graph, sync_citation_graph
+from get_connections import ensure_citations_table
+
+
+def make_papers_db(path, edges):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE papers (id TEXT PRIMARY KEY, title TEXT NOT NULL, connected_papers TEXT)')
+    conn.executemany('INSERT INTO papers (id, title) VALUES (?, ?)', [(paper_id, paper_id) for paper_id in 'abcd'])
+    conn.commit()
+    conn.close()
+    ensure_citations_table(str(path))
+    write_edges(str(path), edges)
+    return str(path)
+
+
+def write_edges(db_path, edges):
+    """Record edges the way the crawler does: citations plus a 'done' extraction."""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO citations (src, dst) VALUES (?, ?)', edges)
+        conn.executemany(
+            "INSERT OR REPLACE INTO reference_extraction (paper_id, status, n_refs, updated_at) VALUES (?, 'done', 1, ?)",
+            [(src, now) for src, _ in edges]
+        )
+    conn.close()
+
+
+def test_graph_picks_up_edges_written_elsewhere(tmp_path):
+    db_path = make_papers_db(tmp_path / 'papers.db', [('a', 'b')])
+    graph = get_citation_graph(db_path, str(tmp_path / 'graph'))
+    assert graph.neighbors('c') == []
+
+    write_edges(db_path, [('c', 'a'), ('c', 'd')])
+    assert sync_citation_graph(db_path, interval=3600) == 0
+    assert sync_citation_graph(db_path, interval=0) == 2
+    assert sorted(graph.neighbors('c')) == ['a', 'd']
+    assert graph.neighbors('a', reverse=True) == ['c']
+    # Edges seen before are not added twice
+    assert sync_citation_graph(db_path, interval=0) == 0
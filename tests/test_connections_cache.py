@@ -0,0 +1,23 @@
+import connections_cache
+from connections_cache import ConnectionsCache
+
+
+def test_views_are_written_in_batches(tmp_path):
+    db_path = str(tmp_path / 'papers.db')
+    cache = ConnectionsCache(db_path)
+    conn = connections_cache.get_connection(db_path)
+
+    before = conn.total_changes
+    for _ in range(3):
+        cache.record_view('2301.00001')
+    cache.record_view('2301.00002')
+    assert conn.total_changes == before
+
+    assert cache.most_viewed(2) == ['2301.00001', '2301.00002']
+    assert conn.execute('SELECT views FROM paper_views WHERE paper_id = ?', ('2301.00001',)).fetchone()[0] == 3
+
+    for _ in range(connections_cache.VIEW_FLUSH_SIZE):
+        cache.record_view('2301.00002')
+    views = conn.execute('SELECT views FROM paper_views WHERE paper_id = ?', ('2301.00002',)).fetchone()[0]
+    assert views == 1 + connections_cache.VIEW_FLUSH_SIZE
+    assert cache.pending_views == {}
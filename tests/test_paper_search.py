@@ -0,0 +1,76 @@
+import sqlite3
+
+from paper_search import (ensure_paper_categories, ensure_papers_fts, search_category, search_papers,
+                          setup_paper_categories, setup_papers_fts)
+
+
+def make_papers_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+    CREATE TABLE papers (
+        id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        authors TEXT,
+        abstract TEXT,
+        categories TEXT,
+        doi INTEGER,
+        connected_papers TEXT,
+        year INTEGER,
+        month INTEGER,
+        day INTEGER
+    )
+    ''')
+    conn.executemany(
+        'INSERT INTO papers (id, title, authors, abstract, categories, year, month, day) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        [('1706.03762', 'Attention is all you need', 'Vaswani', 'Transformers', 'cs.CL cs.LG', 2017, 6, 12),
+         ('1810.04805', 'BERT', 'Devlin', 'Pre-training of deep bidirectional transformers', 'cs.CL', 2018, 10, 11)]
+    )
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+def backfill_markers(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {name for name, in conn.execute('SELECT name FROM search_index_backfill')}
+    finally:
+        conn.close()
+
+
+def test_interrupted_backfills_are_retried(tmp_path):
+    db_path = make_papers_db(tmp_path / 'papers.db')
+    # A run that created the tables and then died before backfilling them
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE VIRTUAL TABLE papers_fts USING fts5(title, authors, abstract, content='papers', content_rowid='rowid')")
+    conn.execute('''
+    CREATE TABLE paper_categories (
+        paper_id TEXT NOT NULL,
+        category TEXT NOT NULL,
+        year INTEGER NOT NULL DEFAULT 0,
+        month INTEGER NOT NULL DEFAULT 0,
+        day INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (paper_id, category)
+    ) WITHOUT ROWID
+    ''')
+    conn.commit()
+    conn.close()
+
+    assert setup_papers_fts(db_path)
+    assert setup_paper_categories(db_path)
+    assert backfill_markers(db_path) == {'papers_fts', 'paper_categories'}
+
+    ensure_papers_fts(db_path)
+    ensure_paper_categories(db_path)
+    assert [row[0] for row in search_papers('attention', db_path=db_path)] == ['1706.03762']
+    assert [row[0] for row in search_category('CS.CL', db_path=db_path)[0]] == ['1810.04805', '1706.03762']
+
+
+def test_failed_backfill_runs_again(tmp_path):
+    db_path = str(tmp_path / 'papers.db')
+    # No papers table yet, so the backfill fails and must run again later
+    assert not setup_paper_categories(db_path)
+
+    make_papers_db(db_path)
+    assert setup_paper_categories(db_path)
+    assert backfill_markers(db_path) == {'paper_categories'}
@@ -0,0 +1,157 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fitz as pymupdf
+import pytest
+
+from pdf_fetcher import FetchError, PDFFetcher, TokenBucket
+
+
+def make_pdf(text: str) -> bytes:
+    doc = pymupdf.open()
+    doc.new_page().insert_text((72, 72), text)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+class StubArxiv(ThreadingHTTPServer):
+    """
+    Serves /pdf/<id> from a dict of PDFs. failures[id] responses of
+    failure_status are returned before the PDF; every request is logged.
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.pdfs = {}
+        self.failures = {}
+        self.failure_status = 503
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/pdf/"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        arxiv_id = self.path[len('/pdf/'):]
+        with server.lock:
+            server.requests.append((arxiv_id, time.monotonic()))
+            failing = server.failures.get(arxiv_id, 0) > 0
+            if failing:
+                server.failures[arxiv_id] -= 1
+
+        if failing:
+            self.send_response(server.failure_status)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+        elif arxiv_id in server.pdfs:
+            body = server.pdfs[arxiv_id]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/pdf')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = StubArxiv()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_text_is_cached_after_first_fetch(stub, tmp_path):
+    stub.pdfs['2301.01234'] = make_pdf('Attention is all you need 1706.03762')
+    fetcher = PDFFetcher(stub.url, str(tmp_path / 'cache'), rate=1000, burst=10)
+
+    assert '1706.03762' in fetcher.get_text('2301.01234')
+    assert '1706.03762' in fetcher.get_text('2301.01234')
+    assert fetcher.get_pdf('2301.01234').startswith(b'%PDF')
+    assert len(stub.requests) == 1
+    assert fetcher.stats()["downloads"] == 1
+    assert fetcher.stats()["text_hits"] == 1
+    assert fetcher.stats()["pdf_hits"] == 1
+
+    # A new fetcher over the same cache directory never goes to the network
+    again = PDFFetcher(stub.url, str(tmp_path / 'cache'), rate=1000, burst=10)
+    assert '1706.03762' in again.get_text('2301.01234')
+    assert len(stub.requests) == 1
+
+
+def test_unwritable_cache_does_not_lose_the_text(stub, tmp_path):
+    stub.pdfs['2301.01234'] = make_pdf('cites 1706.03762')
+    # A file where the cache directory should be makes every cache write fail
+    blocked = tmp_path / 'cache'
+    blocked.write_text('not a directory')
+    fetcher = PDFFetcher(stub.url, str(blocked), rate=1000, burst=10)
+
+    assert '1706.03762' in fetcher.get_text('2301.01234')
+    assert fetcher.stats()["cache_errors"] == 2
+
+
+def test_throttled_requests_are_retried(stub, tmp_path):
+    stub.pdfs['2301.01234'] = make_pdf('cites 1706.03762')
+    stub.failures['2301.01234'] = 2
+    fetcher = PDFFetcher(stub.url, str(tmp_path / 'cache'), rate=1000, burst=10, retries=2, backoff=0.01)
+
+    assert '1706.03762' in fetcher.get_text('2301.01234')
+    assert len(stub.requests) == 3
+    assert fetcher.stats()["retried"] == 2
+
+
+def test_retries_give_up_and_client_errors_are_not_retried(stub, tmp_path):
+    stub.pdfs['2301.01234'] = make_pdf('cites 1706.03762')
+    stub.failures['2301.01234'] = 5
+    fetcher = PDFFetcher(stub.url, str(tmp_path / 'cache'), rate=1000, burst=10, retries=2, backoff=0.01)
+
+    with pytest.raises(FetchError):
+        fetcher.get_pdf('2301.01234')
+    assert len(stub.requests) == 3
+
+    with pytest.raises(FetchError):
+        fetcher.get_pdf('missing')
+    assert len(stub.requests) == 4
+
+
+def test_downloads_are_paced_by_the_token_bucket(stub, tmp_path):
+    ids = [f'2301.0000{i}' for i in range(4)]
+    for arxiv_id in ids:
+        stub.pdfs[arxiv_id] = make_pdf(arxiv_id)
+    rate = 20.0
+    fetcher = PDFFetcher(stub.url, str(tmp_path / 'cache'), rate=rate, burst=1)
+
+    threads = [threading.Thread(target=fetcher.get_pdf, args=(arxiv_id,)) for arxiv_id in ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    times = sorted(t for _, t in stub.requests)
+    assert len(times) == len(ids)
+    # The first request uses the initial token; each later one waits ~1/rate
+    assert times[-1] - times[0] >= (len(ids) - 1) / rate * 0.9
+
+
+def test_token_bucket_allows_a_burst_then_paces():
+    bucket = TokenBucket(rate=50.0, capacity=3)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start >= 5 / 50.0 * 0.9
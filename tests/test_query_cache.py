@@ -0,0 +1,29 @@
+import time
+
+import numpy as np
+
+import query_cache
+from query_cache import QueryEmbeddingCache
+
+
+def test_disk_hit_only_touches_stale_last_used(tmp_path):
+    db_path = str(tmp_path / 'query_cache.db')
+    cache = QueryEmbeddingCache('model', db_path=db_path)
+    cache.put('graph neural networks', np.ones(4, dtype=np.float32))
+    key = cache.key('graph neural networks')
+    conn = query_cache.get_connection(db_path)
+
+    # A fresh entry is read without a write
+    before = conn.total_changes
+    cold = QueryEmbeddingCache('model', db_path=db_path)
+    assert np.array_equal(cold.get('Graph  neural networks'), np.ones(4, dtype=np.float32))
+    assert cold.stats()["disk_hits"] == 1
+    assert conn.total_changes == before
+
+    # An entry last used long ago is refreshed on its next hit
+    stale = time.time() - 2 * query_cache.LAST_USED_RESOLUTION
+    with conn:
+        conn.execute('UPDATE query_embeddings SET last_used = ? WHERE key = ?', (stale, key))
+    assert QueryEmbeddingCache('model', db_path=db_path).get('graph neural networks') is not None
+    last_used = conn.execute('SELECT last_used FROM query_embeddings WHERE key = ?', (key,)).fetchone()[0]
+    assert last_used > stale + query_cache.LAST_USED_RESOLUTION
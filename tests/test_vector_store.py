@@ -0,0 +1,94 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from vector_store import EmbeddingStore
+
+
+def make_embeddings_db(path, vectors=()):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+    CREATE TABLE paper_embeddings (
+        id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        abstract TEXT,
+        embedding BLOB,
+        authors TEXT,
+        categories TEXT,
+        year INTEGER
+    )
+    ''')
+    conn.executemany(
+        'INSERT INTO paper_embeddings (id, title, embedding, categories, year) VALUES (?, ?, ?, ?, ?)',
+        [(paper_id, paper_id, np.asarray(vector, dtype=np.float32).tobytes(), 'cs.LG', 2020)
+         for paper_id, vector in vectors]
+    )
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+@pytest.mark.parametrize("precision", ['float32', 'float16', 'int8'])
+def test_empty_store_returns_no_results(tmp_path, precision):
+    store = EmbeddingStore(make_embeddings_db(tmp_path / 'embeddings.db'), precision)
+    store.load()
+    query = np.ones(8, dtype=np.float32)
+
+    assert store.top_k(query, 5) == []
+    assert store.top_k(query, 5, year_range=(2019, None), categories=['cs.LG']) == []
+    assert store.top_k_batch(np.ones((3, 8), dtype=np.float32), 5) == [[], [], []]
+    ids, scores = store.all_scores(query)
+    assert ids == [] and len(scores) == 0
+
+
+def test_all_scores_skips_removed_papers(tmp_path):
+    vectors = [('a', [1, 0, 0]), ('b', [0, 1, 0]), ('c', [1, 1, 0])]
+    store = EmbeddingStore(make_embeddings_db(tmp_path / 'embeddings.db', vectors))
+    store.load()
+    store.remove_many(['b'])
+
+    ids, scores = store.all_scores(np.array([1, 0, 0], dtype=np.float32))
+    assert ids == ['a', 'c']
+    assert scores == pytest.approx([1.0, np.sqrt(0.5)])
+    assert [paper_id for paper_id, _ in store.top_k(np.array([0, 1, 0], dtype=np.float32), 3)] == ['c', 'a']
+
+
+def test_sync_applies_rows_written_by_another_process(tmp_path):
+    db_path = make_embeddings_db(tmp_path / 'embeddings.db', [('a', [1, 0, 0]), ('b', [0, 1, 0])])
+    store = EmbeddingStore(db_path)
+    store.load()
+    assert store.sync(interval=0) == 0
+
+    # Another worker adds c, replaces a and deletes b
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO paper_embeddings (id, title, embedding, categories, year) VALUES ('c', 'c', ?, 'cs.AI', 2021)",
+                 (np.array([0, 0, 1], dtype=np.float32).tobytes(),))
+    conn.execute("INSERT OR REPLACE INTO paper_embeddings (id, title, embedding, categories, year) VALUES ('a', 'a', ?, 'cs.LG', 2020)",
+                 (np.array([0, 1, 1], dtype=np.float32).tobytes(),))
+    conn.execute("DELETE FROM paper_embeddings WHERE id = 'b'")
+    conn.commit()
+    conn.close()
+
+    assert store.sync(interval=3600) == 0
+    assert store.sync(interval=0) == 3
+    results = store.top_k(np.array([0, 0, 1], dtype=np.float32), 3)
+    assert [paper_id for paper_id, _ in results] == ['c', 'a']
+    assert store.top_k(np.array([0, 0, 1], dtype=np.float32), 3, categories=['cs.AI'])[0][0] == 'c'
+    assert store.sync(interval=0) == 0
+
+
+def test_snapshot_appends_into_spare_rows(tmp_path):
+    db_path = make_embeddings_db(tmp_path / 'embeddings.db', [('a', [1, 0, 0]), ('b', [0, 1, 0])])
+    store = EmbeddingStore(db_path)
+    store.load()
+    store.save_snapshot(str(tmp_path / 'snapshot'))
+
+    mapped = EmbeddingStore(db_path)
+    assert mapped.load_snapshot(str(tmp_path / 'snapshot'))
+    matrix = mapped.matrix
+    mapped.upsert('c', np.array([0, 0, 1], dtype=np.float32), 2022, 'cs.AI')
+
+    # Still the copy-on-write mapping, not a heap copy of the whole matrix
+    assert mapped.matrix is matrix and isinstance(mapped.matrix, np.memmap)
+    assert mapped.top_k(np.array([0, 0, 1], dtype=np.float32), 1, year_range=(2022, None)) == [('c', pytest.approx(1.0))]
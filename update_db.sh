@@ -55,6 +55,16 @@ if [ $? -ne 0 ]; then
     exit 1
 fi
 
+# Step 3: Embed only the new or changed papers
+echo -e "${CYAN}Updating embeddings for new or changed papers...${NC}"
+
+python3 embed.py incremental
+
+if [ $? -ne 0 ]; then
+    echo -e "${RED}Error in embed.py incremental${NC}"
+    exit 1
+fi
+
 # Completion message
 echo -e "${GREEN}"
 echo "  ____                      _      _       _ "
@@ -0,0 +1,737 @@
+import os
+import re
+import json
+import time
+import threading
+import numpy as np
+from typing import List, Dict, Optional, Tuple
+
+from db import connect, get_connection
+
+# Rows fetched from SQLite per round trip while loading the matrix
+LOAD_FETCH_SIZE = 10000
+
+# Queries scored per matrix-matrix product in top_k_batch; bounds the
+# (queries x corpus) score matrix to a few hundred MB on a 600k corpus
+QUERY_BATCH_SIZE = 64
+
+# Rows converted to float32 at a time when scoring a quantized matrix
+SCORE_CHUNK_SIZE = 32768
+
+# Quantized searches rescore this many candidates per requested result
+# against the full-precision vectors in SQLite
+RESCORE_FACTOR = 4
+
+PRECISIONS = ('float32', 'float16', 'int8')
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Zero rows saved after the matrix in a snapshot. Papers added after it was
+# written go there, so appending only copies the touched pages of the
+# copy-on-write mapping; once they are used up the next append copies the
+# whole matrix onto this process's heap.
+SNAPSHOT_SPARE_ROWS = int(os.environ.get('PAPERWEB_SNAPSHOT_SPARE_ROWS', '10000'))
+
+# Seconds between checks for rows written to paper_embeddings by other
+# processes (server workers, the embedding updater); see sync()
+SYNC_INTERVAL = float(os.environ.get('PAPERWEB_SYNC_INTERVAL', '30'))
+
+
+def table_fingerprint(cursor) -> List[int]:
+    """
+    [row count, max rowid] of paper_embeddings. INSERT OR REPLACE gives a
+    row a new rowid, so any insert, update or delete changes it.
+    """
+    cursor.execute('SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM paper_embeddings')
+    return list(cursor.fetchone())
+
+
+def split_categories(categories: Optional[str]) -> List[str]:
+    """Split a categories string ("cs.LG cs.AI" or "cs.LG, cs.AI") into lower-case codes."""
+    if not categories:
+        return []
+    return [cat.lower() for cat in re.split(r'[,\s]+', categories) if cat]
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row in place; zero rows are left as zeros."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+class EmbeddingStore:
+    """
+    Process-wide, in-memory copy of every embedding in paper_embeddings.
+
+    The embeddings are kept in one contiguous float32 matrix whose rows are
+    L2-normalized ahead of time, so cosine similarity against the whole corpus
+    is a single matrix-vector product. ids[row] and id_to_row map between
+    matrix rows and paper ids. Publication years and categories are kept
+    alongside the matrix so searches can be filtered without touching SQLite.
+
+    With precision 'float16' or 'int8' (per-dimension scalar quantization)
+    the matrix is stored at 2 or 1 bytes per value. Searches then make a
+    coarse pass over the quantized matrix and rescore a shortlist of
+    RESCORE_FACTOR * k candidates against the float32 BLOBs in SQLite.
+    """
+
+    def __init__(self, db_path: str, precision: str = 'float32'):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+        self.db_path = db_path
+        self.precision = precision
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.dim = 0
+        self.size = 0
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.ids: List[str] = []
+        self.id_to_row: Dict[str, int] = {}
+        self.years = np.zeros(0, dtype=np.int32)
+        self.row_categories: List[List[str]] = []
+        self.category_rows: Dict[str, set] = {}
+        self._category_arrays: Dict[str, np.ndarray] = {}
+        self.ann_index = None
+        self.ann_nprobe = 16
+        self.ann_rows = np.zeros(0, dtype=np.int64)
+        self.uncovered_rows: List[int] = []
+        # Rows of deleted papers; never returned until the next load()
+        self.removed_rows: List[int] = []
+        # int8 only: value ~= q_offset + q_scale * (code + 128)
+        self.q_offset = np.zeros(0, dtype=np.float32)
+        self.q_scale = np.zeros(0, dtype=np.float32)
+        # table_fingerprint() at the time the rows were read
+        self.fingerprint: List[int] = []
+        # time.monotonic() of the last sync() check
+        self.synced_at = 0.0
+
+    @property
+    def quantized(self) -> bool:
+        return self.precision != 'float32'
+
+    def load(self):
+        """(Re)load every embedding from the database into memory."""
+        conn = connect(self.db_path)
+        cursor = conn.cursor()
+
+        try:
+            fingerprint = table_fingerprint(cursor)
+            cursor.execute('SELECT COUNT(*) FROM paper_embeddings WHERE embedding IS NOT NULL')
+            total = cursor.fetchone()[0]
+
+            cursor.execute('''
+            SELECT id, embedding, year, categories FROM paper_embeddings
+            WHERE embedding IS NOT NULL
+            ''')
+
+            # int8 is staged as float16 so the per-dimension ranges can be
+            # computed before quantizing
+            staging_dtype = np.float32 if self.precision == 'float32' else np.float16
+
+            matrix = None
+            ids = []
+            years = []
+            row_categories = []
+            row = 0
+            while True:
+                rows = cursor.fetchmany(LOAD_FETCH_SIZE)
+                if not rows:
+                    break
+
+                vectors = normalize_rows(np.vstack([np.frombuffer(r[1], dtype=np.float32) for r in rows]))
+                if matrix is None:
+                    matrix = np.empty((max(total, len(rows)), vectors.shape[1]), dtype=staging_dtype)
+                if row + len(rows) > matrix.shape[0]:
+                    # Rows were added between the COUNT and the SELECT
+                    matrix = self._grow(matrix, row + len(rows))
+                matrix[row:row+len(rows)] = vectors
+
+                for paper_id, _, year, categories in rows:
+                    ids.append(paper_id)
+                    years.append(year or 0)
+                    row_categories.append(split_categories(categories))
+                row += len(rows)
+        finally:
+            conn.close()
+
+        if matrix is None:
+            matrix = np.zeros((0, self.dim), dtype=staging_dtype)
+
+        q_offset, q_scale = self.q_offset, self.q_scale
+        if self.precision == 'int8':
+            matrix, q_offset, q_scale = self._quantize_int8(matrix, row)
+
+        full_years = np.zeros(matrix.shape[0], dtype=np.int32)
+        full_years[:row] = years
+        self._install(matrix, q_offset, q_scale, row, ids, full_years, row_categories, fingerprint)
+
+        print(f"Loaded {row} embeddings into memory as {self.precision} ({matrix[:row].nbytes / 1e6:.1f} MB)")
+
+    def _install(self, matrix: np.ndarray, q_offset: np.ndarray, q_scale: np.ndarray, size: int,
+                 ids: List[str], years: np.ndarray, row_categories: List[List[str]], fingerprint: List[int]):
+        """Swap in a freshly loaded matrix and its per-row metadata."""
+        category_rows = {}
+        for i, cats in enumerate(row_categories):
+            for cat in cats:
+                category_rows.setdefault(cat, set()).add(i)
+
+        with self.lock:
+            self.matrix = matrix
+            self.q_offset = q_offset
+            self.q_scale = q_scale
+            self.dim = matrix.shape[1]
+            self.size = size
+            self.ids = ids
+            self.id_to_row = {paper_id: i for i, paper_id in enumerate(ids)}
+            self.years = years
+            self.row_categories = row_categories
+            self.category_rows = category_rows
+            self._category_arrays = {}
+            self.removed_rows = []
+            self.fingerprint = fingerprint
+            self.synced_at = time.monotonic()
+            if self.ann_index is not None:
+                self._map_ann_rows()
+            self.loaded = True
+
+    def save_snapshot(self, path: str):
+        """
+        Write the loaded store to path as .npy files that load_snapshot can
+        memory-map, with SNAPSHOT_SPARE_ROWS empty rows after the matrix.
+        """
+        self.ensure_loaded()
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            # Written beside the old file and renamed over it, so processes
+            # still mapping the old matrix keep reading it
+            staging = os.path.join(path, 'matrix.tmp.npy')
+            matrix = np.lib.format.open_memmap(
+                staging, mode='w+', dtype=self.matrix.dtype, shape=(self.size + SNAPSHOT_SPARE_ROWS, self.dim)
+            )
+            matrix[:self.size] = self.matrix[:self.size]
+            matrix.flush()
+            del matrix
+            os.replace(staging, os.path.join(path, 'matrix.npy'))
+            np.save(os.path.join(path, 'years.npy'), self.years[:self.size])
+            np.save(os.path.join(path, 'ids.npy'), np.asarray(self.ids, dtype=str))
+            np.save(os.path.join(path, 'q_offset.npy'), self.q_offset)
+            np.save(os.path.join(path, 'q_scale.npy'), self.q_scale)
+            with open(os.path.join(path, 'categories.json'), 'w') as f:
+                json.dump(self.row_categories[:self.size], f)
+            meta = {
+                "version": SNAPSHOT_FORMAT_VERSION,
+                "precision": self.precision,
+                "size": self.size,
+                "dim": self.dim,
+                "fingerprint": self.fingerprint,
+                "built_at": time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+        # meta.json goes last so a half-written snapshot is never loaded
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def load_snapshot(self, path: str) -> bool:
+        """
+        Map the matrix saved by save_snapshot instead of reading every BLOB.
+        The mapping is copy-on-write: its pages live in the OS page cache and
+        are shared by every process that maps the file (e.g. all server
+        workers), while upsert() only dirties this process's copy of the
+        pages it writes, as long as the snapshot's spare rows last.
+        Returns False, leaving the store untouched, when there is no
+        snapshot or it has another format or precision, or the table has
+        changed since it was written.
+        """
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_FORMAT_VERSION or meta.get("precision") != self.precision:
+            print(f"Embedding snapshot at {path} does not match this store, ignoring it")
+            return False
+
+        conn = connect(self.db_path)
+        try:
+            fingerprint = table_fingerprint(conn.cursor())
+        finally:
+            conn.close()
+        if fingerprint != meta.get("fingerprint"):
+            print(f"Embedding snapshot at {path} is stale")
+            return False
+
+        with open(os.path.join(path, 'categories.json')) as f:
+            row_categories = json.load(f)
+        matrix = np.load(os.path.join(path, 'matrix.npy'), mmap_mode='c')
+        # One year per matrix row, spare rows included
+        years = np.zeros(matrix.shape[0], dtype=np.int32)
+        years[:meta["size"]] = np.load(os.path.join(path, 'years.npy'))
+        self._install(
+            matrix,
+            np.load(os.path.join(path, 'q_offset.npy')),
+            np.load(os.path.join(path, 'q_scale.npy')),
+            meta["size"],
+            np.load(os.path.join(path, 'ids.npy')).tolist(),
+            years,
+            row_categories,
+            fingerprint
+        )
+        print(f"Mapped {meta['size']} embeddings from snapshot {path}")
+        return True
+
+    @staticmethod
+    def _quantize_int8(matrix: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Per-dimension scalar quantization of the first size rows to int8."""
+        if size == 0:
+            dim = matrix.shape[1]
+            return np.zeros((0, dim), dtype=np.int8), np.zeros(dim, dtype=np.float32), np.ones(dim, dtype=np.float32)
+
+        low = matrix[:size].min(axis=0).astype(np.float32)
+        high = matrix[:size].max(axis=0).astype(np.float32)
+        scale = (high - low) / 255.0
+        scale[scale == 0] = 1.0
+
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        for i in range(0, size, SCORE_CHUNK_SIZE):
+            chunk = matrix[i:min(i + SCORE_CHUNK_SIZE, size)].astype(np.float32)
+            codes[i:i+len(chunk)] = np.clip(np.rint((chunk - low) / scale) - 128, -128, 127)
+        return codes, low, scale
+
+    def _encode(self, vector: np.ndarray) -> np.ndarray:
+        """Convert one normalized float32 vector to the matrix's storage format."""
+        if self.precision == 'int8':
+            return np.clip(np.rint((vector - self.q_offset) / self.q_scale) - 128, -128, 127).astype(np.int8)
+        return vector.astype(self.matrix.dtype)
+
+    def _decode(self, block: np.ndarray) -> np.ndarray:
+        """Convert stored rows back to (approximate) float32 vectors."""
+        if self.precision == 'int8':
+            return self.q_offset + self.q_scale * (block.astype(np.float32) + 128)
+        return block.astype(np.float32, copy=False)
+
+    def _score_all(self, queries: np.ndarray) -> np.ndarray:
+        """(n_queries, size) similarity matrix; approximate when quantized."""
+        if self.size == 0 or self.dim == 0:
+            return np.zeros((len(queries), 0), dtype=np.float32)
+        if not self.quantized:
+            return queries @ self.matrix[:self.size].T
+
+        scores = np.empty((len(queries), self.size), dtype=np.float32)
+        if self.precision == 'int8':
+            # q.x ~= q.offset + 128 * sum(q * scale) + (q * scale).code
+            weights = queries * self.q_scale
+            constant = queries @ self.q_offset + 128 * weights.sum(axis=1)
+        for i in range(0, self.size, SCORE_CHUNK_SIZE):
+            block = self.matrix[i:min(i + SCORE_CHUNK_SIZE, self.size)].astype(np.float32)
+            if self.precision == 'int8':
+                scores[:, i:i+len(block)] = weights @ block.T + constant[:, None]
+            else:
+                scores[:, i:i+len(block)] = queries @ block.T
+        return scores
+
+    def _full_precision(self, rows: np.ndarray) -> np.ndarray:
+        """Normalized float32 vectors for the given rows."""
+        if not self.quantized:
+            return self.matrix[rows]
+
+        vectors = np.zeros((len(rows), self.dim), dtype=np.float32)
+        if len(rows) == 0:
+            return vectors
+        position = {self.ids[row]: i for i, row in enumerate(rows)}
+
+        cursor = get_connection(self.db_path).cursor()
+        paper_ids = list(position)
+        for i in range(0, len(paper_ids), 500):
+            chunk = paper_ids[i:i+500]
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'SELECT id, embedding FROM paper_embeddings WHERE id IN ({placeholders})', chunk)
+            for paper_id, blob in cursor.fetchall():
+                vectors[position[paper_id]] = np.frombuffer(blob, dtype=np.float32)
+
+        return normalize_rows(vectors)
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.load()
+
+    @staticmethod
+    def _grow(matrix: np.ndarray, min_rows: int) -> np.ndarray:
+        capacity = max(min_rows, int(matrix.shape[0] * 1.5) + 16)
+        grown = np.empty((capacity, matrix.shape[1]), dtype=matrix.dtype)
+        grown[:matrix.shape[0]] = matrix
+        return grown
+
+    def upsert(self, paper_id: str, embedding: np.ndarray,
+               year: Optional[int] = None, categories: Optional[str] = None):
+        """
+        Insert or replace one paper's vector. Called after rows are written to
+        paper_embeddings so searches see them without a full reload. Does
+        nothing if the store has not been loaded yet, since load() will pick
+        the row up from the database.
+        """
+        if not self.loaded:
+            return
+
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1).copy()
+        normalize_rows(vector)
+
+        with self.lock:
+            if self.size == 0 and self.dim == 0:
+                self.dim = vector.shape[1]
+                self.matrix = np.zeros((0, self.dim), dtype=self.matrix.dtype)
+                if self.precision == 'int8':
+                    self.q_offset = np.full(self.dim, -1.0, dtype=np.float32)
+                    self.q_scale = np.full(self.dim, 2.0 / 255.0, dtype=np.float32)
+
+            row = self.id_to_row.get(paper_id)
+            if row is None:
+                row = self.size
+                if row >= self.matrix.shape[0]:
+                    self.matrix = self._grow(self.matrix, row + 1)
+                    years = np.zeros(self.matrix.shape[0], dtype=np.int32)
+                    years[:self.size] = self.years[:self.size]
+                    self.years = years
+                self.ids.append(paper_id)
+                self.row_categories.append([])
+                self.id_to_row[paper_id] = row
+                self.size += 1
+                if self.ann_index is not None:
+                    self.uncovered_rows.append(row)
+            self.matrix[row] = self._encode(vector[0])
+            self.years[row] = year or 0
+
+            for cat in self.row_categories[row]:
+                self.category_rows.get(cat, set()).discard(row)
+            cats = split_categories(categories)
+            for cat in cats:
+                self.category_rows.setdefault(cat, set()).add(row)
+            self.row_categories[row] = cats
+            self._category_arrays = {}
+
+    def sync(self, interval: float = SYNC_INTERVAL) -> int:
+        """
+        Apply rows written to paper_embeddings by other processes since this
+        store last read the table. Every server worker has its own store and
+        upsert() only reaches the worker that handled the request, so each
+        worker calls this before searching; the table is checked at most
+        once per interval. Replaced rows get a new rowid, so changes are the
+        rows past the fingerprint's max rowid, and a row count that still
+        disagrees afterwards means papers were deleted. Returns the number
+        of rows applied.
+        """
+        if not self.loaded:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            if now - self.synced_at < interval:
+                return 0
+            self.synced_at = now
+            known = self.fingerprint
+
+        conn = connect(self.db_path)
+        cursor = conn.cursor()
+        try:
+            fingerprint = table_fingerprint(cursor)
+            if fingerprint == known:
+                return 0
+            last_rowid = known[1] if known else 0
+            cursor.execute('SELECT COUNT(*) FROM paper_embeddings WHERE rowid > ?', (last_rowid,))
+            if cursor.fetchone()[0] > max(LOAD_FETCH_SIZE, self.size // 10):
+                # Most of the table was rewritten; reading it whole is cheaper
+                self.load()
+                return self.size
+
+            cursor.execute('''
+            SELECT id, embedding, year, categories FROM paper_embeddings
+            WHERE rowid > ? AND embedding IS NOT NULL
+            ''', (last_rowid,))
+            rows = cursor.fetchall()
+            for paper_id, blob, year, categories in rows:
+                self.upsert(paper_id, np.frombuffer(blob, dtype=np.float32), year, categories)
+
+            deleted = []
+            if fingerprint[0] != len(self.id_to_row):
+                stored = {paper_id for paper_id, in cursor.execute('SELECT id FROM paper_embeddings')}
+                with self.lock:
+                    deleted = [paper_id for paper_id in self.id_to_row if paper_id not in stored]
+                self.remove_many(deleted)
+        finally:
+            conn.close()
+
+        with self.lock:
+            self.fingerprint = fingerprint
+        if rows or deleted:
+            print(f"Synced {len(rows)} new and {len(deleted)} deleted embeddings from {self.db_path}")
+        return len(rows) + len(deleted)
+
+    def upsert_many(self, paper_ids: List[str], embeddings: np.ndarray,
+                    years: Optional[List[int]] = None, categories: Optional[List[str]] = None):
+        for i, (paper_id, embedding) in enumerate(zip(paper_ids, embeddings)):
+            self.upsert(paper_id, embedding,
+                        years[i] if years else None,
+                        categories[i] if categories else None)
+
+    def remove_many(self, paper_ids: List[str]):
+        """Forget deleted papers. Their rows stay allocated until the next load()."""
+        if not self.loaded:
+            return
+
+        with self.lock:
+            for paper_id in paper_ids:
+                row = self.id_to_row.pop(paper_id, None)
+                if row is None:
+                    continue
+                for cat in self.row_categories[row]:
+                    self.category_rows.get(cat, set()).discard(row)
+                self.row_categories[row] = []
+                self.removed_rows.append(row)
+            self._category_arrays = {}
+
+    def _rows_for_category(self, category: str) -> np.ndarray:
+        rows = self._category_arrays.get(category)
+        if rows is None:
+            rows = np.fromiter(self.category_rows.get(category, ()), dtype=np.int64)
+            self._category_arrays[category] = rows
+        return rows
+
+    def filter_mask(self, year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                    categories: Optional[List[str]] = None) -> Optional[np.ndarray]:
+        """
+        Boolean mask over stored rows for the given filters, or None when no
+        filter applies. year_range is an inclusive (min, max) pair where either
+        bound may be None; a row matches categories if it has any of them.
+        """
+        mask = None
+
+        if year_range and (year_range[0] is not None or year_range[1] is not None):
+            years = self.years[:self.size]
+            mask = np.ones(self.size, dtype=bool)
+            if year_range[0] is not None:
+                mask &= years >= year_range[0]
+            if year_range[1] is not None:
+                mask &= years <= year_range[1]
+
+        if categories:
+            category_mask = np.zeros(self.size, dtype=bool)
+            for category in categories:
+                category_mask[self._rows_for_category(category.lower())] = True
+            mask = category_mask if mask is None else mask & category_mask
+
+        return mask
+
+    def get_vector(self, paper_id: str) -> Optional[np.ndarray]:
+        """Return the normalized vector for a paper, or None if it is not stored."""
+        self.ensure_loaded()
+        row = self.id_to_row.get(paper_id)
+        if row is None:
+            return None
+        return self._full_precision(np.array([row]))[0]
+
+    def attach_ann_index(self, index, nprobe: int = 16):
+        """
+        Route unfiltered top_k calls through an approximate index. Rows the
+        index does not know about (added after it was built) are still scored
+        exactly on every query, so new papers are never missed.
+        """
+        self.ensure_loaded()
+        with self.lock:
+            self.ann_index = index
+            self.ann_nprobe = nprobe
+            self._map_ann_rows()
+
+    def _map_ann_rows(self):
+        index_ids = self.ann_index.ids
+        self.ann_rows = np.fromiter(
+            (self.id_to_row.get(str(paper_id), -1) for paper_id in index_ids),
+            dtype=np.int64,
+            count=len(index_ids)
+        )
+        covered = np.zeros(self.size, dtype=bool)
+        covered[self.ann_rows[self.ann_rows >= 0]] = True
+        self.uncovered_rows = list(np.nonzero(~covered)[0])
+
+    def get_vectors(self, paper_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Look up several normalized vectors at once. Returns (vectors, found)
+        where found[i] is False for ids that are not stored; their rows in
+        vectors are zeros.
+        """
+        self.ensure_loaded()
+        with self.lock:
+            rows = np.array([self.id_to_row.get(paper_id, -1) for paper_id in paper_ids], dtype=np.int64)
+            found = rows >= 0
+            vectors = np.zeros((len(paper_ids), self.dim), dtype=np.float32)
+            vectors[found] = self._full_precision(rows[found])
+            return vectors, found
+
+    @staticmethod
+    def _select_top(scores: np.ndarray, k: int) -> np.ndarray:
+        """Positions of the k largest scores, best first."""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top])]
+
+    def _exclude_rows(self, exclude_ids: Optional[set]) -> List[int]:
+        if not exclude_ids:
+            return list(self.removed_rows)
+        return self.removed_rows + [self.id_to_row[paper_id] for paper_id in exclude_ids if paper_id in self.id_to_row]
+
+    def top_k(self, query: np.ndarray, k: int = 10,
+              exclude_ids: Optional[set] = None,
+              year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+              categories: Optional[List[str]] = None,
+              exact: bool = False, nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Return the k most similar papers to the query vector as
+        (paper_id, cosine similarity) pairs, best first. Papers in exclude_ids
+        or outside the year/category filters are never returned.
+
+        When an ANN index is attached, unfiltered queries use it unless exact
+        is set; nprobe overrides the index's default speed/recall trade-off.
+        Filtered queries always scan exactly.
+        """
+        self.ensure_loaded()
+
+        query = np.asarray(query, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        with self.lock:
+            # An empty paper_embeddings table leaves no dimension to score against
+            if self.size == 0 or self.dim == 0:
+                return []
+            mask = self.filter_mask(year_range, categories)
+            excluded = self._exclude_rows(exclude_ids)
+
+            if self.ann_index is not None and mask is None and not exact:
+                rows = self._ann_candidates(query, k + len(excluded), nprobe or self.ann_nprobe)
+                scores = self._decode(self.matrix[rows]) @ query
+            else:
+                rows = None
+                scores = self._score_all(query.reshape(1, -1))[0]
+                if mask is not None:
+                    scores[~mask] = -np.inf
+
+            if excluded:
+                if rows is None:
+                    scores[excluded] = -np.inf
+                else:
+                    scores[np.isin(rows, excluded)] = -np.inf
+
+            return self._best(query, scores, rows, k)
+
+    def _best(self, query: np.ndarray, scores: np.ndarray,
+              rows: Optional[np.ndarray], k: int) -> List[Tuple[str, float]]:
+        """
+        Pick the k best (id, score) pairs from scores over rows (all rows when
+        None), rescoring a shortlist at full precision if the matrix is quantized.
+        """
+        if self.quantized:
+            shortlist = self._select_top(scores, RESCORE_FACTOR * k)
+            shortlist = shortlist[scores[shortlist] != -np.inf]
+            rows = shortlist if rows is None else rows[shortlist]
+            scores = self._full_precision(rows) @ query
+        elif rows is None:
+            top = self._select_top(scores, k)
+            return [(self.ids[row], float(scores[row])) for row in top if scores[row] != -np.inf]
+
+        top = self._select_top(scores, k)
+        return [(self.ids[rows[i]], float(scores[i])) for i in top if scores[i] != -np.inf]
+
+    def top_k_batch(self, queries: np.ndarray, k: int = 10,
+                    exclude_ids: Optional[List[Optional[set]]] = None,
+                    year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                    categories: Optional[List[str]] = None,
+                    exact: bool = False) -> List[List[Tuple[str, float]]]:
+        """
+        top_k for N queries at once. Exact scoring is done with one
+        matrix-matrix product per QUERY_BATCH_SIZE queries instead of N
+        matrix-vector products. exclude_ids, if given, has one set per query.
+        """
+        self.ensure_loaded()
+
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        if exclude_ids is None:
+            exclude_ids = [None] * len(queries)
+
+        with self.lock:
+            if self.size == 0 or self.dim == 0:
+                return [[] for _ in range(len(queries))]
+            mask = self.filter_mask(year_range, categories)
+            if self.ann_index is not None and mask is None and not exact:
+                return [self.top_k(query, k, excluded) for query, excluded in zip(queries, exclude_ids)]
+
+            queries = normalize_rows(queries.copy())
+            results = []
+            for start in range(0, len(queries), QUERY_BATCH_SIZE):
+                chunk = queries[start:start+QUERY_BATCH_SIZE]
+                # (chunk, size) so each query's scores are a contiguous row
+                scores = self._score_all(chunk)
+                if mask is not None:
+                    scores[:, ~mask] = -np.inf
+
+                for i in range(len(chunk)):
+                    row_scores = scores[i]
+                    if not chunk[i].any():
+                        results.append([])
+                        continue
+                    excluded = self._exclude_rows(exclude_ids[start + i])
+                    if excluded:
+                        row_scores[excluded] = -np.inf
+                    results.append(self._best(chunk[i], row_scores, None, k))
+            return results
+
+    def _ann_candidates(self, query: np.ndarray, k: int, nprobe: int) -> np.ndarray:
+        """Store rows to rescore exactly: the index's top hits plus uncovered rows."""
+        # Over-fetch a little so stale index vectors can be corrected by rescoring
+        positions, _ = self.ann_index.search(query, 2 * k, nprobe)
+        rows = self.ann_rows[positions]
+        rows = rows[rows >= 0]
+        if self.uncovered_rows:
+            rows = np.concatenate([rows, np.asarray(self.uncovered_rows, dtype=np.int64)])
+        return np.unique(rows)
+
+    def all_scores(self, query: np.ndarray) -> Tuple[List[str], np.ndarray]:
+        """Return (ids, similarities) for every stored paper, except removed ones."""
+        self.ensure_loaded()
+
+        query = np.asarray(query, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm != 0:
+            query = query / norm
+
+        with self.lock:
+            scores = self._score_all(query.reshape(1, -1))[0]
+            if not self.removed_rows:
+                return list(self.ids), scores
+            # Same rows top_k never returns: deleted papers awaiting the next load()
+            kept = np.ones(self.size, dtype=bool)
+            kept[self.removed_rows] = False
+            rows = np.nonzero(kept)[0]
+            return [self.ids[row] for row in rows], scores[rows]
+
+
+_stores: Dict[Tuple[str, str], EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(db_path: str, precision: str = 'float32') -> EmbeddingStore:
+    """Return the process-wide store for an embeddings database."""
+    with _stores_lock:
+        store = _stores.get((db_path, precision))
+        if store is None:
+            store = EmbeddingStore(db_path, precision)
+            _stores[(db_path, precision)] = store
+        return store
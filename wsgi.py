@@ -0,0 +1,59 @@
+"""
+Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+
+Importing this module warms every process-wide structure before the server
+accepts traffic. With preload_app (the default in gunicorn.conf.py) that
+happens once in the master, and workers inherit it on fork: the vector
+store and citation graph are memory-mapped files shared through the page
+cache, the model weights and ranking matrices are shared copy-on-write.
+"""
+import gc
+import os
+import time
+
+from api import app, DB_PATH
+from db import close_connections
+from embed import load_model, load_store_snapshot, get_search_store, generate_embeddings
+from get_connections import ensure_citations_table, get_connections_cache
+from graph_ranking import get_graph_ranker
+from paper_search import ensure_papers_fts, ensure_paper_categories
+
+# Load the model in the master so workers share its weights. Turn off when
+# it runs on a GPU: a CUDA context does not survive fork.
+PRELOAD_MODEL = os.environ.get('PAPERWEB_PRELOAD_MODEL', '1') == '1'
+
+
+def warm_up():
+    start = time.time()
+
+    ensure_citations_table(DB_PATH)
+    ensure_papers_fts(DB_PATH)
+    ensure_paper_categories(DB_PATH)
+    get_connections_cache(DB_PATH)
+
+    if PRELOAD_MODEL:
+        load_model()
+    load_store_snapshot()
+    get_search_store()
+    get_graph_ranker(DB_PATH).refresh()
+
+    # Workers open their own connections; don't hand them the master's
+    close_connections()
+    # Keep the collector from touching (and so copying) everything loaded so far
+    gc.freeze()
+    print(f"Warmed up in {time.time() - start:.1f}s")
+
+
+def warm_worker():
+    """
+    Per-worker warm-up after fork. The first forward pass (torch thread
+    pools, lazy kernels) is run here rather than in the master, since
+    forking after torch has started its threads can deadlock the child.
+    """
+    start = time.time()
+    load_model()
+    generate_embeddings(["warm up"])
+    print(f"Worker {os.getpid()} ready in {time.time() - start:.1f}s")
+
+
+warm_up()